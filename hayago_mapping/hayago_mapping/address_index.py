@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+Local reverse geocoding over addresses we already know.
+
+Every address resolved through Nominatim (the Geocode Cache) and every Trip
+pickup/dropoff address is kept in a per-process lat/lng grid, so a pin drop
+close to a known place is answered without leaving the server. The index is
+built on first use per site, extended as this worker resolves new addresses,
+and picks up rows written by other workers every ADDRESS_REFRESH_SECONDS.
+"""
+
+from __future__ import unicode_literals
+import frappe
+import json
+import math
+import threading
+import time
+from .utils import get_bounding_box, haversine_distance
+
+# Grid cell size in degrees (~110m of latitude)
+ADDRESS_CELL_DEGREES = 0.001
+
+# How often a worker pulls addresses written by other workers
+ADDRESS_REFRESH_SECONDS = 60
+
+# Used when Module Settings leaves the match distance empty
+DEFAULT_REVERSE_MATCH_METERS = 50
+
+_address_indexes = {}
+_address_indexes_lock = threading.Lock()
+
+class AddressIndex(object):
+	def __init__(self, cell_degrees=ADDRESS_CELL_DEGREES):
+		self.cell_degrees = cell_degrees
+		self.cells = {}
+		self.known = set()
+		self.last_geocode_modified = None
+		self.last_trip_modified = None
+		self.refreshed_at = 0
+		self.lock = threading.RLock()
+
+	def __len__(self):
+		return len(self.known)
+
+	def get_cell(self, latitude, longitude):
+		return (int(math.floor(latitude / self.cell_degrees)), int(math.floor(longitude / self.cell_degrees)))
+
+	def add(self, latitude, longitude, address, address_details=None):
+		"""Index an address at a point; repeats of the same place are ignored"""
+		if not address or latitude is None or longitude is None:
+			return False
+
+		latitude, longitude = float(latitude), float(longitude)
+		key = (round(latitude, 6), round(longitude, 6), address)
+
+		with self.lock:
+			if key in self.known:
+				return False
+
+			self.known.add(key)
+			self.cells.setdefault(self.get_cell(latitude, longitude), []).append(
+				(latitude, longitude, address, address_details or {}))
+
+		return True
+
+	def nearest(self, latitude, longitude, max_distance_m):
+		"""The closest known address within `max_distance_m`, or None.
+
+		Returns a dict with address, address_details and distance (meters).
+		"""
+		radius_km = max_distance_m / 1000.0
+		box = get_bounding_box(latitude, longitude, radius_km)
+		min_row, min_col = self.get_cell(box["min_lat"], box["min_lon"])
+		max_row, max_col = self.get_cell(box["max_lat"], box["max_lon"])
+
+		best = None
+		best_distance = radius_km
+		with self.lock:
+			for row in range(min_row, max_row + 1):
+				for col in range(min_col, max_col + 1):
+					for entry in self.cells.get((row, col), ()):
+						distance = haversine_distance(latitude, longitude, entry[0], entry[1])
+						if distance <= best_distance:
+							best, best_distance = entry, distance
+
+		if not best:
+			return None
+
+		return {
+			"address": best[2],
+			"address_details": best[3],
+			"distance": best_distance * 1000
+		}
+
+	def rebuild(self):
+		"""Load every known address from the database"""
+		with self.lock:
+			self.cells = {}
+			self.known = set()
+			self.last_geocode_modified = None
+			self.last_trip_modified = None
+			self.refresh()
+
+	def refresh(self):
+		"""Add addresses resolved or used by trips since the last load"""
+		geocoded = frappe.db.sql("""
+			SELECT latitude, longitude, display_name, response, modified
+			FROM `tabGeocode Cache`
+			WHERE not_found = 0 AND latitude IS NOT NULL AND modified >= %s
+		""", (self.last_geocode_modified or "1900-01-01",), as_dict=True)
+
+		trips = frappe.db.sql("""
+			SELECT pickup_latitude, pickup_longitude, pickup_address,
+				dropoff_latitude, dropoff_longitude, dropoff_address, modified
+			FROM `tabTrip`
+			WHERE modified >= %s
+		""", (self.last_trip_modified or "1900-01-01",), as_dict=True)
+
+		with self.lock:
+			for row in geocoded:
+				self.add(row.latitude, row.longitude, row.display_name, json.loads(row.response).get("address_details"))
+				self.last_geocode_modified = max(self.last_geocode_modified or row.modified, row.modified)
+
+			for trip in trips:
+				self.add(trip.pickup_latitude, trip.pickup_longitude, trip.pickup_address)
+				self.add(trip.dropoff_latitude, trip.dropoff_longitude, trip.dropoff_address)
+				self.last_trip_modified = max(self.last_trip_modified or trip.modified, trip.modified)
+
+			self.refreshed_at = time.monotonic()
+
+def get_address_index():
+	"""Return this process's index for the current site, loading or refreshing it as needed"""
+	site = getattr(frappe.local, "site", None)
+
+	with _address_indexes_lock:
+		index = _address_indexes.get(site)
+		if index is None:
+			index = _address_indexes[site] = AddressIndex()
+			index.rebuild()
+			return index
+
+	if time.monotonic() - index.refreshed_at >= ADDRESS_REFRESH_SECONDS:
+		index.refresh()
+
+	return index
+
+def add_known_address(latitude, longitude, address, address_details=None):
+	"""Add a newly resolved address to this process's index, if it is loaded"""
+	index = _address_indexes.get(getattr(frappe.local, "site", None))
+	if index is not None:
+		index.add(latitude, longitude, address, address_details)
@@ -3,16 +3,39 @@
 # For license information, please see license.txt
 
 from __future__ import unicode_literals
+import base64
 import frappe
 import json
 import requests
 from frappe import _
+from frappe.utils import get_datetime
+from hayago_mapping.hayago_mapping.address_index import DEFAULT_REVERSE_MATCH_METERS, add_known_address, get_address_index
+from hayago_mapping.hayago_mapping.autocomplete import MAX_SUGGESTIONS, get_autocomplete_index
+from hayago_mapping.hayago_mapping.doctype.geocode_cache.geocode_cache import (
+	geocode_cache,
+	get_geocode_ttl,
+	get_reverse_query,
+	normalize_address
+)
+from hayago_mapping.hayago_mapping.fleet_index import get_fleet_index
+from hayago_mapping.hayago_mapping.http_client import get_upstream_stats, nominatim
+from hayago_mapping.hayago_mapping.utils import get_module_settings
+
+# Page size of get_driver_location_history, and the most a caller may ask for
+LOCATION_HISTORY_LIMIT = 1000
+LOCATION_HISTORY_MAX_LIMIT = 5000
 
 @frappe.whitelist(allow_guest=True)
 def geocode_address(address):
 	"""Geocode an address using Nominatim API"""
 	try:
-		settings = frappe.get_single("Module Settings")
+		query = normalize_address(address)
+		cached = geocode_cache.get("Forward", query)
+		if cached is not None:
+			return cached
+		
+		geocode_cache.count("misses")
+		settings = get_module_settings()
 		nominatim_url = settings.nominatim_url or "https://nominatim.openstreetmap.org/"
 		
 		# Ensure URL ends with /
@@ -28,24 +51,23 @@ def geocode_address(address):
 			'addressdetails': 1
 		}
 		
-		headers = {
-			'User-Agent': 'Hayago Mapping Module/1.0 (Frappe Framework)'
-		}
-		
-		response = requests.get(search_url, params=params, headers=headers, timeout=10)
+		response = nominatim.get(search_url, params=params, timeout=10)
 		response.raise_for_status()
 		
 		results = response.json()
 		
 		if not results:
-			return {
+			geocoded = {
 				"status": "error",
 				"message": "Address not found"
 			}
+			geocode_cache.set("Forward", query, geocoded, get_geocode_ttl(settings, not_found=True), not_found=True)
+			frappe.db.commit()
+			return geocoded
 		
 		result = results[0]
 		
-		return {
+		geocoded = {
 			"status": "success",
 			"latitude": float(result['lat']),
 			"longitude": float(result['lon']),
@@ -53,6 +75,14 @@ def geocode_address(address):
 			"address_details": result.get('address', {})
 		}
 		
+		# Guest geocoding arrives as GET, which Frappe does not auto-commit
+		geocode_cache.set("Forward", query, geocoded, get_geocode_ttl(settings),
+			latitude=geocoded["latitude"], longitude=geocoded["longitude"], display_name=geocoded["display_name"])
+		frappe.db.commit()
+		add_known_address(geocoded["latitude"], geocoded["longitude"], geocoded["display_name"], geocoded["address_details"])
+		
+		return geocoded
+		
 	except requests.RequestException as e:
 		frappe.log_error(f"Nominatim API Error: {str(e)}", "Geocoding Error")
 		return {
@@ -70,7 +100,31 @@ def geocode_address(address):
 def reverse_geocode(latitude, longitude):
 	"""Reverse geocode coordinates to get address using Nominatim API"""
 	try:
-		settings = frappe.get_single("Module Settings")
+		query = get_reverse_query(latitude, longitude)
+		cached = geocode_cache.get("Reverse", query)
+		if cached is not None:
+			return cached
+		
+		settings = get_module_settings()
+		
+		# Most pins land on a place we have already resolved or driven to.
+		# Known addresses include customers' trip addresses, so not for guests
+		match_distance = settings.reverse_geocode_match_distance
+		if match_distance is None:
+			match_distance = DEFAULT_REVERSE_MATCH_METERS
+		
+		if match_distance > 0 and frappe.session.user != "Guest":
+			known = get_address_index().nearest(float(latitude), float(longitude), match_distance)
+			if known:
+				geocode_cache.count("local_hits")
+				return {
+					"status": "success",
+					"address": known["address"],
+					"address_details": known["address_details"],
+					"source": "local"
+				}
+		
+		geocode_cache.count("misses")
 		nominatim_url = settings.nominatim_url or "https://nominatim.openstreetmap.org/"
 		
 		# Ensure URL ends with /
@@ -86,27 +140,33 @@ def reverse_geocode(latitude, longitude):
 			'addressdetails': 1
 		}
 		
-		headers = {
-			'User-Agent': 'Hayago Mapping Module/1.0 (Frappe Framework)'
-		}
-		
-		response = requests.get(reverse_url, params=params, headers=headers, timeout=10)
+		response = nominatim.get(reverse_url, params=params, timeout=10)
 		response.raise_for_status()
 		
 		result = response.json()
 		
 		if 'error' in result:
-			return {
+			geocoded = {
 				"status": "error",
 				"message": result['error']
 			}
+			geocode_cache.set("Reverse", query, geocoded, get_geocode_ttl(settings, not_found=True), not_found=True)
+			frappe.db.commit()
+			return geocoded
 		
-		return {
+		geocoded = {
 			"status": "success",
 			"address": result['display_name'],
 			"address_details": result.get('address', {})
 		}
 		
+		geocode_cache.set("Reverse", query, geocoded, get_geocode_ttl(settings),
+			latitude=float(latitude), longitude=float(longitude), display_name=geocoded["address"])
+		frappe.db.commit()
+		add_known_address(latitude, longitude, geocoded["address"], geocoded["address_details"])
+		
+		return geocoded
+		
 	except requests.RequestException as e:
 		frappe.log_error(f"Nominatim API Error: {str(e)}", "Reverse Geocoding Error")
 		return {
@@ -120,54 +180,65 @@ def reverse_geocode(latitude, longitude):
 			"message": str(e)
 		}
 
+@frappe.whitelist()
+def suggest_addresses(query, limit=5):
+	"""Autocomplete an address from previously geocoded and trip addresses.
+
+	Not open to guests: trip addresses are where customers were picked up
+	and dropped off.
+	"""
+	try:
+		limit = min(max(int(limit), 1), MAX_SUGGESTIONS)
+		suggestions = get_autocomplete_index().suggest(query, limit)
+		
+		return {
+			"status": "success",
+			"suggestions": [{
+				"address": suggestion["address"],
+				"latitude": suggestion["latitude"],
+				"longitude": suggestion["longitude"]
+			} for suggestion in suggestions]
+		}
+		
+	except Exception as e:
+		frappe.log_error(frappe.get_traceback(), "Address Suggestion Error")
+		return {
+			"status": "error",
+			"message": str(e)
+		}
+
+@frappe.whitelist()
+def get_geocode_cache_stats():
+	"""Geocoding cache hits per tier and the share of lookups sent to Nominatim"""
+	frappe.only_for("System Manager")
+	
+	return {
+		"status": "success",
+		"stats": geocode_cache.get_stats()
+	}
+
+@frappe.whitelist()
+def get_upstream_service_stats():
+	"""Request latency histograms, error counts and circuit state for GraphHopper and Nominatim"""
+	frappe.only_for("System Manager")
+	
+	return {
+		"status": "success",
+		"upstreams": get_upstream_stats()
+	}
+
 @frappe.whitelist()
 def find_nearby_drivers(latitude, longitude, radius=None):
 	"""Find drivers within a specified radius of a location"""
 	try:
-		settings = frappe.get_single("Module Settings")
+		settings = get_module_settings()
 		search_radius = float(radius) if radius else settings.nearby_driver_radius or 5.0
 		
-		# Get recent driver locations (within last 5 minutes)
-		sql_query = """
-			SELECT 
-				dl.driver,
-				dl.latitude,
-				dl.longitude,
-				dl.timestamp,
-				dl.speed,
-				u.full_name as driver_name,
-				u.mobile_no as driver_mobile,
-				(
-					6371 * acos(
-						cos(radians(%s)) * cos(radians(dl.latitude)) *
-						cos(radians(dl.longitude) - radians(%s)) +
-						sin(radians(%s)) * sin(radians(dl.latitude))
-					)
-				) AS distance
-			FROM `tabDriver Location` dl
-			LEFT JOIN `tabUser` u ON dl.driver = u.name
-			WHERE dl.timestamp >= DATE_SUB(NOW(), INTERVAL 5 MINUTE)
-			HAVING distance <= %s
-			ORDER BY distance ASC
-			LIMIT 20
-		"""
-		
-		drivers = frappe.db.sql(sql_query, 
-			(latitude, longitude, latitude, search_radius), 
-			as_dict=True
-		)
-		
-		# Check driver availability (not currently on a trip)
-		available_drivers = []
-		for driver in drivers:
-			# Check if driver has any active trips
-			active_trips = frappe.db.count("Trip", {
-				"driver": driver.driver,
-				"status": ["in", ["Accepted", "On Route"]]
-			})
-			
-			if active_trips == 0:
-				available_drivers.append(driver)
+		# Closest available drivers, fresh within the last 5 minutes, served
+		# from this worker's in-memory fleet index. Availability is kept on
+		# Driver Position by Trip updates, so filtering happens before the limit
+		available_drivers = get_fleet_index().nearest(float(latitude), float(longitude), 20, search_radius,
+			condition=lambda driver: driver.get("is_available", 1))
 		
 		return {
 			"status": "success",
@@ -183,7 +254,7 @@ def find_nearby_drivers(latitude, longitude, radius=None):
 		}
 
 @frappe.whitelist()
-def update_driver_location_api(driver, latitude, longitude, speed=None, heading=None, accuracy=None, is_offline=0, trip=None):
+def update_driver_location_api(driver, latitude, longitude, speed=None, heading=None, accuracy=None, is_offline=0, trip=None, timestamp=None):
 	"""API endpoint to update driver location - wrapper for the DocType method"""
 	from hayago_mapping.hayago_mapping.doctype.driver_location.driver_location import update_driver_location
 	
@@ -195,15 +266,74 @@ def update_driver_location_api(driver, latitude, longitude, speed=None, heading=
 		heading=heading,
 		accuracy=accuracy,
 		is_offline=is_offline,
-		trip=trip
+		trip=trip,
+		timestamp=timestamp
 	)
 
 @frappe.whitelist()
-def get_driver_location_history(driver, hours=24):
-	"""Get driver location history for the specified number of hours"""
+def update_driver_locations_batch(locations):
+	"""Insert many driver locations (possibly for many drivers) in one transaction.
+
+	`locations` is a list (or JSON string) of objects with the same keys as
+	`update_driver_location_api`. `results` has one entry per location: 1 if
+	it was stored, otherwise the error message.
+	"""
+	from hayago_mapping.hayago_mapping.doctype.driver_location.driver_location import bulk_insert_driver_locations
+
 	try:
+		if isinstance(locations, str):
+			locations = json.loads(locations)
+
+		if not isinstance(locations, list):
+			return {"status": "error", "message": "Locations must be a list"}
+
+		frappe.has_permission("Driver Location", "create", throw=True)
+
+		results = [1 if name else error for name, error in bulk_insert_driver_locations(locations)]
+		frappe.db.commit()
+
+		inserted = sum(1 for result in results if result == 1)
+
+		return {
+			"status": "success",
+			"inserted": inserted,
+			"failed": len(results) - inserted,
+			"results": results
+		}
+
+	except frappe.PermissionError:
+		raise
+	except Exception as e:
+		frappe.db.rollback()
+		frappe.log_error(frappe.get_traceback(), "Driver Location Batch Update Error")
+		return {
+			"status": "error",
+			"message": str(e)
+		}
+
+@frappe.whitelist()
+def get_driver_location_history(driver, hours=24, limit=LOCATION_HISTORY_LIMIT, cursor=None):
+	"""Get driver location history for the specified number of hours.
+
+	Newest first, `limit` rows per page. Pass the returned `next_cursor` as
+	`cursor` for the next page; it is None on the last one. Pages are found
+	by (timestamp, name) rather than OFFSET, so deep pages are as cheap as
+	the first.
+	"""
+	try:
+		limit = max(1, min(int(limit), LOCATION_HISTORY_MAX_LIMIT))
+		
+		conditions = ""
+		values = {"driver": driver, "hours": int(hours), "limit": limit + 1}
+		if cursor:
+			values["cursor_timestamp"], values["cursor_name"] = decode_history_cursor(cursor)
+			conditions = """
+			AND (timestamp < %(cursor_timestamp)s
+				OR (timestamp = %(cursor_timestamp)s AND name < %(cursor_name)s))"""
+		
 		sql_query = """
 			SELECT 
+				name,
 				timestamp,
 				latitude,
 				longitude,
@@ -213,20 +343,32 @@ def get_driver_location_history(driver, hours=24):
 				is_offline,
 				trip
 			FROM `tabDriver Location`
-			WHERE driver = %s
-			AND timestamp >= DATE_SUB(NOW(), INTERVAL %s HOUR)
-			ORDER BY timestamp DESC
-			LIMIT 1000
-		"""
+			WHERE driver = %(driver)s
+			AND timestamp >= DATE_SUB(NOW(), INTERVAL %(hours)s HOUR){0}
+			ORDER BY timestamp DESC, name DESC
+			LIMIT %(limit)s
+		""".format(conditions)
 		
-		locations = frappe.db.sql(sql_query, (driver, int(hours)), as_dict=True)
+		locations = frappe.db.sql(sql_query, values, as_dict=True)
+		
+		# One extra row tells whether another page follows
+		next_cursor = None
+		if len(locations) > limit:
+			locations = locations[:limit]
+			next_cursor = encode_history_cursor(locations[-1])
 		
 		return {
 			"status": "success",
 			"locations": locations,
-			"count": len(locations)
+			"count": len(locations),
+			"next_cursor": next_cursor
 		}
 		
+	except ValueError as e:
+		return {
+			"status": "error",
+			"message": str(e)
+		}
 	except Exception as e:
 		frappe.log_error(frappe.get_traceback(), "Get Driver Location History Error")
 		return {
@@ -234,6 +376,19 @@ def get_driver_location_history(driver, hours=24):
 			"message": str(e)
 		}
 
+def encode_history_cursor(location):
+	"""Opaque cursor for the history page after `location`"""
+	raw = json.dumps([str(location.timestamp), location.name], separators=(",", ":"))
+	return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_history_cursor(cursor):
+	"""(timestamp, name) from a history cursor; raises ValueError if malformed"""
+	try:
+		timestamp, name = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+		return get_datetime(timestamp), name
+	except (TypeError, ValueError, UnicodeDecodeError):
+		raise ValueError("Invalid cursor")
+
 @frappe.whitelist()
 def get_active_trips():
 	"""Get all active trips with driver and customer information"""
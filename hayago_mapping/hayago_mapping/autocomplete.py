@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+Address autocomplete over our own geocoding history and trip addresses.
+
+Each distinct address is stored once with a popularity weight (how many
+geocoding results and trip pickups/dropoffs used it). Words are kept in a
+sorted vocabulary so every word of the typed query is matched as a prefix
+with a binary search, and the matching addresses are ranked by weight. The
+index is built per site on first use and extended with rows created since
+the last load every AUTOCOMPLETE_REFRESH_SECONDS.
+"""
+
+from __future__ import unicode_literals
+import bisect
+import frappe
+import heapq
+import re
+import threading
+import time
+from hayago_mapping.hayago_mapping.doctype.geocode_cache.geocode_cache import normalize_address
+
+# How often a worker pulls addresses created by other workers
+AUTOCOMPLETE_REFRESH_SECONDS = 60
+
+# Shorter queries match too much to be useful
+MIN_QUERY_LENGTH = 3
+
+MAX_SUGGESTIONS = 20
+
+_autocomplete_indexes = {}
+_autocomplete_indexes_lock = threading.Lock()
+
+def tokenize(text):
+	return re.findall(r"\w+", text, re.UNICODE)
+
+class AutocompleteIndex(object):
+	def __init__(self):
+		self.entries = []
+		self.ids = {}
+		self.words = []
+		self.new_words = []
+		self.postings = {}
+		self.last_geocode_created = None
+		self.last_trip_created = None
+		self.refreshed_at = 0
+		self.lock = threading.RLock()
+
+	def __len__(self):
+		return len(self.entries)
+
+	def add(self, address, latitude=None, longitude=None, weight=1):
+		"""Index an address, or add `weight` to its popularity if already known"""
+		key = normalize_address(address)
+		if not key:
+			return
+
+		with self.lock:
+			entry_id = self.ids.get(key)
+			if entry_id is not None:
+				entry = self.entries[entry_id]
+				entry["weight"] += weight
+				if entry["latitude"] is None and latitude is not None:
+					entry["latitude"], entry["longitude"] = latitude, longitude
+				return
+
+			entry_id = self.ids[key] = len(self.entries)
+			self.entries.append({
+				"address": address,
+				"latitude": latitude,
+				"longitude": longitude,
+				"weight": weight
+			})
+
+			for word in set(tokenize(key)):
+				postings = self.postings.get(word)
+				if postings is None:
+					postings = self.postings[word] = set()
+					self.new_words.append(word)
+				postings.add(entry_id)
+
+	def suggest(self, query, limit=5):
+		"""Most popular addresses containing a word starting with each query word"""
+		words = tokenize(normalize_address(query))
+		if len("".join(words)) < MIN_QUERY_LENGTH:
+			return []
+
+		with self.lock:
+			# Sorting once per batch of new words is much cheaper than insort
+			if self.new_words:
+				self.words.extend(self.new_words)
+				self.words.sort()
+				self.new_words = []
+
+			# Match the most selective word first so the intersection stays small
+			matches = sorted((self._match_prefix(word) for word in set(words)), key=len)
+			candidates = matches[0]
+			for match in matches[1:]:
+				candidates = candidates & match
+				if not candidates:
+					break
+
+			best = heapq.nlargest(int(limit), candidates,
+				key=lambda entry_id: (self.entries[entry_id]["weight"], -len(self.entries[entry_id]["address"])))
+
+			return [dict(self.entries[entry_id]) for entry_id in best]
+
+	def rebuild(self):
+		"""Load every known address from the database"""
+		with self.lock:
+			self.entries = []
+			self.ids = {}
+			self.words = []
+			self.new_words = []
+			self.postings = {}
+			self.last_geocode_created = None
+			self.last_trip_created = None
+			self.refresh()
+
+	def refresh(self):
+		"""Add geocoding results and trips created since the last load"""
+		geocoded = frappe.db.sql("""
+			SELECT display_name, latitude, longitude, creation
+			FROM `tabGeocode Cache`
+			WHERE not_found = 0 AND IFNULL(display_name, '') != '' AND creation > %s
+		""", (self.last_geocode_created or "1900-01-01",), as_dict=True)
+
+		trips = frappe.db.sql("""
+			SELECT pickup_address, pickup_latitude, pickup_longitude,
+				dropoff_address, dropoff_latitude, dropoff_longitude, creation
+			FROM `tabTrip`
+			WHERE creation > %s
+		""", (self.last_trip_created or "1900-01-01",), as_dict=True)
+
+		with self.lock:
+			for row in geocoded:
+				self.add(row.display_name, row.latitude, row.longitude)
+				self.last_geocode_created = max(self.last_geocode_created or row.creation, row.creation)
+
+			for trip in trips:
+				self.add(trip.pickup_address, trip.pickup_latitude, trip.pickup_longitude)
+				self.add(trip.dropoff_address, trip.dropoff_latitude, trip.dropoff_longitude)
+				self.last_trip_created = max(self.last_trip_created or trip.creation, trip.creation)
+
+			self.refreshed_at = time.monotonic()
+
+	def _match_prefix(self, prefix):
+		start = bisect.bisect_left(self.words, prefix)
+		end = bisect.bisect_left(self.words, prefix + "\uffff", start)
+
+		if end - start == 1:
+			return self.postings[self.words[start]]
+
+		matched = set()
+		for word in self.words[start:end]:
+			matched.update(self.postings[word])
+		return matched
+
+def get_autocomplete_index():
+	"""Return this process's index for the current site, loading or refreshing it as needed"""
+	site = getattr(frappe.local, "site", None)
+
+	with _autocomplete_indexes_lock:
+		index = _autocomplete_indexes.get(site)
+		if index is None:
+			index = _autocomplete_indexes[site] = AutocompleteIndex()
+			index.rebuild()
+			return index
+
+	if time.monotonic() - index.refreshed_at >= AUTOCOMPLETE_REFRESH_SECONDS:
+		index.refresh()
+
+	return index
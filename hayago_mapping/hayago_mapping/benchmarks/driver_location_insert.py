@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+Benchmark Driver Location inserts: full Document lifecycle vs the lightweight
+ingest path used by update_driver_location.
+
+Run against a development site (all rows are rolled back):
+
+	bench --site your-site-name execute hayago_mapping.hayago_mapping.benchmarks.driver_location_insert.run --kwargs "{'count': 2000}"
+"""
+
+from __future__ import unicode_literals
+import frappe
+import random
+import time
+from hayago_mapping.hayago_mapping.doctype.driver_location.driver_location import (
+	bulk_insert_driver_locations,
+	update_driver_location
+)
+
+def generate_points(count, driver):
+	return [{
+		"driver": driver,
+		"latitude": 37.7749 + random.uniform(-0.05, 0.05),
+		"longitude": -122.4194 + random.uniform(-0.05, 0.05),
+		"speed": random.uniform(0, 80),
+		"heading": random.uniform(0, 360),
+		"accuracy": 5.0
+	} for _ in range(count)]
+
+def timed(label, count, func):
+	start = time.perf_counter()
+	func()
+	elapsed = time.perf_counter() - start
+	frappe.db.rollback()
+
+	rate = count / elapsed if elapsed else 0
+	print("{0:<32} {1:>10,.0f} inserts/s ({2:.2f}s)".format(label, rate, elapsed))
+	return rate
+
+def run(count=1000, driver="Administrator"):
+	"""Insert `count` points through each path and print inserts/second"""
+	points = generate_points(int(count), driver)
+
+	# update_driver_location commits per point, so defer commits to keep the
+	# benchmark rows out of the database
+	commit = frappe.db.commit
+	frappe.db.commit = lambda *args, **kwargs: None
+
+	try:
+		def document_path():
+			for point in points:
+				doc = frappe.get_doc(dict(point, doctype="Driver Location", timestamp=frappe.utils.now()))
+				doc.insert()
+
+		def single_point_path():
+			for point in points:
+				update_driver_location(**point)
+
+		def batch_path():
+			bulk_insert_driver_locations(points)
+
+		print("Driver Location insert benchmark ({0} points)".format(len(points)))
+		baseline = timed("Document.insert()", len(points), document_path)
+		single = timed("update_driver_location", len(points), single_point_path)
+		batch = timed("bulk_insert_driver_locations", len(points), batch_path)
+
+		if baseline:
+			print("Speedup: single-point {0:.1f}x, batch {1:.1f}x".format(single / baseline, batch / baseline))
+	finally:
+		frappe.db.commit = commit
+		frappe.db.rollback()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+Microbenchmark the geodesic kernels at 10, 1k and 100k points: the previous
+per-point loop over the scalar functions, the kernels' pure-Python path and
+their NumPy path (when NumPy is installed).
+
+Needs no site or database:
+
+	python -m hayago_mapping.hayago_mapping.benchmarks.geodesic
+
+or, from a bench:
+
+	bench --site your-site-name execute hayago_mapping.hayago_mapping.benchmarks.geodesic.run
+"""
+
+from __future__ import unicode_literals
+import math
+import random
+import time
+from hayago_mapping.hayago_mapping import geodesic
+
+CENTER_LAT = 37.7749
+CENTER_LNG = -122.4194
+SPREAD_DEG = 0.3
+
+SIZES = (10, 1000, 100000)
+
+def scalar_haversine(lat1, lon1, lat2, lon2):
+	"""The per-pair function callers used to loop over"""
+	lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+	a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+	return 2 * math.asin(math.sqrt(a)) * 6371
+
+def random_path(size):
+	latitudes = [CENTER_LAT + random.uniform(-SPREAD_DEG, SPREAD_DEG) for _ in range(size)]
+	longitudes = [CENTER_LNG + random.uniform(-SPREAD_DEG, SPREAD_DEG) for _ in range(size)]
+	return latitudes, longitudes
+
+def timed(label, size, func):
+	# Repeat small inputs so each timing covers a comparable amount of work
+	repeat = max(1, 100000 // size)
+	start = time.perf_counter()
+	for _ in range(repeat):
+		func()
+	elapsed = (time.perf_counter() - start) / repeat
+
+	print("{0:<36} {1:>7} pts {2:>10.1f} us".format(label, size, elapsed * 1000000))
+	return elapsed
+
+def run_kernels(size, latitudes, longitudes, backend):
+	timed("haversine, one to many ({0})".format(backend), size,
+		lambda: geodesic.haversine(CENTER_LAT, CENTER_LNG, latitudes, longitudes))
+	timed("bearing, one to many ({0})".format(backend), size,
+		lambda: geodesic.bearing(CENTER_LAT, CENTER_LNG, latitudes, longitudes))
+	timed("path length ({0})".format(backend), size,
+		lambda: geodesic.path_length(latitudes, longitudes))
+	timed("point to segments ({0})".format(backend), size,
+		lambda: geodesic.point_segment_distance(CENTER_LAT, CENTER_LNG, latitudes, longitudes))
+	timed("bounding boxes ({0})".format(backend), size,
+		lambda: geodesic.bounding_box(latitudes, longitudes, 5.0))
+
+def run():
+	numpy = geodesic.numpy
+
+	for size in SIZES:
+		latitudes, longitudes = random_path(size)
+		print("")
+
+		timed("haversine, scalar loop", size,
+			lambda: [scalar_haversine(CENTER_LAT, CENTER_LNG, lat, lng) for lat, lng in zip(latitudes, longitudes)])
+		timed("path length, scalar loop", size,
+			lambda: sum(scalar_haversine(latitudes[i - 1], longitudes[i - 1], latitudes[i], longitudes[i])
+				for i in range(1, size)))
+
+		try:
+			geodesic.numpy = None
+			run_kernels(size, latitudes, longitudes, "python")
+		finally:
+			geodesic.numpy = numpy
+
+		if numpy is not None:
+			run_kernels(size, latitudes, longitudes, "numpy")
+
+	if numpy is None:
+		print("\nNumPy is not installed; only the pure-Python path was measured")
+
+if __name__ == "__main__":
+	run()
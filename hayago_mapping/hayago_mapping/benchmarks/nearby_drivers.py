@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+Benchmark nearby-driver search over synthetic drivers: the previous
+acos-per-row scan, the geohash cell lookup with haversine refinement, and the
+in-process fleet index used by find_nearby_drivers.
+
+Run against a development site (all rows are rolled back):
+
+	bench --site your-site-name execute hayago_mapping.hayago_mapping.benchmarks.nearby_drivers.run --kwargs "{'drivers': 100000}"
+"""
+
+from __future__ import unicode_literals
+import frappe
+import random
+import time
+from frappe.utils import now_datetime
+from hayago_mapping.hayago_mapping.doctype.driver_position.driver_position import get_nearby_positions
+from hayago_mapping.hayago_mapping.fleet_index import FleetIndex
+from hayago_mapping.hayago_mapping.spatial_index import encode_geohash
+
+# Synthetic fleet spread over a ~60km x 60km metro area
+CENTER_LAT = 37.7749
+CENTER_LNG = -122.4194
+SPREAD_DEG = 0.3
+
+def legacy_nearby(latitude, longitude, radius):
+	"""The pre-index query: distance expression evaluated for every row"""
+	return frappe.db.sql("""
+		SELECT
+			dp.driver, dp.latitude, dp.longitude,
+			(
+				6371 * acos(
+					cos(radians(%s)) * cos(radians(dp.latitude)) *
+					cos(radians(dp.longitude) - radians(%s)) +
+					sin(radians(%s)) * sin(radians(dp.latitude))
+				)
+			) AS distance
+		FROM `tabDriver Position` dp
+		WHERE dp.timestamp >= DATE_SUB(NOW(), INTERVAL 5 MINUTE)
+		HAVING distance <= %s
+		ORDER BY distance ASC
+		LIMIT 20
+	""", (latitude, longitude, latitude, radius), as_dict=True)
+
+def seed_positions(count):
+	now = now_datetime()
+	rows = []
+	for i in range(count):
+		latitude = CENTER_LAT + random.uniform(-SPREAD_DEG, SPREAD_DEG)
+		longitude = CENTER_LNG + random.uniform(-SPREAD_DEG, SPREAD_DEG)
+		name = "bench-driver-{0:06d}".format(i)
+		rows.append((name, now, now, "Administrator", "Administrator", 0,
+			name, now, latitude, longitude, 30.0, 90.0, encode_geohash(latitude, longitude), 1))
+
+	frappe.db.bulk_insert("Driver Position", fields=[
+		"name", "creation", "modified", "owner", "modified_by", "docstatus",
+		"driver", "timestamp", "latitude", "longitude", "speed", "heading", "geohash", "is_available"
+	], values=rows)
+
+def timed(label, queries, func):
+	start = time.perf_counter()
+	for latitude, longitude, radius in queries:
+		func(latitude, longitude, radius)
+	elapsed = time.perf_counter() - start
+
+	print("{0:<24} {1:>8.2f} ms/query".format(label, elapsed * 1000 / len(queries)))
+	return elapsed
+
+def run(drivers=100000, queries=50, radius=5.0):
+	"""Seed `drivers` positions, run `queries` random searches with each method"""
+	try:
+		seed_positions(int(drivers))
+
+		searches = [(
+			CENTER_LAT + random.uniform(-SPREAD_DEG, SPREAD_DEG),
+			CENTER_LNG + random.uniform(-SPREAD_DEG, SPREAD_DEG),
+			float(radius)
+		) for _ in range(int(queries))]
+
+		print("Nearby driver search: {0} drivers, {1} queries, {2} km radius".format(drivers, queries, radius))
+		legacy = timed("acos scan", searches, legacy_nearby)
+		indexed = timed("geohash cells", searches, lambda lat, lng, r: get_nearby_positions(lat, lng, r, limit=20))
+
+		if indexed:
+			print("Speedup: {0:.1f}x".format(legacy / indexed))
+
+		fleet = FleetIndex()
+		start = time.perf_counter()
+		fleet.rebuild()
+		print("{0:<24} {1:>8.2f} ms ({2} drivers)".format("fleet index rebuild", (time.perf_counter() - start) * 1000, len(fleet)))
+
+		in_memory = timed("fleet index", searches, lambda lat, lng, r: fleet.nearest(lat, lng, 20, r))
+		if in_memory:
+			print("Speedup: {0:.1f}x".format(legacy / in_memory))
+	finally:
+		frappe.db.rollback()
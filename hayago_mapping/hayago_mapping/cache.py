@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+Shared response cache on the site's Redis cache.
+
+Entries expire after a TTL and the least recently used ones are evicted once
+a namespace holds more than `max_entries`. Hits and misses are counted per
+namespace, and concurrent misses on the same key across workers are collapsed
+behind a short Redis lock so only one caller reaches the upstream service.
+"""
+
+from __future__ import unicode_literals
+import frappe
+import time
+
+# How often a caller waiting on another worker's fill checks for the value
+SINGLE_FLIGHT_POLL_SECONDS = 0.05
+
+def quantize_coordinate(value, places):
+	"""Round a coordinate for use in a cache key (4 places is ~11m)"""
+	# Adding 0.0 folds -0.0 into 0.0 so both sides of the equator share keys
+	return "{0:.{1}f}".format(round(float(value), places) + 0.0, places)
+
+def increment_counter(namespace, counter):
+	"""Bump a per-namespace counter shared by all workers"""
+	cache = frappe.cache()
+	cache.hincrby(cache.make_key("{0}|stats".format(namespace)), counter, 1)
+
+def get_counters(namespace):
+	cache = frappe.cache()
+	counters = cache.hgetall(cache.make_key("{0}|stats".format(namespace)))
+	return {frappe.safe_decode(name): int(count) for name, count in counters.items()}
+
+class SharedCache(object):
+	def __init__(self, namespace, ttl, max_entries, lock_timeout=35):
+		self.namespace = namespace
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.lock_timeout = lock_timeout
+
+	def make_key(self, *parts):
+		return "{0}|{1}".format(self.namespace, "|".join(str(part) for part in parts))
+
+	def get(self, key):
+		# expires=True skips the per-request memo, which would pin a miss
+		value = frappe.cache().get_value(key, expires=True)
+		if value is not None:
+			self._touch(key)
+		self._count("hits" if value is not None else "misses")
+
+		return value
+
+	def set(self, key, value):
+		cache = frappe.cache()
+		cache.set_value(key, value, expires_in_sec=self.ttl)
+		self._touch(key)
+
+		# Evict the least recently used entries beyond max_entries
+		lru_key = cache.make_key(self._lru_key())
+		overflow = cache.zcard(lru_key) - self.max_entries
+		if overflow > 0:
+			for stale_key in cache.zrange(lru_key, 0, overflow - 1):
+				cache.delete_value(frappe.safe_decode(stale_key))
+			cache.zremrangebyrank(lru_key, 0, overflow - 1)
+
+	def get_or_compute(self, key, compute, cacheable=None):
+		"""Return the cached value for `key`, computing and storing it on a miss.
+
+		Only one worker computes a given key at a time; the others wait for its
+		result (up to `lock_timeout`) before falling back to computing it
+		themselves. Values rejected by `cacheable` are returned but not stored.
+		"""
+		value = self.get(key)
+		if value is not None:
+			return value
+
+		cache = frappe.cache()
+		lock_key = cache.make_key("{0}|lock".format(key))
+		deadline = time.monotonic() + self.lock_timeout
+
+		while not cache.set(lock_key, 1, nx=True, ex=self.lock_timeout):
+			if time.monotonic() >= deadline:
+				return self._fill(key, compute, cacheable)
+
+			time.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+			value = frappe.cache().get_value(key, expires=True)
+			if value is not None:
+				self._count("coalesced")
+				return value
+
+		try:
+			return self._fill(key, compute, cacheable)
+		finally:
+			cache.delete(lock_key)
+
+	def get_stats(self):
+		cache = frappe.cache()
+		stats = get_counters(self.namespace)
+		stats.setdefault("hits", 0)
+		stats.setdefault("misses", 0)
+
+		lookups = stats["hits"] + stats["misses"]
+		stats["hit_rate"] = stats["hits"] / float(lookups) if lookups else 0.0
+		stats["entries"] = cache.zcard(cache.make_key(self._lru_key()))
+
+		return stats
+
+	def clear(self):
+		cache = frappe.cache()
+		lru_key = cache.make_key(self._lru_key())
+		for key in cache.zrange(lru_key, 0, -1):
+			cache.delete_value(frappe.safe_decode(key))
+		cache.delete(lru_key, cache.make_key("{0}|stats".format(self.namespace)))
+
+	def _fill(self, key, compute, cacheable):
+		value = compute()
+		if value is not None and (cacheable is None or cacheable(value)):
+			self.set(key, value)
+		return value
+
+	def _touch(self, key):
+		cache = frappe.cache()
+		cache.zadd(cache.make_key(self._lru_key()), {key: time.time()})
+
+	def _count(self, counter):
+		increment_counter(self.namespace, counter)
+
+	def _lru_key(self):
+		return "{0}|lru".format(self.namespace)
@@ -5,9 +5,24 @@
 from __future__ import unicode_literals
 import frappe
 import json
+import time
 from frappe.model.document import Document
+from frappe.utils import cint, convert_utc_to_system_timezone, get_datetime, now_datetime
+from hayago_mapping.hayago_mapping.doctype.driver_position.driver_position import get_nearby_positions, upsert_driver_positions
+
+# Column order for bulk inserts into `tabDriver Location`
+LOCATION_INSERT_FIELDS = [
+	"name", "creation", "modified", "owner", "modified_by", "docstatus",
+	"driver", "timestamp", "latitude", "longitude",
+	"speed", "heading", "accuracy", "is_offline", "trip", "geojson_point"
+]
+
+_last_name_micros = 0
 
 class DriverLocation(Document):
+	def autoname(self):
+		self.name = new_location_name()
+	
 	def before_save(self):
 		"""Generate GeoJSON point from latitude and longitude"""
 		if self.latitude and self.longitude:
@@ -19,72 +34,199 @@ class DriverLocation(Document):
 	
 	def validate(self):
 		"""Validate location data"""
-		if not (-90 <= self.latitude <= 90):
-			frappe.throw("Latitude must be between -90 and 90 degrees")
+		error = get_location_error(self.latitude, self.longitude, self.speed, self.heading)
+		if error:
+			frappe.throw(error)
+	
+	def on_update(self):
+		"""Keep the driver's current position in step with desk-created locations"""
+		upsert_driver_positions([{
+			"driver": self.driver,
+			"timestamp": get_datetime(self.timestamp),
+			"latitude": self.latitude,
+			"longitude": self.longitude,
+			"speed": self.speed,
+			"heading": self.heading
+		}])
+
+def on_doctype_update():
+	"""Composite indexes for the hot Driver Location reads, (re)applied by bench migrate.
+
+	History pages filter on driver and page by (timestamp, name); InnoDB
+	appends the primary key to every secondary index, so (driver, timestamp)
+	serves both the range and the order without a filesort. Retention
+	cleanup deletes by timestamp alone.
+	"""
+	frappe.db.add_index("Driver Location", ["driver", "timestamp"], "driver_timestamp_index")
+	frappe.db.add_index("Driver Location", ["timestamp"], "timestamp_index")
+
+def new_location_name():
+	"""Return a time-ordered unique name for a Driver Location.
+
+	The hex microsecond timestamp prefix keeps new primary keys increasing so
+	inserts append to the end of the table's clustered index; the random
+	suffix keeps names unique across workers.
+	"""
+	global _last_name_micros
+	
+	micros = max(int(time.time() * 1000000), _last_name_micros + 1)
+	_last_name_micros = micros
+	
+	return "{0:014x}{1}".format(micros, frappe.generate_hash(length=6))
+
+def get_location_error(latitude, longitude, speed=None, heading=None):
+	"""Return the validation error for a location, or None if it is valid"""
+	if not (-90 <= latitude <= 90):
+		return "Latitude must be between -90 and 90 degrees"
+	
+	if not (-180 <= longitude <= 180):
+		return "Longitude must be between -180 and 180 degrees"
+	
+	if speed and speed < 0:
+		return "Speed cannot be negative"
+	
+	if heading and not (0 <= heading <= 360):
+		return "Heading must be between 0 and 360 degrees"
+	
+	return None
+
+def parse_location_numbers(location, fieldnames):
+	"""Return `float()` of each field, None for empty ones.
+
+	Unlike `flt`, non-numeric input is an error rather than 0, which would
+	pass the range checks and store a fix at (0, 0). Raises ValueError.
+	"""
+	values = []
+	for fieldname in fieldnames:
+		value = location.get(fieldname)
+		if value in (None, ""):
+			values.append(None)
+			continue
 		
-		if not (-180 <= self.longitude <= 180):
-			frappe.throw("Longitude must be between -180 and 180 degrees")
+		try:
+			values.append(float(value))
+		except (TypeError, ValueError):
+			raise ValueError("Invalid coordinate format")
+	
+	return values
+
+def parse_location_timestamp(value):
+	"""Parse a client timestamp into a naive datetime in the system timezone"""
+	if not value:
+		return get_datetime()
+	
+	timestamp = get_datetime(value.replace("Z", "+00:00") if isinstance(value, str) else value)
+	if timestamp.tzinfo:
+		timestamp = convert_utc_to_system_timezone(timestamp).replace(tzinfo=None)
+	
+	return timestamp
+
+def bulk_insert_driver_locations(locations):
+	"""Validate and insert many Driver Location rows with one multi-row INSERT.
+
+	Skips the Document lifecycle (hooks, link validation, naming series,
+	versioning), so all checks `DriverLocation` would run are done here in a
+	single pass. Returns one `(name, error)` tuple per input location, with
+	exactly one of the two set. The caller commits.
+	"""
+	results = []
+	rows = []
+	parsed = []
+	
+	for location in locations:
+		try:
+			if not location.get("driver") or location.get("latitude") in (None, "") or location.get("longitude") in (None, ""):
+				raise ValueError("driver, latitude and longitude are required")
+			
+			latitude, longitude, speed, heading, accuracy = parse_location_numbers(
+				location, ("latitude", "longitude", "speed", "heading", "accuracy"))
+			
+			error = get_location_error(latitude, longitude, speed, heading)
+			if error:
+				raise ValueError(error)
+			
+			parsed.append((len(results), location, latitude, longitude, speed, heading, accuracy,
+				parse_location_timestamp(location.get("timestamp"))))
+			results.append((None, None))
+		except Exception as e:
+			results.append((None, str(e)))
+	
+	if not parsed:
+		return results
+	
+	# Resolve Link fields once for the whole batch instead of per document
+	drivers = set(frappe.get_all("User", filters={"name": ["in", list({p[1]["driver"] for p in parsed})]}, pluck="name"))
+	trip_names = list({p[1]["trip"] for p in parsed if p[1].get("trip")})
+	trips = set(frappe.get_all("Trip", filters={"name": ["in", trip_names]}, pluck="name")) if trip_names else set()
+	
+	now = now_datetime()
+	user = frappe.session.user
+	
+	for index, location, latitude, longitude, speed, heading, accuracy, timestamp in parsed:
+		if location["driver"] not in drivers:
+			results[index] = (None, "Driver {0} not found".format(location["driver"]))
+			continue
 		
-		if self.speed and self.speed < 0:
-			frappe.throw("Speed cannot be negative")
+		trip = location.get("trip") or None
+		if trip and trip not in trips:
+			results[index] = (None, "Trip {0} not found".format(trip))
+			continue
 		
-		if self.heading and not (0 <= self.heading <= 360):
-			frappe.throw("Heading must be between 0 and 360 degrees")
+		name = new_location_name()
+		results[index] = (name, None)
+		rows.append((
+			name,
+			now, now, user, user, 0,
+			location["driver"],
+			timestamp,
+			latitude,
+			longitude,
+			speed,
+			heading,
+			accuracy,
+			cint(location.get("is_offline")),
+			trip,
+			json.dumps({"type": "Point", "coordinates": [longitude, latitude]})
+		))
+	
+	if rows:
+		frappe.db.bulk_insert("Driver Location", fields=LOCATION_INSERT_FIELDS, values=rows)
+		upsert_driver_positions([dict(zip(LOCATION_INSERT_FIELDS, row)) for row in rows])
+	
+	return results
 
 @frappe.whitelist()
 def get_nearby_drivers(latitude, longitude, radius=5.0):
 	"""Get drivers within a specified radius (in km) of a location"""
-	# Using Haversine formula for distance calculation
-	# This is a simplified implementation - in production, consider using spatial indexing
-	
-	sql_query = """
-		SELECT 
-			dl.driver,
-			dl.latitude,
-			dl.longitude,
-			dl.timestamp,
-			dl.speed,
-			(
-				6371 * acos(
-					cos(radians(%s)) * cos(radians(dl.latitude)) *
-					cos(radians(dl.longitude) - radians(%s)) +
-					sin(radians(%s)) * sin(radians(dl.latitude))
-				)
-			) AS distance
-		FROM `tabDriver Location` dl
-		WHERE dl.timestamp >= DATE_SUB(NOW(), INTERVAL 5 MINUTE)
-		HAVING distance <= %s
-		ORDER BY distance ASC
-	"""
-	
-	drivers = frappe.db.sql(sql_query, 
-		(latitude, longitude, latitude, radius), 
-		as_dict=True
-	)
-	
-	return drivers
+	# Reads the one-row-per-driver position table, not the location history
+	return get_nearby_positions(float(latitude), float(longitude), float(radius))
 
 @frappe.whitelist()
-def update_driver_location(driver, latitude, longitude, speed=None, heading=None, accuracy=None, is_offline=False, trip=None):
+def update_driver_location(driver, latitude, longitude, speed=None, heading=None, accuracy=None, is_offline=False, trip=None, timestamp=None):
 	"""API endpoint to update driver location"""
 	try:
-		doc = frappe.get_doc({
-			"doctype": "Driver Location",
+		frappe.has_permission("Driver Location", "create", throw=True)
+		
+		# Lightweight ingest: same validation as DriverLocation.validate, but a
+		# single INSERT with no document hooks, naming series or Version rows
+		name, error = bulk_insert_driver_locations([{
 			"driver": driver,
-			"timestamp": frappe.utils.now(),
-			"latitude": float(latitude),
-			"longitude": float(longitude),
-			"speed": float(speed) if speed else None,
-			"heading": float(heading) if heading else None,
-			"accuracy": float(accuracy) if accuracy else None,
-			"is_offline": int(is_offline),
+			"timestamp": timestamp,
+			"latitude": latitude,
+			"longitude": longitude,
+			"speed": speed,
+			"heading": heading,
+			"accuracy": accuracy,
+			"is_offline": is_offline,
 			"trip": trip
-		})
-		doc.insert()
+		}])[0]
+		
+		if error:
+			return {"status": "error", "message": error}
+		
 		frappe.db.commit()
 		
-		return {"status": "success", "name": doc.name}
+		return {"status": "success", "name": name}
 	except Exception as e:
 		frappe.log_error(frappe.get_traceback(), "Driver Location Update Error")
 		return {"status": "error", "message": str(e)}
-
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import unittest
+from hayago_mapping.hayago_mapping.doctype.driver_location.driver_location import bulk_insert_driver_locations
+
+class TestDriverLocation(unittest.TestCase):
+	def test_non_numeric_location_is_rejected(self):
+		"""Garbage coordinates are an error, not a fix at (0, 0)"""
+		results = bulk_insert_driver_locations([
+			{"driver": "Administrator", "latitude": "abc", "longitude": 2},
+			{"driver": "Administrator", "latitude": 1, "longitude": 2, "speed": "fast"},
+			{"driver": "Administrator", "latitude": None, "longitude": 2}
+		])
+		
+		self.assertEqual(results, [
+			(None, "Invalid coordinate format"),
+			(None, "Invalid coordinate format"),
+			(None, "driver, latitude and longitude are required")
+		])
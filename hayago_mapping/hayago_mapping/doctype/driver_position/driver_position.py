@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now_datetime
+from hayago_mapping.hayago_mapping.fleet_index import update_fleet_availability, update_fleet_index
+from hayago_mapping.hayago_mapping.spatial_index import encode_geohash, get_cell_conditions, get_covering_cells, refine_by_distance
+
+# Drivers whose last ping is older than this are not offered to riders
+POSITION_FRESHNESS_MINUTES = 5
+
+# Trip statuses that keep a driver off the market
+BUSY_TRIP_STATUSES = ("Accepted", "On Route")
+
+class DriverPosition(Document):
+	"""Latest known position of a driver, one row per driver.
+
+	Maintained by the Driver Location write paths; `tabDriver Location` keeps
+	the full history.
+	"""
+	pass
+
+def upsert_driver_positions(positions):
+	"""Upsert the newest of `positions` for each driver into `tabDriver Position`.
+
+	`positions` are dicts with driver, timestamp, latitude, longitude, speed and
+	heading. A stored position is only replaced by a newer timestamp, so
+	out-of-order offline replays never move a driver backwards. A driver's
+	first position takes its availability from their open trips; after that
+	`update_driver_availability` maintains it. The caller commits.
+	"""
+	latest = {}
+	for position in positions:
+		current = latest.get(position["driver"])
+		if not current or position["timestamp"] >= current["timestamp"]:
+			latest[position["driver"]] = position
+
+	if not latest:
+		return
+
+	now = now_datetime()
+	user = frappe.session.user
+	values = []
+	placeholders = []
+
+	busy_placeholders = ", ".join(["%s"] * len(BUSY_TRIP_STATUSES))
+
+	for driver, position in latest.items():
+		placeholders.append("""(%s, %s, %s, %s, %s, 0, %s, %s, %s, %s, %s, %s, %s,
+			NOT EXISTS (SELECT 1 FROM `tabTrip` WHERE driver = %s AND status IN ({0})))""".format(busy_placeholders))
+		values.extend([
+			driver, now, now, user, user,
+			driver,
+			position["timestamp"],
+			position["latitude"],
+			position["longitude"],
+			position.get("speed"),
+			position.get("heading"),
+			encode_geohash(position["latitude"], position["longitude"]),
+			driver
+		])
+		values.extend(BUSY_TRIP_STATUSES)
+
+	# MariaDB applies the assignments left to right, so `timestamp` must be
+	# updated last for the newer-than checks on the other columns to work
+	frappe.db.sql("""
+		INSERT INTO `tabDriver Position`
+			(name, creation, modified, owner, modified_by, docstatus,
+			driver, timestamp, latitude, longitude, speed, heading, geohash, is_available)
+		VALUES {0}
+		ON DUPLICATE KEY UPDATE
+			latitude = IF(VALUES(timestamp) >= timestamp, VALUES(latitude), latitude),
+			longitude = IF(VALUES(timestamp) >= timestamp, VALUES(longitude), longitude),
+			speed = IF(VALUES(timestamp) >= timestamp, VALUES(speed), speed),
+			heading = IF(VALUES(timestamp) >= timestamp, VALUES(heading), heading),
+			geohash = IF(VALUES(timestamp) >= timestamp, VALUES(geohash), geohash),
+			modified = IF(VALUES(timestamp) >= timestamp, VALUES(modified), modified),
+			timestamp = GREATEST(VALUES(timestamp), timestamp)
+	""".format(", ".join(placeholders)), values)
+
+	# Keep this worker's live fleet index current once the write is durable
+	frappe.db.after_commit.add(lambda: update_fleet_index(latest.values()))
+
+def update_driver_availability(driver):
+	"""Recompute `is_available` for a driver from their open trips.
+
+	Called on Trip changes so nearby searches can filter on the stored flag
+	instead of counting trips per candidate. The caller commits.
+	"""
+	if not driver:
+		return
+
+	is_available = 0 if frappe.db.exists("Trip", {"driver": driver, "status": ["in", BUSY_TRIP_STATUSES]}) else 1
+
+	frappe.db.sql("""
+		UPDATE `tabDriver Position`
+		SET is_available = %s, modified = %s
+		WHERE driver = %s AND is_available != %s
+	""", (is_available, now_datetime(), driver, is_available))
+
+	frappe.db.after_commit.add(lambda: update_fleet_availability(driver, is_available))
+
+def get_nearby_positions(latitude, longitude, radius, limit=None):
+	"""Fresh driver positions within `radius` km, closest first.
+
+	Candidates come from the geohash cells covering the search area (an index
+	range scan on `geohash`); exact distances are computed only for those.
+	"""
+	cell_condition, cell_values = get_cell_conditions(get_covering_cells(latitude, longitude, radius), "dp.geohash")
+
+	candidates = frappe.db.sql("""
+		SELECT
+			dp.driver,
+			dp.latitude,
+			dp.longitude,
+			dp.timestamp,
+			dp.speed,
+			dp.heading,
+			dp.is_available,
+			u.full_name as driver_name,
+			u.mobile_no as driver_mobile
+		FROM `tabDriver Position` dp
+		LEFT JOIN `tabUser` u ON dp.driver = u.name
+		WHERE {0}
+		AND dp.timestamp >= DATE_SUB(NOW(), INTERVAL %s MINUTE)
+	""".format(cell_condition), cell_values + [POSITION_FRESHNESS_MINUTES], as_dict=True)
+
+	return refine_by_distance(candidates, latitude, longitude, radius, limit)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from frappe.model.document import Document
+from frappe.utils import cint, now_datetime
+from hayago_mapping.hayago_mapping.cache import get_counters, increment_counter, quantize_coordinate
+
+# Decimal places kept from reverse-geocoded points in cache keys (~11m)
+GEOCODE_CACHE_PRECISION = 4
+
+# Per-process tier in front of the table
+GEOCODE_MEMORY_MAX_ENTRIES = 5000
+GEOCODE_MEMORY_TTL = 300
+
+# Used when Module Settings leaves the TTLs empty
+DEFAULT_GEOCODE_TTL_DAYS = 30
+DEFAULT_GEOCODE_NEGATIVE_TTL_HOURS = 24
+
+GEOCODE_STATS_NAMESPACE = "hayago_geocode"
+
+class GeocodeCache(Document):
+	"""Cached Nominatim response for a normalized address or quantized point.
+
+	Written and read by the geocoding endpoints through `geocode_cache`;
+	expired rows are ignored and overwritten on the next lookup.
+	"""
+	pass
+
+def normalize_address(address):
+	"""Case, punctuation and whitespace insensitive form of an address"""
+	address = re.sub(r"[^\w\s,]", " ", str(address or "").lower())
+	address = re.sub(r"\s*,\s*", ", ", address)
+	address = re.sub(r"\s+", " ", address)
+	return address.strip(" ,")
+
+def get_reverse_query(latitude, longitude):
+	return "{0},{1}".format(
+		quantize_coordinate(latitude, GEOCODE_CACHE_PRECISION),
+		quantize_coordinate(longitude, GEOCODE_CACHE_PRECISION)
+	)
+
+def get_geocode_ttl(settings, not_found=False):
+	"""Seconds a response stays cached; misses use the shorter negative TTL"""
+	if not_found:
+		return 3600 * (cint(settings.get("geocode_negative_ttl_hours")) or DEFAULT_GEOCODE_NEGATIVE_TTL_HOURS)
+	return 86400 * (cint(settings.get("geocode_cache_ttl_days")) or DEFAULT_GEOCODE_TTL_DAYS)
+
+class GeocodeResponseCache(object):
+	"""Two-tier cache: a per-process LRU over the `tabGeocode Cache` table.
+
+	Lookups are counted as memory hits, table hits, local hits (answered from
+	the known-address index) or misses (calls that go on to Nominatim) in
+	Redis, so the counts cover every worker. Callers record the last two with
+	`count`, since only they know how a lookup missing the cache was answered.
+	"""
+
+	def __init__(self, max_entries=GEOCODE_MEMORY_MAX_ENTRIES, memory_ttl=GEOCODE_MEMORY_TTL):
+		self.max_entries = max_entries
+		self.memory_ttl = memory_ttl
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, lookup_type, query):
+		name = get_cache_name(lookup_type, query)
+		memory_key = (getattr(frappe.local, "site", None), name)
+
+		with self.lock:
+			entry = self.entries.get(memory_key)
+			if entry and entry[0] > time.monotonic():
+				self.entries.move_to_end(memory_key)
+			else:
+				entry = None
+
+		# Counted outside the lock so a slow Redis does not serialize lookups
+		if entry:
+			increment_counter(GEOCODE_STATS_NAMESPACE, "memory_hits")
+			return entry[1]
+
+		row = frappe.db.sql("""
+			SELECT response, expires_on
+			FROM `tabGeocode Cache`
+			WHERE name = %s AND expires_on > %s
+		""", (name, now_datetime()), as_dict=True)
+
+		if not row:
+			return None
+
+		response = json.loads(row[0].response)
+		self._remember(memory_key, response, row[0].expires_on)
+		increment_counter(GEOCODE_STATS_NAMESPACE, "table_hits")
+
+		return response
+
+	def set(self, lookup_type, query, response, ttl, not_found=False, latitude=None, longitude=None, display_name=None):
+		"""Store `response` in both tiers. The caller commits."""
+		name = get_cache_name(lookup_type, query)
+		now = now_datetime()
+		expires_on = now + timedelta(seconds=ttl)
+		user = frappe.session.user
+
+		frappe.db.sql("""
+			INSERT INTO `tabGeocode Cache`
+				(name, creation, modified, owner, modified_by, docstatus,
+				lookup_type, query, not_found, expires_on, latitude, longitude, display_name, response)
+			VALUES (%s, %s, %s, %s, %s, 0, %s, %s, %s, %s, %s, %s, %s, %s)
+			ON DUPLICATE KEY UPDATE
+				modified = VALUES(modified),
+				not_found = VALUES(not_found),
+				expires_on = VALUES(expires_on),
+				latitude = VALUES(latitude),
+				longitude = VALUES(longitude),
+				display_name = VALUES(display_name),
+				response = VALUES(response)
+		""", (name, now, now, user, user,
+			lookup_type, query[:255], 1 if not_found else 0, expires_on,
+			latitude, longitude, display_name, json.dumps(response)))
+
+		self._remember((getattr(frappe.local, "site", None), name), response, expires_on)
+
+	def count(self, counter):
+		"""Record how a lookup that missed the cache was answered: local_hits or misses"""
+		increment_counter(GEOCODE_STATS_NAMESPACE, counter)
+
+	def get_stats(self):
+		stats = get_counters(GEOCODE_STATS_NAMESPACE)
+		for counter in ("memory_hits", "table_hits", "local_hits", "misses"):
+			stats.setdefault(counter, 0)
+
+		lookups = stats["memory_hits"] + stats["table_hits"] + stats["local_hits"] + stats["misses"]
+		stats["upstream_rate"] = stats["misses"] / float(lookups) if lookups else 0.0
+
+		return stats
+
+	def _remember(self, memory_key, response, expires_on):
+		remaining = (expires_on - now_datetime()).total_seconds()
+		deadline = time.monotonic() + min(self.memory_ttl, remaining)
+
+		with self.lock:
+			self.entries[memory_key] = (deadline, response)
+			self.entries.move_to_end(memory_key)
+			while len(self.entries) > self.max_entries:
+				self.entries.popitem(last=False)
+
+def get_cache_name(lookup_type, query):
+	"""Stable row name for a lookup; queries can exceed the name column length"""
+	return hashlib.sha1("{0}|{1}".format(lookup_type, query).encode("utf-8")).hexdigest()[:20]
+
+geocode_cache = GeocodeResponseCache()
@@ -5,6 +5,7 @@
 from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
+from hayago_mapping.hayago_mapping.utils import invalidate_module_settings
 
 class ModuleSettings(Document):
 	def validate(self):
@@ -18,6 +19,15 @@ class ModuleSettings(Document):
 		if self.cost_per_minute and self.cost_per_minute < 0:
 			frappe.throw("Cost per minute cannot be negative")
 		
+		if self.geocode_cache_ttl_days and self.geocode_cache_ttl_days < 0:
+			frappe.throw("Geocode cache TTL cannot be negative")
+		
+		if self.geocode_negative_ttl_hours and self.geocode_negative_ttl_hours < 0:
+			frappe.throw("Not found cache TTL cannot be negative")
+		
+		if self.reverse_geocode_match_distance and self.reverse_geocode_match_distance < 0:
+			frappe.throw("Local reverse geocode distance cannot be negative")
+		
 		# Validate URLs
 		if self.nominatim_url and not self.nominatim_url.startswith(('http://', 'https://')):
 			frappe.throw("Nominatim URL must start with http:// or https://")
@@ -27,4 +37,7 @@ class ModuleSettings(Document):
 		
 		if self.tracking_api_endpoint and not self.tracking_api_endpoint.startswith(('http://', 'https://')):
 			frappe.throw("Tracking API endpoint must start with http:// or https://")
-
+	
+	def on_update(self):
+		"""Invalidate the cached settings snapshot in every worker once saved"""
+		frappe.db.after_commit.add(invalidate_module_settings)
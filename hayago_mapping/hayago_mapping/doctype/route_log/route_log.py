@@ -5,6 +5,16 @@
 from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
+from frappe.utils import now_datetime
+from hayago_mapping.hayago_mapping.doctype.driver_location.driver_location import get_location_error, new_location_name, parse_location_numbers, parse_location_timestamp
+from hayago_mapping.hayago_mapping.doctype.trip.trip import TRIP_PROGRESS_FIELDS, accumulate_trip_progress
+
+# Column order for bulk inserts into `tabRoute Log`
+ROUTE_LOG_INSERT_FIELDS = [
+	"name", "creation", "modified", "owner", "modified_by", "docstatus",
+	"parent", "parenttype", "parentfield", "idx",
+	"timestamp", "latitude", "longitude", "speed"
+]
 
 class RouteLog(Document):
 	def validate(self):
@@ -18,3 +28,63 @@ class RouteLog(Document):
 		if self.speed and self.speed < 0:
 			frappe.throw("Speed cannot be negative")
 
+def append_route_logs(trip, points):
+	"""Append route points to a trip with one multi-row INSERT.
+
+	Rows are written straight into `tabRoute Log`, so the Trip document is
+	not loaded or re-saved and each append costs the same however long the
+	trip is; the trip's progress aggregates are updated from the new points
+	alone. `trip` is the Trip row with `name` and TRIP_PROGRESS_FIELDS, read
+	under its row lock (SELECT ... FOR UPDATE) so concurrent appends are
+	serialized. The caller commits. Returns
+	one `(point, error)` tuple per input point, with exactly one of the two
+	set; `point` is the stored row as a dict.
+	"""
+	results = []
+	rows = []
+	
+	for point in points:
+		try:
+			if point.get("latitude") in (None, "") or point.get("longitude") in (None, ""):
+				raise ValueError("latitude and longitude are required")
+			
+			latitude, longitude, speed = parse_location_numbers(point, ("latitude", "longitude", "speed"))
+			
+			error = get_location_error(latitude, longitude, speed)
+			if error:
+				raise ValueError(error)
+			
+			rows.append([new_location_name(), parse_location_timestamp(point.get("timestamp")), latitude, longitude, speed])
+			results.append((rows[-1], None))
+		except Exception as e:
+			results.append((None, str(e)))
+	
+	if not rows:
+		return results
+	
+	last_idx = frappe.db.sql("""
+		SELECT IFNULL(MAX(idx), 0) FROM `tabRoute Log`
+		WHERE parent = %s AND parenttype = 'Trip' AND parentfield = 'route_logs'
+	""", (trip.name,))[0][0]
+	
+	now = now_datetime()
+	user = frappe.session.user
+	
+	frappe.db.bulk_insert("Route Log", fields=ROUTE_LOG_INSERT_FIELDS, values=[
+		[name, now, now, user, user, 0, trip.name, "Trip", "route_logs", last_idx + i + 1, timestamp, latitude, longitude, speed]
+		for i, (name, timestamp, latitude, longitude, speed) in enumerate(rows)
+	])
+	
+	stored = [(dict(zip(("name", "timestamp", "latitude", "longitude", "speed"), row)) if row else None, error)
+		for row, error in results]
+	
+	progress = accumulate_trip_progress(trip, [point for point, error in stored if point])
+	
+	# Bumping modified also stops a Trip form opened before these points were
+	# logged from being saved over them with its stale child table
+	frappe.db.sql("""
+		UPDATE `tabTrip` SET {0}, modified = %(modified)s WHERE name = %(name)s
+	""".format(", ".join("`{0}` = %({0})s".format(fieldname) for fieldname in TRIP_PROGRESS_FIELDS)),
+		dict(progress, modified=now, name=trip.name))
+	
+	return stored
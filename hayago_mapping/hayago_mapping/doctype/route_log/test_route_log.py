@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+import unittest
+from hayago_mapping.hayago_mapping.doctype.route_log.route_log import append_route_logs
+
+class TestRouteLog(unittest.TestCase):
+	def test_non_numeric_point_is_skipped(self):
+		"""A garbage point gets its own error instead of a fix at (0, 0)"""
+		results = append_route_logs(frappe._dict(name="_Test Trip"), [
+			{"latitude": "abc", "longitude": 2},
+			{"latitude": 1, "longitude": 2, "speed": "fast"},
+			{"latitude": "", "longitude": 2}
+		])
+		
+		self.assertEqual(results, [
+			(None, "Invalid coordinate format"),
+			(None, "Invalid coordinate format"),
+			(None, "latitude and longitude are required")
+		])
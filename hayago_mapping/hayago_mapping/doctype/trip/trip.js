@@ -178,24 +178,31 @@ function update_trip_map(frm) {
         }
     }
     
-    // Add logged route if available
-    if (frm.doc.logged_route_geojson) {
+    // Add logged route if available. The route logs are always current;
+    // logged_route_geojson is only rebuilt when the form is saved
+    let loggedCoordinates = null;
+    if (frm.doc.route_logs && frm.doc.route_logs.length) {
+        loggedCoordinates = frm.doc.route_logs.map(log => [log.latitude, log.longitude]);
+    } else if (frm.doc.logged_route_geojson) {
         try {
             const loggedRouteData = JSON.parse(frm.doc.logged_route_geojson);
             if (loggedRouteData.coordinates) {
-                const coordinates = loggedRouteData.coordinates.map(coord => [coord[1], coord[0]]); // Convert [lng, lat] to [lat, lng]
-                frm.trip_map.addRoute('logged', coordinates, {
-                    color: '#28a745',
-                    weight: 5,
-                    opacity: 0.8,
-                    popup: `<strong>Actual Route</strong><br>Distance: ${frm.doc.actual_distance || 'N/A'} km<br>Duration: ${frm.doc.actual_duration || 'N/A'} min`
-                });
+                loggedCoordinates = loggedRouteData.coordinates.map(coord => [coord[1], coord[0]]); // Convert [lng, lat] to [lat, lng]
             }
         } catch (e) {
             console.error('Error parsing logged route GeoJSON:', e);
         }
     }
     
+    if (loggedCoordinates) {
+        frm.trip_map.addRoute('logged', loggedCoordinates, {
+            color: '#28a745',
+            weight: 5,
+            opacity: 0.8,
+            popup: `<strong>Actual Route</strong><br>Distance: ${frm.doc.actual_distance || 'N/A'} km<br>Duration: ${frm.doc.actual_duration || 'N/A'} min`
+        });
+    }
+    
     // Fit map to show all markers
     const bounds = [];
     if (frm.doc.pickup_latitude && frm.doc.pickup_longitude) {
@@ -257,6 +264,7 @@ function calculate_trip_estimate(frm) {
                 frm.set_value('estimated_duration', result.estimated_duration);
                 frm.set_value('estimated_cost', result.estimated_cost);
                 frm.set_value('route_geojson', result.route_geojson);
+                frm.set_value('route_instructions', result.route_instructions);
                 
                 // Update map with new route
                 update_trip_map(frm);
@@ -5,9 +5,21 @@
 from __future__ import unicode_literals
 import frappe
 import json
-import requests
 from frappe.model.document import Document
-from frappe.utils import now, time_diff_in_seconds
+from frappe.utils import cint, flt, now, time_diff_in_seconds
+from hayago_mapping.hayago_mapping.doctype.driver_position.driver_position import update_driver_availability
+from hayago_mapping.hayago_mapping.routing import get_route
+from hayago_mapping.hayago_mapping import geodesic
+
+# Running aggregates of the logged route, updated as points are appended
+TRIP_PROGRESS_FIELDS = [
+	"distance_covered", "moving_time", "route_point_count",
+	"max_speed", "avg_speed", "speed_point_count",
+	"last_point_time", "last_latitude", "last_longitude"
+]
+
+# Slower movement between two points is GPS drift, not moving time
+MOVING_SPEED_KMH = 3
 
 class Trip(Document):
 	def validate(self):
@@ -35,50 +47,39 @@ class Trip(Document):
 			duration_seconds = time_diff_in_seconds(self.end_time, self.start_time)
 			self.actual_duration = duration_seconds / 60.0
 			
-			# Calculate actual distance from route logs if available
-			if self.route_logs:
+			# Use the running total kept at ingest unless logs were edited in the form
+			if self.route_logs and cint(self.route_point_count) == len(self.route_logs):
+				self.actual_distance = flt(self.distance_covered)
+			elif self.route_logs:
 				self.actual_distance = self.calculate_distance_from_logs()
 			
 			# Generate logged route GeoJSON from route logs
 			if self.route_logs:
 				self.logged_route_geojson = self.generate_logged_route_geojson()
 	
+	def on_update(self):
+		"""Keep the driver's availability in step with their trips"""
+		previous = self.get_doc_before_save()
+		if previous and previous.status == self.status and previous.driver == self.driver:
+			return
+		
+		update_driver_availability(self.driver)
+		if previous and previous.driver != self.driver:
+			update_driver_availability(previous.driver)
+	
+	def after_delete(self):
+		"""Release the driver if a deleted trip was keeping them busy"""
+		update_driver_availability(self.driver)
+	
 	def calculate_distance_from_logs(self):
 		"""Calculate total distance from route log points using Haversine formula"""
 		if not self.route_logs or len(self.route_logs) < 2:
 			return 0.0
 		
-		total_distance = 0.0
-		
-		for i in range(1, len(self.route_logs)):
-			prev_log = self.route_logs[i-1]
-			curr_log = self.route_logs[i]
-			
-			distance = self.haversine_distance(
-				prev_log.latitude, prev_log.longitude,
-				curr_log.latitude, curr_log.longitude
-			)
-			total_distance += distance
-		
-		return total_distance
-	
-	def haversine_distance(self, lat1, lon1, lat2, lon2):
-		"""Calculate distance between two points using Haversine formula"""
-		import math
-		
-		# Convert latitude and longitude from degrees to radians
-		lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-		
-		# Haversine formula
-		dlat = lat2 - lat1
-		dlon = lon2 - lon1
-		a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-		c = 2 * math.asin(math.sqrt(a))
-		
-		# Radius of earth in kilometers
-		r = 6371
-		
-		return c * r
+		return geodesic.path_length(
+			[log.latitude for log in self.route_logs],
+			[log.longitude for log in self.route_logs]
+		)[-1]
 	
 	def generate_logged_route_geojson(self):
 		"""Generate GeoJSON LineString from route logs"""
@@ -96,75 +97,91 @@ class Trip(Document):
 		
 		return json.dumps(geojson)
 
+def accumulate_trip_progress(progress, points):
+	"""Fold route points into a trip's progress aggregates.
+
+	`progress` holds the TRIP_PROGRESS_FIELDS of the trip and `points` are
+	the appended points in order (timestamp, latitude, longitude, speed).
+	Returns the updated aggregates; each point costs O(1) however many were
+	logged before it.
+	"""
+	progress = frappe._dict({fieldname: progress.get(fieldname) for fieldname in TRIP_PROGRESS_FIELDS})
+	for fieldname in TRIP_PROGRESS_FIELDS[:6]:
+		progress[fieldname] = flt(progress[fieldname])
+	
+	# Distance of each point from the one logged before it, in one batch
+	latitudes = [point["latitude"] for point in points]
+	longitudes = [point["longitude"] for point in points]
+	if progress.route_point_count:
+		latitudes.insert(0, progress.last_latitude)
+		longitudes.insert(0, progress.last_longitude)
+	steps = geodesic.haversine(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+	if not progress.route_point_count:
+		steps.insert(0, None)
+	
+	for point, distance in zip(points, steps):
+		if distance is not None:
+			progress.distance_covered += distance
+			
+			seconds = time_diff_in_seconds(point["timestamp"], progress.last_point_time) if progress.last_point_time else 0
+			if seconds > 0 and distance / seconds * 3600 >= MOVING_SPEED_KMH:
+				progress.moving_time += seconds / 60.0
+		
+		if point.get("speed") is not None:
+			speed = flt(point["speed"])
+			progress.max_speed = max(progress.max_speed, speed)
+			progress.avg_speed += (speed - progress.avg_speed) / (progress.speed_point_count + 1)
+			progress.speed_point_count += 1
+		
+		progress.route_point_count += 1
+		progress.last_point_time = point["timestamp"]
+		progress.last_latitude = point["latitude"]
+		progress.last_longitude = point["longitude"]
+	
+	progress.route_point_count = cint(progress.route_point_count)
+	progress.speed_point_count = cint(progress.speed_point_count)
+	
+	return progress
+
 @frappe.whitelist()
 def estimate_trip_cost(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng):
-	"""Estimate trip cost using GraphHopper API"""
+	"""Estimate trip cost using GraphHopper API.
+
+	The route comes with its turn-by-turn instructions so that a trip created
+	from this estimate can be navigated without routing again.
+	"""
 	try:
-		settings = frappe.get_single("Module Settings")
-		
-		# Get route from GraphHopper
-		route_data = get_route_from_graphhopper(
-			pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, settings
-		)
+		route = get_route(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, vehicle="car", alternatives=False)
 		
-		if not route_data:
+		if route.get("status") != "success":
 			return {"status": "error", "message": "Could not calculate route"}
 		
-		# Extract distance (in meters) and time (in milliseconds)
-		distance_km = route_data.get("distance", 0) / 1000.0
-		duration_minutes = route_data.get("time", 0) / 60000.0
-		
-		# Calculate cost
-		cost = (distance_km * settings.cost_per_km) + (duration_minutes * settings.cost_per_minute)
-		
-		# Generate route GeoJSON
-		route_geojson = None
-		if "paths" in route_data and route_data["paths"]:
-			points = route_data["paths"][0].get("points", {})
-			if "coordinates" in points:
-				route_geojson = json.dumps({
-					"type": "LineString",
-					"coordinates": points["coordinates"]
-				})
-		
 		return {
 			"status": "success",
-			"estimated_distance": distance_km,
-			"estimated_duration": duration_minutes,
-			"estimated_cost": cost,
-			"route_geojson": route_geojson
+			"estimated_distance": route["distance_km"],
+			"estimated_duration": route["duration_minutes"],
+			"estimated_cost": route["estimated_cost"],
+			"route_geojson": json.dumps(route["route_geojson"]) if route.get("route_geojson") else None,
+			"route_instructions": dump_route_instructions(route)
 		}
 		
 	except Exception as e:
 		frappe.log_error(frappe.get_traceback(), "Trip Cost Estimation Error")
 		return {"status": "error", "message": str(e)}
 
-def get_route_from_graphhopper(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, settings):
-	"""Get route data from GraphHopper API"""
-	try:
-		url = settings.graphhopper_url
-		
-		params = {
-			"point": [f"{pickup_lat},{pickup_lng}", f"{dropoff_lat},{dropoff_lng}"],
-			"vehicle": "car",
-			"locale": "en",
-			"calc_points": "true",
-			"debug": "true",
-			"elevation": "false",
-			"points_encoded": "false"
-		}
-		
-		if settings.graphhopper_api_key:
-			params["key"] = settings.graphhopper_api_key
-		
-		response = requests.get(url, params=params, timeout=30)
-		response.raise_for_status()
-		
-		return response.json()
-		
-	except Exception as e:
-		frappe.log_error(f"GraphHopper API Error: {str(e)}", "GraphHopper API Error")
-		return None
+def dump_route_instructions(route):
+	"""Compact JSON of a routing.get_route result's instructions, as stored on Trip"""
+	return json.dumps({
+		"distance_km": route.get("distance_km", 0),
+		"duration_minutes": route.get("duration_minutes", 0),
+		"instructions": [{
+			"text": instruction.get("text", ""),
+			"distance": instruction.get("distance", 0),
+			"time": instruction.get("time", 0),
+			"sign": instruction.get("sign", 0),
+			"interval": instruction.get("interval", [])
+		} for instruction in route.get("instructions", [])]
+	}, separators=(",", ":"))
 
 @frappe.whitelist()
 def create_trip(driver, customer, pickup_address, pickup_lat, pickup_lng, 
@@ -192,6 +209,7 @@ def create_trip(driver, customer, pickup_address, pickup_lat, pickup_lng,
 			"estimated_duration": estimation.get("estimated_duration"),
 			"estimated_cost": estimation.get("estimated_cost"),
 			"route_geojson": estimation.get("route_geojson"),
+			"route_instructions": estimation.get("route_instructions"),
 			"status": "Pending"
 		})
 		
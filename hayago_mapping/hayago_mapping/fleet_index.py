@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+In-process live fleet index.
+
+Holds the latest position of every online driver in a uniform lat/lng grid so
+radius and k-nearest queries are answered from memory. Each worker process
+keeps one index per site: it is rebuilt from `tabDriver Position` on first
+use, updated after every committed position upsert in this process, and
+catches up with writes from other workers by pulling rows modified since its
+last refresh (at most once every FLEET_REFRESH_SECONDS).
+"""
+
+from __future__ import unicode_literals
+import frappe
+import math
+import threading
+import time
+from datetime import timedelta
+from frappe.utils import get_datetime, now_datetime
+from .utils import get_bounding_box, haversine_distance
+
+# Grid cell size in degrees (~1.1km of latitude)
+FLEET_CELL_DEGREES = 0.01
+
+# How often a worker pulls positions written by other workers
+FLEET_REFRESH_SECONDS = 1.0
+
+# Matches the freshness window of the SQL nearby-driver queries
+FLEET_MAX_AGE_MINUTES = 5
+
+# Radius of the first k-nearest probe; doubled until enough drivers are found
+FLEET_KNN_START_RADIUS_KM = 1.0
+
+_fleet_indexes = {}
+_fleet_indexes_lock = threading.Lock()
+
+class FleetIndex(object):
+	def __init__(self, cell_degrees=FLEET_CELL_DEGREES, max_age_minutes=FLEET_MAX_AGE_MINUTES):
+		self.cell_degrees = cell_degrees
+		self.max_age = timedelta(minutes=max_age_minutes)
+		self.cells = {}
+		self.drivers = {}
+		self.last_modified = None
+		self.refreshed_at = 0
+		self.lock = threading.RLock()
+
+	def __len__(self):
+		return len(self.drivers)
+
+	def get_cell(self, latitude, longitude):
+		return (int(math.floor(latitude / self.cell_degrees)), int(math.floor(longitude / self.cell_degrees)))
+
+	def upsert(self, position):
+		"""Insert or move a driver. Older timestamps never replace newer ones.
+
+		`position` needs driver, latitude, longitude and timestamp; any other
+		keys (speed, heading, is_available, driver_name, ...) are kept as
+		details and merged over what the index already holds.
+		"""
+		timestamp = get_datetime(position["timestamp"])
+
+		with self.lock:
+			current = self.drivers.get(position["driver"])
+			if current and current.timestamp > timestamp:
+				return False
+
+			if current:
+				self._remove_from_cell(current)
+
+			entry = frappe._dict(current or {})
+			entry.update(position)
+			entry.timestamp = timestamp
+			entry.latitude = float(entry.latitude)
+			entry.longitude = float(entry.longitude)
+			entry.cell = self.get_cell(entry.latitude, entry.longitude)
+
+			self.drivers[entry.driver] = entry
+			self.cells.setdefault(entry.cell, set()).add(entry.driver)
+
+		return True
+
+	def set_available(self, driver, is_available):
+		with self.lock:
+			entry = self.drivers.get(driver)
+			if entry:
+				entry.is_available = is_available
+
+	def remove(self, driver):
+		with self.lock:
+			entry = self.drivers.pop(driver, None)
+			if entry:
+				self._remove_from_cell(entry)
+
+	def evict_stale(self, now=None):
+		"""Drop drivers whose last position is older than the freshness window"""
+		cutoff = (now or now_datetime()) - self.max_age
+
+		with self.lock:
+			stale = [driver for driver, entry in self.drivers.items() if entry.timestamp < cutoff]
+			for driver in stale:
+				self.remove(driver)
+
+		return len(stale)
+
+	def radius(self, latitude, longitude, radius_km, limit=None, now=None, condition=None):
+		"""Fresh drivers within `radius_km`, closest first.
+
+		`condition` is an optional predicate on each entry (e.g. availability)
+		applied before `limit`, so the result is filled with matching drivers.
+		"""
+		cutoff = (now or now_datetime()) - self.max_age
+		box = get_bounding_box(latitude, longitude, radius_km)
+		min_row, min_col = self.get_cell(box["min_lat"], box["min_lon"])
+		max_row, max_col = self.get_cell(box["max_lat"], box["max_lon"])
+
+		results = []
+		with self.lock:
+			for row in range(min_row, max_row + 1):
+				for col in range(min_col, max_col + 1):
+					for driver in self.cells.get((row, col), ()):
+						entry = self.drivers[driver]
+						if entry.timestamp < cutoff or (condition and not condition(entry)):
+							continue
+
+						distance = haversine_distance(latitude, longitude, entry.latitude, entry.longitude)
+						if distance <= radius_km:
+							result = frappe._dict(entry)
+							result.pop("cell", None)
+							result.distance = distance
+							results.append(result)
+
+		results.sort(key=lambda result: result.distance)
+
+		return results[:int(limit)] if limit else results
+
+	def nearest(self, latitude, longitude, k, max_radius_km, now=None, condition=None):
+		"""The `k` closest fresh drivers within `max_radius_km`"""
+		radius_km = min(FLEET_KNN_START_RADIUS_KM, max_radius_km)
+
+		while True:
+			results = self.radius(latitude, longitude, radius_km, limit=k, now=now, condition=condition)
+			if len(results) >= k or radius_km >= max_radius_km:
+				return results
+			radius_km = min(radius_km * 2, max_radius_km)
+
+	def rebuild(self):
+		"""Reload every fresh driver position from the database"""
+		positions = self._load_positions("dp.timestamp >= DATE_SUB(NOW(), INTERVAL %s MINUTE)",
+			[int(self.max_age.total_seconds() // 60)])
+
+		with self.lock:
+			self.cells = {}
+			self.drivers = {}
+			self._apply(positions)
+
+	def refresh(self):
+		"""Pull positions modified since the last load, then evict stale drivers"""
+		if self.last_modified is None:
+			return self.rebuild()
+
+		positions = self._load_positions("dp.modified >= %s", [self.last_modified])
+
+		with self.lock:
+			self._apply(positions)
+			self.evict_stale()
+
+	def _apply(self, positions):
+		for position in positions:
+			modified = position.pop("modified")
+			if self.last_modified is None or modified > self.last_modified:
+				self.last_modified = modified
+			self.upsert(position)
+
+		if self.last_modified is None:
+			self.last_modified = now_datetime()
+		self.refreshed_at = time.monotonic()
+
+	def _load_positions(self, condition, values):
+		return frappe.db.sql("""
+			SELECT
+				dp.driver,
+				dp.latitude,
+				dp.longitude,
+				dp.timestamp,
+				dp.speed,
+				dp.heading,
+				dp.is_available,
+				dp.modified,
+				u.full_name as driver_name,
+				u.mobile_no as driver_mobile
+			FROM `tabDriver Position` dp
+			LEFT JOIN `tabUser` u ON dp.driver = u.name
+			WHERE {0}
+		""".format(condition), values, as_dict=True)
+
+	def _remove_from_cell(self, entry):
+		drivers = self.cells.get(entry.cell)
+		if drivers is not None:
+			drivers.discard(entry.driver)
+			if not drivers:
+				del self.cells[entry.cell]
+
+def get_fleet_index():
+	"""Return this process's index for the current site, loading or refreshing it as needed"""
+	site = getattr(frappe.local, "site", None)
+
+	with _fleet_indexes_lock:
+		index = _fleet_indexes.get(site)
+		if index is None:
+			index = _fleet_indexes[site] = FleetIndex()
+			index.rebuild()
+			return index
+
+	if time.monotonic() - index.refreshed_at >= FLEET_REFRESH_SECONDS:
+		index.refresh()
+
+	return index
+
+def update_fleet_index(positions):
+	"""Apply committed position upserts to this process's index, if it is loaded"""
+	index = _fleet_indexes.get(getattr(frappe.local, "site", None))
+	if index is None:
+		return
+
+	for position in positions:
+		index.upsert(position)
+
+def update_fleet_availability(driver, is_available):
+	"""Apply a committed availability change to this process's index, if it is loaded"""
+	index = _fleet_indexes.get(getattr(frappe.local, "site", None))
+	if index is not None:
+		index.set_available(driver, is_available)
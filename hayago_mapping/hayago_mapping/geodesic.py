@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+Batch geodesic kernels.
+
+Distance, bearing, path length, point-to-segment distance and bounding box
+functions that take either single coordinates or sequences of them. Scalar
+arguments are broadcast against sequences, so one origin can be measured
+against many candidates in a single call. Batches are computed with NumPy
+when it is installed and large enough to repay the conversion; otherwise,
+and for single points, a pure-Python path gives the same results.
+
+Sequence results are returned as plain lists of floats so callers can
+index, slice and JSON-encode them whichever backend was used.
+"""
+
+from __future__ import unicode_literals
+import itertools
+import math
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+EARTH_RADIUS_KM = 6371.0
+
+# Approximate length of a degree of latitude, as used for bounding boxes
+KM_PER_DEGREE = 111.0
+
+# Below this many elements the Python loop beats NumPy's conversion overhead
+NUMPY_MIN_SIZE = 32
+
+def haversine(lat1, lon1, lat2, lon2):
+	"""Great-circle distance in kilometers.
+
+	Returns a float when all arguments are numbers, otherwise a list with
+	one distance per element of the (broadcast) sequences.
+	"""
+	if _all_scalars(lat1, lon1, lat2, lon2):
+		return _haversine(lat1, lon1, lat2, lon2)
+
+	size = _broadcast_size(lat1, lon1, lat2, lon2)
+	if _use_numpy(size):
+		return _haversine_array(lat1, lon1, lat2, lon2).tolist()
+
+	return [_haversine(*row) for row in zip(*_columns(lat1, lon1, lat2, lon2))]
+
+def bearing(lat1, lon1, lat2, lon2):
+	"""Initial bearing from the first point to the second, in degrees (0-360).
+
+	Broadcasts like `haversine`.
+	"""
+	if _all_scalars(lat1, lon1, lat2, lon2):
+		return _bearing(lat1, lon1, lat2, lon2)
+
+	size = _broadcast_size(lat1, lon1, lat2, lon2)
+	if _use_numpy(size):
+		lat1, lon1, lat2, lon2 = (numpy.radians(numpy.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+		dlon = lon2 - lon1
+		y = numpy.sin(dlon) * numpy.cos(lat2)
+		x = numpy.cos(lat1) * numpy.sin(lat2) - numpy.sin(lat1) * numpy.cos(lat2) * numpy.cos(dlon)
+		return ((numpy.degrees(numpy.arctan2(y, x)) + 360) % 360).tolist()
+
+	return [_bearing(*row) for row in zip(*_columns(lat1, lon1, lat2, lon2))]
+
+def path_length(latitudes, longitudes):
+	"""Cumulative distance (km) from the first point of a path to each point.
+
+	The first element is 0 and the last is the length of the whole path;
+	an empty path gives an empty list.
+	"""
+	size = len(latitudes)
+	if size == 0:
+		return []
+
+	if _use_numpy(size):
+		latitudes = numpy.asarray(latitudes, dtype=float)
+		longitudes = numpy.asarray(longitudes, dtype=float)
+		steps = _haversine_array(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+		return numpy.concatenate(([0.0], numpy.cumsum(steps))).tolist()
+
+	cumulative = [0.0]
+	total = 0.0
+	for i in range(1, size):
+		total += _haversine(latitudes[i - 1], longitudes[i - 1], latitudes[i], longitudes[i])
+		cumulative.append(total)
+	return cumulative
+
+def point_segment_distance(latitude, longitude, latitudes, longitudes):
+	"""Distance (km) from a point to each segment of a path.
+
+	Uses an equirectangular projection centred on the point, which is
+	accurate to well under a meter over city distances. Returns
+	`(distances, fractions)`, one entry per segment, where the fraction is
+	how far along the segment (0-1) the closest point lies.
+	"""
+	if len(latitudes) < 2:
+		return [], []
+
+	scale_x = math.radians(1) * EARTH_RADIUS_KM * math.cos(math.radians(latitude))
+	scale_y = math.radians(1) * EARTH_RADIUS_KM
+
+	if _use_numpy(len(latitudes)):
+		xs = (numpy.asarray(longitudes, dtype=float) - longitude) * scale_x
+		ys = (numpy.asarray(latitudes, dtype=float) - latitude) * scale_y
+		x1, y1, dx, dy = xs[:-1], ys[:-1], numpy.diff(xs), numpy.diff(ys)
+		length_sq = dx * dx + dy * dy
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			fractions = numpy.where(length_sq > 0, -(x1 * dx + y1 * dy) / length_sq, 0.0)
+		fractions = numpy.clip(fractions, 0.0, 1.0)
+		distances = numpy.hypot(x1 + fractions * dx, y1 + fractions * dy)
+		return distances.tolist(), fractions.tolist()
+
+	distances, fractions = [], []
+	previous = None
+	for lat, lng in zip(latitudes, longitudes):
+		point = ((lng - longitude) * scale_x, (lat - latitude) * scale_y)
+		if previous is not None:
+			(x1, y1), (x2, y2) = previous, point
+			dx, dy = x2 - x1, y2 - y1
+			length_sq = dx * dx + dy * dy
+			fraction = min(max(-(x1 * dx + y1 * dy) / length_sq, 0.0), 1.0) if length_sq > 0 else 0.0
+			distances.append(math.hypot(x1 + fraction * dx, y1 + fraction * dy))
+			fractions.append(fraction)
+		previous = point
+	return distances, fractions
+
+def bounding_box(latitude, longitude, radius_km):
+	"""Box of `radius_km` around a point, as min_lat, max_lat, min_lon, max_lon.
+
+	With sequences of centres each key holds a list, one box per centre.
+	"""
+	if _all_scalars(latitude, longitude, radius_km):
+		return _bounding_box(latitude, longitude, radius_km)
+
+	size = _broadcast_size(latitude, longitude, radius_km)
+	if _use_numpy(size):
+		latitude, longitude, radius_km = (numpy.asarray(value, dtype=float) for value in (latitude, longitude, radius_km))
+		lat_offset = radius_km / KM_PER_DEGREE
+		lon_offset = radius_km / (KM_PER_DEGREE * numpy.cos(numpy.radians(latitude)))
+		return {
+			"min_lat": (latitude - lat_offset).tolist(),
+			"max_lat": (latitude + lat_offset).tolist(),
+			"min_lon": (longitude - lon_offset).tolist(),
+			"max_lon": (longitude + lon_offset).tolist()
+		}
+
+	boxes = [_bounding_box(*row) for row in zip(*_columns(latitude, longitude, radius_km))]
+	return {key: [box[key] for box in boxes] for key in ("min_lat", "max_lat", "min_lon", "max_lon")}
+
+def _haversine(lat1, lon1, lat2, lon2, radians=math.radians, sin=math.sin, cos=math.cos, asin=math.asin, sqrt=math.sqrt):
+	lat1, lat2 = radians(lat1), radians(lat2)
+	a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin(radians(lon2 - lon1) / 2) ** 2
+	return 2 * EARTH_RADIUS_KM * asin(sqrt(min(a, 1.0)))
+
+def _haversine_array(lat1, lon1, lat2, lon2):
+	lat1, lon1, lat2, lon2 = (numpy.radians(numpy.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+	a = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2
+	return 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+
+def _bearing(lat1, lon1, lat2, lon2):
+	lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+	dlon = lon2 - lon1
+	y = math.sin(dlon) * math.cos(lat2)
+	x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dlon)
+	return (math.degrees(math.atan2(y, x)) + 360) % 360
+
+def _bounding_box(latitude, longitude, radius_km):
+	lat_offset = radius_km / KM_PER_DEGREE
+	lon_offset = radius_km / (KM_PER_DEGREE * math.cos(math.radians(latitude)))
+	return {
+		"min_lat": latitude - lat_offset,
+		"max_lat": latitude + lat_offset,
+		"min_lon": longitude - lon_offset,
+		"max_lon": longitude + lon_offset
+	}
+
+def _is_sequence(value):
+	return hasattr(value, "__len__") and not isinstance(value, (str, bytes))
+
+def _all_scalars(*values):
+	for value in values:
+		if _is_sequence(value):
+			return False
+	return True
+
+def _broadcast_size(*values):
+	"""Common length of the sequence arguments"""
+	size = None
+	for value in values:
+		if _is_sequence(value):
+			if size is None:
+				size = len(value)
+			elif len(value) != size:
+				raise ValueError("Coordinate sequences must have the same length")
+	return size
+
+def _columns(*values):
+	"""Sequence arguments as they are, scalars repeated alongside them"""
+	return [value if _is_sequence(value) else itertools.repeat(value) for value in values]
+
+def _use_numpy(size):
+	return numpy is not None and size >= NUMPY_MIN_SIZE
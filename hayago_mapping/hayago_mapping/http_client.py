@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+Shared HTTP clients for the upstream map services.
+
+Each upstream (GraphHopper, Nominatim) gets one `requests.Session` per
+process, so connections are kept alive and reused instead of paying a TCP
+and TLS handshake on every call. Responses are gzip-compressed where the
+server supports it. A circuit breaker fails fast while an upstream keeps
+failing, and request latencies are recorded as a histogram in Redis so the
+counts cover every worker.
+"""
+
+from __future__ import unicode_literals
+import requests
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from .cache import get_counters, increment_counter
+
+USER_AGENT = "Hayago Mapping Module/1.0 (Frappe Framework)"
+
+# Connections kept open per upstream host and per process
+UPSTREAM_POOL_SIZE = 10
+
+# Seconds to establish a connection; read timeouts are set per call
+UPSTREAM_CONNECT_TIMEOUT = 3.05
+
+# Consecutive failures that open the circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 30
+
+# Upper bounds (ms) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class CircuitOpenError(requests.RequestException):
+	"""Raised without contacting the upstream while its circuit is open"""
+	pass
+
+class UpstreamClient(object):
+	def __init__(self, name, timeout, pool_size=UPSTREAM_POOL_SIZE,
+			failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+		self.name = name
+		self.timeout = timeout
+		self.failure_threshold = failure_threshold
+		self.reset_seconds = reset_seconds
+
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+		self.session.headers.update({
+			"User-Agent": USER_AGENT,
+			"Accept-Encoding": "gzip, deflate"
+		})
+
+		self.failures = 0
+		self.opened_at = None
+		self.trial_in_flight = False
+		self.lock = threading.Lock()
+
+	def get(self, url, **kwargs):
+		return self.request("GET", url, **kwargs)
+
+	def post(self, url, **kwargs):
+		return self.request("POST", url, **kwargs)
+
+	def request(self, method, url, timeout=None, **kwargs):
+		"""Send a request through the pool.
+
+		Raises CircuitOpenError while the circuit is open, and any
+		`requests.RequestException` from the request itself, so callers keep
+		their existing error handling. 5xx responses count as failures.
+		"""
+		self._check_circuit()
+
+		start = time.monotonic()
+		try:
+			response = self.session.request(method, url,
+				timeout=(UPSTREAM_CONNECT_TIMEOUT, timeout or self.timeout), **kwargs)
+		except requests.RequestException:
+			self._record(start, failed=True)
+			raise
+
+		self._record(start, failed=response.status_code >= 500)
+		return response
+
+	def get_stats(self):
+		stats = get_counters(self._stats_namespace())
+		stats["circuit"] = self._get_circuit_state()
+		stats["consecutive_failures"] = self.failures
+		return stats
+
+	def _check_circuit(self):
+		with self.lock:
+			if self.opened_at is None:
+				return
+
+			# After the reset period one trial request is let through
+			if time.monotonic() - self.opened_at >= self.reset_seconds and not self.trial_in_flight:
+				self.trial_in_flight = True
+				return
+
+		increment_counter(self._stats_namespace(), "rejected")
+		raise CircuitOpenError("{0} is unavailable (circuit open)".format(self.name))
+
+	def _record(self, start, failed):
+		elapsed_ms = (time.monotonic() - start) * 1000
+
+		with self.lock:
+			self.trial_in_flight = False
+			if failed:
+				self.failures += 1
+				if self.failures >= self.failure_threshold or self.opened_at is not None:
+					self.opened_at = time.monotonic()
+			else:
+				self.failures = 0
+				self.opened_at = None
+
+		namespace = self._stats_namespace()
+		bucket = next(("le_{0}ms".format(bound) for bound in LATENCY_BUCKETS_MS if elapsed_ms <= bound), "gt_{0}ms".format(LATENCY_BUCKETS_MS[-1]))
+		increment_counter(namespace, bucket)
+		increment_counter(namespace, "requests")
+		if failed:
+			increment_counter(namespace, "errors")
+
+	def _get_circuit_state(self):
+		if self.opened_at is None:
+			return "closed"
+		if time.monotonic() - self.opened_at >= self.reset_seconds:
+			return "half-open"
+		return "open"
+
+	def _stats_namespace(self):
+		return "hayago_upstream|{0}".format(self.name)
+
+graphhopper = UpstreamClient("graphhopper", timeout=30)
+nominatim = UpstreamClient("nominatim", timeout=10)
+
+def get_upstream_stats():
+	"""Latency buckets, request/error counts and circuit state per upstream"""
+	return {client.name: client.get_stats() for client in (graphhopper, nominatim)}
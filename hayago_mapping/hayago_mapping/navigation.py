@@ -6,16 +6,30 @@ from __future__ import unicode_literals
 import frappe
 import json
 import math
+from . import geodesic
+from .navigation_session import NavigationSession, get_navigation_session, invalidate_navigation_session
 from .routing import get_route
-from .utils import haversine_distance, calculate_bearing
 
-@frappe.whitelist()
-def get_navigation_instructions(trip_id):
-	"""Get turn-by-turn navigation instructions for a trip"""
-	try:
-		trip = frappe.get_doc("Trip", trip_id)
-		
-		# Get route with instructions
+# Trip columns needed to navigate; avoids loading the route log child table
+TRIP_ROUTE_FIELDS = [
+	"name", "driver", "status",
+	"pickup_latitude", "pickup_longitude", "dropoff_latitude", "dropoff_longitude",
+	"route_geojson", "route_instructions"
+]
+
+def get_trip_route(trip_id):
+	"""Trip row with its stored route, as (trip, route).
+
+	`route` holds distance_km, duration_minutes, instructions and the parsed
+	`coordinates` of the planned route. Trips created before routes were
+	stored get theirs computed and saved once. Raises DoesNotExistError for
+	unknown trips; returns (trip, error response) if routing fails.
+	"""
+	trip = frappe.db.get_value("Trip", trip_id, TRIP_ROUTE_FIELDS, as_dict=True)
+	if not trip:
+		raise frappe.DoesNotExistError
+	
+	if not trip.route_instructions:
 		route_result = get_route(
 			trip.pickup_latitude,
 			trip.pickup_longitude,
@@ -26,43 +40,71 @@ def get_navigation_instructions(trip_id):
 		)
 		
 		if route_result.get("status") != "success":
-			return route_result
+			return trip, route_result
 		
-		instructions = route_result.get("instructions", [])
-		
-		# Process instructions for better navigation display
-		processed_instructions = []
-		for i, instruction in enumerate(instructions):
-			processed_instruction = {
-				"step": i + 1,
-				"text": instruction.get("text", ""),
-				"distance": instruction.get("distance", 0),
-				"time": instruction.get("time", 0),
-				"sign": instruction.get("sign", 0),
-				"direction": get_direction_text(instruction.get("sign", 0)),
-				"maneuver": get_maneuver_type(instruction.get("sign", 0))
-			}
-			
-			# Add coordinate information if available
-			if "interval" in instruction and len(instruction["interval"]) >= 2:
-				start_idx = instruction["interval"][0]
-				end_idx = instruction["interval"][1]
-				
-				# Extract coordinates from route if available
-				if trip.route_geojson:
-					route_data = json.loads(trip.route_geojson)
-					if "coordinates" in route_data and len(route_data["coordinates"]) > end_idx:
-						processed_instruction["start_coordinate"] = route_data["coordinates"][start_idx]
-						processed_instruction["end_coordinate"] = route_data["coordinates"][end_idx]
-			
-			processed_instructions.append(processed_instruction)
+		store_trip_route(trip, route_result)
+		# Navigation reads arrive as GET, which Frappe does not auto-commit
+		frappe.db.commit()
+	
+	route = json.loads(trip.route_instructions)
+	route["coordinates"] = json.loads(trip.route_geojson).get("coordinates", []) if trip.route_geojson else []
+	
+	return trip, route
+
+def store_trip_route(trip, route_result):
+	"""Save a routing.get_route result as the trip's planned route"""
+	from hayago_mapping.hayago_mapping.doctype.trip.trip import dump_route_instructions
+	
+	trip.route_geojson = json.dumps(route_result["route_geojson"]) if route_result.get("route_geojson") else None
+	trip.route_instructions = dump_route_instructions(route_result)
+	
+	frappe.db.set_value("Trip", trip.name, {
+		"route_geojson": trip.route_geojson,
+		"route_instructions": trip.route_instructions
+	}, update_modified=False)
+	
+	frappe.db.after_commit.add(lambda: invalidate_navigation_session(trip.name))
+
+def process_instructions(route):
+	"""Stored instructions in the shape returned by the navigation endpoints"""
+	coordinates = route.get("coordinates", [])
+	
+	processed_instructions = []
+	for i, instruction in enumerate(route.get("instructions", [])):
+		processed_instruction = {
+			"step": i + 1,
+			"text": instruction.get("text", ""),
+			"distance": instruction.get("distance", 0),
+			"time": instruction.get("time", 0),
+			"sign": instruction.get("sign", 0),
+			"direction": get_direction_text(instruction.get("sign", 0)),
+			"maneuver": get_maneuver_type(instruction.get("sign", 0))
+		}
+		
+		# Add coordinate information if available
+		interval = instruction.get("interval", [])
+		if len(interval) >= 2 and len(coordinates) > interval[1]:
+			processed_instruction["start_coordinate"] = coordinates[interval[0]]
+			processed_instruction["end_coordinate"] = coordinates[interval[1]]
+		
+		processed_instructions.append(processed_instruction)
+	
+	return processed_instructions
+
+@frappe.whitelist()
+def get_navigation_instructions(trip_id):
+	"""Get turn-by-turn navigation instructions for a trip from its stored route"""
+	try:
+		trip, route = get_trip_route(trip_id)
+		if route.get("status") == "error":
+			return route
 		
 		return {
 			"status": "success",
 			"trip_id": trip_id,
-			"instructions": processed_instructions,
-			"total_distance": route_result.get("distance_km", 0),
-			"total_duration": route_result.get("duration_minutes", 0)
+			"instructions": process_instructions(route),
+			"total_distance": route.get("distance_km", 0),
+			"total_duration": route.get("duration_minutes", 0)
 		}
 		
 	except frappe.DoesNotExistError:
@@ -78,66 +120,111 @@ def get_navigation_instructions(trip_id):
 		}
 
 @frappe.whitelist()
-def get_next_instruction(trip_id, current_lat, current_lng):
-	"""Get the next navigation instruction based on current location"""
+def reroute_trip(trip_id, current_lat, current_lng):
+	"""Compute a new route from the driver's position to the dropoff and store it"""
 	try:
-		trip = frappe.get_doc("Trip", trip_id)
+		# The route is written with set_value, which skips document permissions
+		frappe.has_permission("Trip", "write", trip_id, throw=True)
 		
-		# Get all navigation instructions
-		nav_result = get_navigation_instructions(trip_id)
-		if nav_result.get("status") != "success":
-			return nav_result
+		trip = frappe.db.get_value("Trip", trip_id, TRIP_ROUTE_FIELDS, as_dict=True)
+		if not trip:
+			raise frappe.DoesNotExistError
+		
+		if trip.status not in ["Accepted", "On Route"]:
+			return {
+				"status": "error",
+				"message": "Trip is not active"
+			}
+		
+		route_result = get_route(
+			current_lat,
+			current_lng,
+			trip.dropoff_latitude,
+			trip.dropoff_longitude,
+			vehicle="car",
+			alternatives=False
+		)
+		
+		if route_result.get("status") != "success":
+			return route_result
+		
+		store_trip_route(trip, route_result)
+		frappe.db.commit()
+		
+		return get_navigation_instructions(trip_id)
 		
-		instructions = nav_result.get("instructions", [])
+	except frappe.DoesNotExistError:
+		return {
+			"status": "error",
+			"message": "Trip not found"
+		}
+	except frappe.PermissionError:
+		raise
+	except Exception as e:
+		frappe.log_error(frappe.get_traceback(), "Reroute Trip Error")
+		return {
+			"status": "error",
+			"message": str(e)
+		}
+
+def get_trip_navigation_session(trip_id):
+	"""The trip's NavigationSession, or an error response if it has no route"""
+	def load(version):
+		trip, route = get_trip_route(trip_id)
+		if route.get("status") == "error":
+			return route
+		
+		return NavigationSession(route, process_instructions(route), version)
+	
+	return get_navigation_session(trip_id, load)
+
+@frappe.whitelist()
+def get_next_instruction(trip_id, current_lat, current_lng):
+	"""Get the next navigation instruction based on current location.
+
+	The position is snapped to the trip's stored route, and distances to the
+	next turn and to the destination are measured along the route (km).
+	"""
+	try:
+		session = get_trip_navigation_session(trip_id)
+		if isinstance(session, dict):
+			return session
 		
-		if not instructions:
+		location = session.locate(float(current_lat), float(current_lng))
+		if not session.instructions or location is None:
 			return {
 				"status": "error",
 				"message": "No navigation instructions available"
 			}
 		
-		# Find the closest instruction based on current location
-		min_distance = float('inf')
-		next_instruction = instructions[0]
-		instruction_index = 0
-		
-		for i, instruction in enumerate(instructions):
-			if "start_coordinate" in instruction:
-				coord = instruction["start_coordinate"]
-				distance = haversine_distance(
-					current_lat, current_lng,
-					coord[1], coord[0]  # GeoJSON uses [lng, lat]
-				)
-				
-				if distance < min_distance:
-					min_distance = distance
-					next_instruction = instruction
-					instruction_index = i
+		next_instruction = dict(session.instructions[location["instruction_index"]])
 		
 		# Calculate bearing to next instruction
 		if "start_coordinate" in next_instruction:
 			coord = next_instruction["start_coordinate"]
-			bearing = calculate_bearing(
-				current_lat, current_lng,
+			bearing = geodesic.bearing(
+				float(current_lat), float(current_lng),
 				coord[1], coord[0]  # GeoJSON uses [lng, lat]
 			)
 			next_instruction["bearing"] = bearing
 		
-		# Calculate distance to destination
-		dest_distance = haversine_distance(
-			current_lat, current_lng,
-			trip.dropoff_latitude, trip.dropoff_longitude
-		)
-		
 		return {
 			"status": "success",
 			"current_instruction": next_instruction,
-			"instruction_index": instruction_index,
-			"total_instructions": len(instructions),
-			"distance_to_destination": dest_distance,
-			"distance_to_next_turn": min_distance
+			"instruction_index": location["instruction_index"],
+			"total_instructions": len(session.instructions),
+			"distance_to_destination": location["distance_to_destination"],
+			"distance_to_next_turn": location["distance_to_next_turn"],
+			"distance_along_route": location["distance_along_route"],
+			"off_route_distance": location["off_route_distance"],
+			"snapped_coordinate": location["snapped_coordinate"]
 		}
 		
+	except frappe.DoesNotExistError:
+		return {
+			"status": "error",
+			"message": "Trip not found"
+		}
 	except Exception as e:
 		frappe.log_error(frappe.get_traceback(), "Next Instruction Error")
 		return {
@@ -148,40 +235,77 @@ def get_next_instruction(trip_id, current_lat, current_lng):
 @frappe.whitelist()
 def log_route_point(trip_id, latitude, longitude, speed=None, timestamp=None):
 	"""Log a route point for trip tracking"""
+	result = log_route_points(trip_id, [{
+		"latitude": latitude,
+		"longitude": longitude,
+		"speed": speed,
+		"timestamp": timestamp
+	}])
+	
+	if result.get("status") != "success":
+		return result
+	
+	if result["failed"]:
+		return {"status": "error", "message": result["results"][0]}
+	
+	return {
+		"status": "success",
+		"message": "Route point logged successfully"
+	}
+
+@frappe.whitelist()
+def log_route_points(trip_id, points):
+	"""Append a batch of route points to a trip.
+
+	`points` is a list (or JSON string) of objects with latitude, longitude
+	and optional speed and timestamp. The Route Log rows and the driver's
+	Driver Location rows are written in one transaction, without loading or
+	saving the Trip document. `results` has one entry per point: 1 if it was
+	stored, otherwise the error message.
+	"""
+	from hayago_mapping.hayago_mapping.doctype.driver_location.driver_location import bulk_insert_driver_locations
+	from hayago_mapping.hayago_mapping.doctype.route_log.route_log import append_route_logs
+	from hayago_mapping.hayago_mapping.doctype.trip.trip import TRIP_PROGRESS_FIELDS
+	
 	try:
-		trip = frappe.get_doc("Trip", trip_id)
+		if isinstance(points, str):
+			points = json.loads(points)
 		
-		# Validate coordinates
-		if not (-90 <= float(latitude) <= 90):
-			return {"status": "error", "message": "Invalid latitude"}
+		if not isinstance(points, list):
+			return {"status": "error", "message": "Points must be a list"}
 		
-		if not (-180 <= float(longitude) <= 180):
-			return {"status": "error", "message": "Invalid longitude"}
+		frappe.has_permission("Trip", "write", trip_id, throw=True)
 		
-		# Add route log entry
-		route_log = {
-			"timestamp": timestamp or frappe.utils.now(),
-			"latitude": float(latitude),
-			"longitude": float(longitude),
-			"speed": float(speed) if speed else None
-		}
+		# Row lock serializes appends to the same trip
+		trip = frappe.db.sql("""
+			SELECT name, driver, {0} FROM `tabTrip` WHERE name = %s FOR UPDATE
+		""".format(", ".join(TRIP_PROGRESS_FIELDS)), (trip_id,), as_dict=True)
+		if not trip:
+			raise frappe.DoesNotExistError
+		trip = trip[0]
 		
-		trip.append("route_logs", route_log)
-		trip.save()
+		logged = append_route_logs(trip, points)
 		
-		# Also update driver location
-		from .api import update_driver_location_api
-		update_driver_location_api(
-			driver=trip.driver,
-			latitude=latitude,
-			longitude=longitude,
-			speed=speed,
-			trip=trip_id
-		)
+		stored = [point for point, error in logged if point]
+		if stored:
+			bulk_insert_driver_locations([{
+				"driver": trip.driver,
+				"timestamp": point["timestamp"],
+				"latitude": point["latitude"],
+				"longitude": point["longitude"],
+				"speed": point["speed"],
+				"trip": trip.name
+			} for point in stored])
+		
+		frappe.db.commit()
+		
+		results = [1 if point else error for point, error in logged]
 		
 		return {
 			"status": "success",
-			"message": "Route point logged successfully"
+			"logged": len(stored),
+			"failed": len(results) - len(stored),
+			"results": results
 		}
 		
 	except frappe.DoesNotExistError:
@@ -189,7 +313,10 @@ def log_route_point(trip_id, latitude, longitude, speed=None, timestamp=None):
 			"status": "error",
 			"message": "Trip not found"
 		}
+	except frappe.PermissionError:
+		raise
 	except Exception as e:
+		frappe.db.rollback()
 		frappe.log_error(frappe.get_traceback(), "Route Point Logging Error")
 		return {
 			"status": "error",
@@ -245,26 +372,48 @@ def start_trip_navigation(trip_id):
 
 @frappe.whitelist()
 def complete_trip(trip_id, end_latitude=None, end_longitude=None):
-	"""Complete a trip and calculate final metrics"""
+	"""Complete a trip and record its final metrics.
+
+	The metrics come from the progress aggregates kept as points are logged,
+	and only the Trip row is written, so completing costs the same however
+	many route points the trip has.
+	"""
+	from hayago_mapping.hayago_mapping.doctype.driver_position.driver_position import update_driver_availability
+	
 	try:
-		trip = frappe.get_doc("Trip", trip_id)
+		# Written with set_value, which skips document permissions
+		frappe.has_permission("Trip", "write", trip_id, throw=True)
 		
-		if trip.status != "On Route":
+		if frappe.db.get_value("Trip", trip_id, "status") != "On Route":
+			if not frappe.db.exists("Trip", trip_id):
+				raise frappe.DoesNotExistError
+			
 			return {
 				"status": "error",
 				"message": "Trip is not currently on route"
 			}
 		
-		# Update trip status and end time
-		trip.status = "Completed"
-		trip.end_time = frappe.utils.now()
-		
-		# Log final location if provided
+		# Log final location if provided, so it counts towards the distance
 		if end_latitude and end_longitude:
 			log_route_point(trip_id, end_latitude, end_longitude)
 		
-		# Calculate final cost (this will be done in the trip's before_save method)
-		trip.save()
+		trip = frappe.db.get_value("Trip", trip_id,
+			["name", "driver", "start_time", "distance_covered", "actual_duration", "actual_cost"], as_dict=True)
+		
+		values = {
+			"status": "Completed",
+			"end_time": frappe.utils.now_datetime(),
+			"actual_distance": frappe.utils.flt(trip.distance_covered)
+		}
+		if trip.start_time:
+			values["actual_duration"] = frappe.utils.time_diff_in_seconds(values["end_time"], trip.start_time) / 60.0
+		
+		frappe.db.set_value("Trip", trip_id, values)
+		trip.update(values)
+		
+		# Trip.on_update does not run for set_value
+		update_driver_availability(trip.driver)
+		frappe.db.commit()
 		
 		return {
 			"status": "success",
@@ -285,6 +434,8 @@ def complete_trip(trip_id, end_latitude=None, end_longitude=None):
 			"status": "error",
 			"message": "Trip not found"
 		}
+	except frappe.PermissionError:
+		raise
 	except Exception as e:
 		frappe.log_error(frappe.get_traceback(), "Complete Trip Error")
 		return {
@@ -332,11 +483,20 @@ def get_maneuver_type(sign_code):
 
 @frappe.whitelist()
 def get_trip_progress(trip_id):
-	"""Get current progress of a trip"""
+	"""Get current progress of a trip.
+
+	Reads the aggregates kept up to date as route points are logged, so
+	the cost does not depend on how many points the trip has.
+	"""
+	from hayago_mapping.hayago_mapping.doctype.trip.trip import TRIP_PROGRESS_FIELDS
+	
 	try:
-		trip = frappe.get_doc("Trip", trip_id)
+		trip = frappe.db.get_value("Trip", trip_id,
+			["estimated_distance", "dropoff_latitude", "dropoff_longitude"] + TRIP_PROGRESS_FIELDS, as_dict=True)
+		if not trip:
+			raise frappe.DoesNotExistError
 		
-		if not trip.route_logs:
+		if not trip.route_point_count:
 			return {
 				"status": "success",
 				"progress": 0,
@@ -344,40 +504,33 @@ def get_trip_progress(trip_id):
 				"estimated_remaining": trip.estimated_distance or 0
 			}
 		
-		# Calculate distance covered from route logs
-		total_distance = 0
-		for i in range(1, len(trip.route_logs)):
-			prev_log = trip.route_logs[i-1]
-			curr_log = trip.route_logs[i]
-			
-			distance = haversine_distance(
-				prev_log.latitude, prev_log.longitude,
-				curr_log.latitude, curr_log.longitude
-			)
-			total_distance += distance
-		
 		# Calculate progress percentage
+		total_distance = trip.distance_covered or 0
 		estimated_distance = trip.estimated_distance or 0
 		progress_percentage = 0
 		if estimated_distance > 0:
 			progress_percentage = min((total_distance / estimated_distance) * 100, 100)
 		
 		# Calculate remaining distance to destination
-		if trip.route_logs:
-			last_log = trip.route_logs[-1]
-			remaining_distance = haversine_distance(
-				last_log.latitude, last_log.longitude,
-				trip.dropoff_latitude, trip.dropoff_longitude
-			)
-		else:
-			remaining_distance = estimated_distance
+		remaining_distance = geodesic.haversine(
+			trip.last_latitude, trip.last_longitude,
+			trip.dropoff_latitude, trip.dropoff_longitude
+		)
 		
 		return {
 			"status": "success",
 			"progress": progress_percentage,
 			"distance_covered": total_distance,
 			"estimated_remaining": remaining_distance,
-			"total_route_points": len(trip.route_logs)
+			"total_route_points": trip.route_point_count,
+			"moving_time": trip.moving_time,
+			"max_speed": trip.max_speed,
+			"avg_speed": trip.avg_speed,
+			"last_point": {
+				"timestamp": trip.last_point_time,
+				"latitude": trip.last_latitude,
+				"longitude": trip.last_longitude
+			}
 		}
 		
 	except frappe.DoesNotExistError:
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+Per-trip navigation sessions.
+
+A session holds a trip's planned route in the form needed on every GPS tick:
+the polyline projected to meters, cumulative distances along it, the point
+at which each instruction starts, and a grid of segments. The current
+position is snapped to the nearest segment by looking only at the grid
+cells around it, and the next maneuver is found by binary search over the
+instruction start points, so a tick costs the same for a 5 km or a 500 km
+route.
+
+Sessions are kept per process and per site. A reroute bumps the trip's route
+version in Redis so every worker rebuilds its session on the next tick.
+"""
+
+from __future__ import unicode_literals
+import bisect
+import frappe
+import math
+import threading
+import time
+from collections import OrderedDict
+from . import geodesic
+
+# Grid cell size in meters used to find segments near the driver
+SEGMENT_CELL_METERS = 250
+
+# Rings of cells searched before falling back to scanning every segment
+SEGMENT_SEARCH_RINGS = 4
+
+# Sessions kept per process, and how long one is used before reloading
+NAVIGATION_SESSION_MAX_ENTRIES = 1000
+NAVIGATION_SESSION_TTL = 3600
+
+# Route versions outlive the sessions they invalidate
+ROUTE_VERSION_TTL = 24 * 3600
+
+EARTH_RADIUS_M = 6371000.0
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+class NavigationSession(object):
+	def __init__(self, route, instructions, version=None):
+		"""`route` is a stored trip route (see navigation.get_trip_route) and
+		`instructions` its processed instructions, as returned to clients.
+		"""
+		self.version = version
+		self.loaded_at = time.monotonic()
+		self.instructions = instructions
+		self.points = [(float(lat), float(lng)) for lng, lat in route.get("coordinates", [])]
+
+		# Local equirectangular projection, accurate to well under a meter at city scale
+		mean_lat = sum(lat for lat, lng in self.points) / len(self.points) if self.points else 0
+		self.scale_x = math.radians(1) * EARTH_RADIUS_M * math.cos(math.radians(mean_lat))
+		self.scale_y = math.radians(1) * EARTH_RADIUS_M
+		self.projected = [self.project(lat, lng) for lat, lng in self.points]
+
+		# Cumulative distance (km) from the start of the route to each point
+		self.cumulative = geodesic.path_length([lat for lat, lng in self.points], [lng for lat, lng in self.points]) or [0.0]
+
+		# Point index at which each instruction starts, for bisecting
+		self.instruction_starts = []
+		for instruction in route.get("instructions", []):
+			start = (instruction.get("interval") or [None])[0]
+			if start is None:
+				start = self.instruction_starts[-1] if self.instruction_starts else 0
+			self.instruction_starts.append(min(start, max(len(self.points) - 1, 0)))
+
+		self.cells = {}
+		for segment in range(len(self.points) - 1):
+			(x1, y1), (x2, y2) = self.projected[segment], self.projected[segment + 1]
+			min_col, min_row = self.get_cell(min(x1, x2), min(y1, y2))
+			max_col, max_row = self.get_cell(max(x1, x2), max(y1, y2))
+			for row in range(min_row, max_row + 1):
+				for col in range(min_col, max_col + 1):
+					self.cells.setdefault((col, row), []).append(segment)
+
+	@property
+	def total_distance(self):
+		return self.cumulative[-1]
+
+	def project(self, latitude, longitude):
+		return (longitude * self.scale_x, latitude * self.scale_y)
+
+	def get_cell(self, x, y):
+		return (int(math.floor(x / SEGMENT_CELL_METERS)), int(math.floor(y / SEGMENT_CELL_METERS)))
+
+	def snap(self, latitude, longitude):
+		"""Closest point on the route, as (segment, fraction along it, meters off route).
+
+		Returns None for routes without segments.
+		"""
+		if len(self.points) < 2:
+			return None
+
+		x, y = self.project(float(latitude), float(longitude))
+		col, row = self.get_cell(x, y)
+
+		best = None
+		seen = set()
+		for ring in range(SEGMENT_SEARCH_RINGS + 1):
+			for cell in self._ring_cells(col, row, ring):
+				for segment in self.cells.get(cell, ()):
+					if segment in seen:
+						continue
+					seen.add(segment)
+					candidate = self._project_on_segment(segment, x, y)
+					if best is None or candidate[2] < best[2]:
+						best = candidate
+
+			# Segments outside the searched rings are at least this far away
+			if best is not None and best[2] <= ring * SEGMENT_CELL_METERS:
+				return best
+
+		if best is None:
+			distances, fractions = geodesic.point_segment_distance(float(latitude), float(longitude),
+				[lat for lat, lng in self.points], [lng for lat, lng in self.points])
+			segment = min(range(len(distances)), key=distances.__getitem__)
+			best = (segment, fractions[segment], distances[segment] * 1000)
+
+		return best
+
+	def locate(self, latitude, longitude):
+		"""Progress along the route for a position.
+
+		Returns the index of the next maneuver, the distance to it and to the
+		end of the route along the route (km), and how far the position is
+		from the route (meters). Returns None for routes without segments.
+		"""
+		snapped = self.snap(latitude, longitude)
+		if snapped is None:
+			return None
+
+		segment, fraction, off_route = snapped
+		along = self.cumulative[segment] + fraction * (self.cumulative[segment + 1] - self.cumulative[segment])
+
+		# The maneuver ahead is the first instruction starting after the snapped segment
+		next_index = bisect.bisect_right(self.instruction_starts, segment)
+		next_index = min(next_index, len(self.instructions) - 1)
+		turn_point = self.instruction_starts[next_index] if self.instructions else len(self.points) - 1
+
+		return {
+			"instruction_index": next_index,
+			"distance_along_route": along,
+			"distance_to_next_turn": max(self.cumulative[turn_point] - along, 0.0),
+			"distance_to_destination": max(self.total_distance - along, 0.0),
+			"off_route_distance": off_route,
+			"snapped_coordinate": self._point_on_segment(segment, fraction)
+		}
+
+	def _project_on_segment(self, segment, x, y):
+		(x1, y1), (x2, y2) = self.projected[segment], self.projected[segment + 1]
+		dx, dy = x2 - x1, y2 - y1
+		length_sq = dx * dx + dy * dy
+
+		fraction = 0.0
+		if length_sq > 0:
+			fraction = min(max(((x - x1) * dx + (y - y1) * dy) / length_sq, 0.0), 1.0)
+
+		return (segment, fraction, math.hypot(x - (x1 + fraction * dx), y - (y1 + fraction * dy)))
+
+	def _point_on_segment(self, segment, fraction):
+		(lat1, lng1), (lat2, lng2) = self.points[segment], self.points[segment + 1]
+		return [lng1 + fraction * (lng2 - lng1), lat1 + fraction * (lat2 - lat1)]
+
+	@staticmethod
+	def _ring_cells(col, row, ring):
+		if ring == 0:
+			return [(col, row)]
+
+		cells = []
+		for offset in range(-ring, ring + 1):
+			cells.extend([(col + offset, row - ring), (col + offset, row + ring)])
+		for offset in range(-ring + 1, ring):
+			cells.extend([(col - ring, row + offset), (col + ring, row + offset)])
+		return cells
+
+def get_route_version_key(trip_id):
+	return "hayago_nav_route|{0}".format(trip_id)
+
+def get_navigation_session(trip_id, load):
+	"""This process's session for a trip, built with `load(version)` when
+	missing, older than NAVIGATION_SESSION_TTL or superseded by a reroute.
+
+	`load` returns a NavigationSession, or a dict (an error response) which
+	is returned as is and not cached.
+	"""
+	site = getattr(frappe.local, "site", None)
+	version = frappe.cache().get_value(get_route_version_key(trip_id))
+
+	with _sessions_lock:
+		sessions = _sessions.setdefault(site, OrderedDict())
+		session = sessions.get(trip_id)
+		if session is not None and session.version == version \
+				and time.monotonic() - session.loaded_at < NAVIGATION_SESSION_TTL:
+			sessions.move_to_end(trip_id)
+			return session
+
+	session = load(version)
+	if not isinstance(session, NavigationSession):
+		return session
+
+	with _sessions_lock:
+		sessions[trip_id] = session
+		sessions.move_to_end(trip_id)
+		while len(sessions) > NAVIGATION_SESSION_MAX_ENTRIES:
+			sessions.popitem(last=False)
+
+	return session
+
+def invalidate_navigation_session(trip_id):
+	"""Make every worker rebuild the trip's session on its next tick"""
+	site = getattr(frappe.local, "site", None)
+	with _sessions_lock:
+		_sessions.get(site, {}).pop(trip_id, None)
+
+	frappe.cache().set_value(get_route_version_key(trip_id), frappe.generate_hash(length=10),
+		expires_in_sec=ROUTE_VERSION_TTL)
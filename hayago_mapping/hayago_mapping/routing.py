@@ -7,8 +7,19 @@ import frappe
 import json
 import requests
 from frappe import _
+from .cache import SharedCache, quantize_coordinate
+from .http_client import graphhopper
 from .utils import get_module_settings, validate_coordinates
 
+# Decimal places kept from route endpoints in cache keys (~11m)
+ROUTE_CACHE_PRECISION = 4
+
+# Cached routes live for an hour; at most this many are kept
+ROUTE_CACHE_TTL = 3600
+ROUTE_CACHE_MAX_ENTRIES = 10000
+
+route_cache = SharedCache("hayago_route", ROUTE_CACHE_TTL, ROUTE_CACHE_MAX_ENTRIES)
+
 @frappe.whitelist()
 def get_route(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, vehicle="car", alternatives=False):
 	"""Get route information from GraphHopper API"""
@@ -24,103 +35,40 @@ def get_route(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, vehicle="car", a
 		
 		settings = get_module_settings()
 		
-		# Prepare GraphHopper API request
-		url = settings.graphhopper_url or "https://graphhopper.com/api/1/route"
-		
-		params = {
-			"point": [f"{pickup_lat},{pickup_lng}", f"{dropoff_lat},{dropoff_lng}"],
-			"vehicle": vehicle,
-			"locale": "en",
-			"calc_points": "true",
-			"debug": "true",
-			"elevation": "false",
-			"points_encoded": "false",
-			"instructions": "true",
-			"alternative_route.max_paths": "3" if alternatives else "1"
-		}
-		
-		if settings.graphhopper_api_key:
-			params["key"] = settings.graphhopper_api_key
-		
-		headers = {
-			'User-Agent': 'Hayago Mapping Module/1.0 (Frappe Framework)'
-		}
-		
-		response = requests.get(url, params=params, headers=headers, timeout=30)
-		response.raise_for_status()
+		# Quantized endpoints let nearby repeat requests (airports, malls,
+		# stations) share one GraphHopper response
+		cache_key = route_cache.make_key(
+			quantize_coordinate(pickup_lat, ROUTE_CACHE_PRECISION),
+			quantize_coordinate(pickup_lng, ROUTE_CACHE_PRECISION),
+			quantize_coordinate(dropoff_lat, ROUTE_CACHE_PRECISION),
+			quantize_coordinate(dropoff_lng, ROUTE_CACHE_PRECISION),
+			vehicle,
+			1 if alternatives else 0
+		)
 		
-		route_data = response.json()
+		route = route_cache.get_or_compute(
+			cache_key,
+			lambda: fetch_route(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, vehicle, alternatives, settings)
+		)
 		
-		if "paths" not in route_data or not route_data["paths"]:
+		if not route:
 			return {
 				"status": "error",
 				"message": "No route found between the specified points"
 			}
 		
-		# Process the main route
-		main_path = route_data["paths"][0]
-		
-		# Extract route information
-		distance_km = main_path.get("distance", 0) / 1000.0
-		duration_minutes = main_path.get("time", 0) / 60000.0
-		
-		# Create GeoJSON for the route
-		route_geojson = None
-		if "points" in main_path and "coordinates" in main_path["points"]:
-			route_geojson = {
-				"type": "LineString",
-				"coordinates": main_path["points"]["coordinates"]
-			}
-		
-		# Extract turn-by-turn instructions
-		instructions = []
-		if "instructions" in main_path:
-			for instruction in main_path["instructions"]:
-				instructions.append({
-					"text": instruction.get("text", ""),
-					"distance": instruction.get("distance", 0),
-					"time": instruction.get("time", 0),
-					"sign": instruction.get("sign", 0),
-					"interval": instruction.get("interval", [])
-				})
-		
-		# Calculate estimated cost
+		# Costs are applied after the cache so rate changes take effect at once
 		cost_per_km = settings.cost_per_km or 1.0
 		cost_per_minute = settings.cost_per_minute or 0.2
-		estimated_cost = (distance_km * cost_per_km) + (duration_minutes * cost_per_minute)
 		
-		result = {
-			"status": "success",
-			"distance_km": distance_km,
-			"duration_minutes": duration_minutes,
-			"estimated_cost": estimated_cost,
-			"route_geojson": route_geojson,
-			"instructions": instructions
-		}
+		result = dict(route, status="success")
+		result["estimated_cost"] = (route["distance_km"] * cost_per_km) + (route["duration_minutes"] * cost_per_minute)
 		
-		# Add alternative routes if requested
-		if alternatives and len(route_data["paths"]) > 1:
-			alternative_routes = []
-			for alt_path in route_data["paths"][1:]:
-				alt_distance_km = alt_path.get("distance", 0) / 1000.0
-				alt_duration_minutes = alt_path.get("time", 0) / 60000.0
-				alt_cost = (alt_distance_km * cost_per_km) + (alt_duration_minutes * cost_per_minute)
-				
-				alt_geojson = None
-				if "points" in alt_path and "coordinates" in alt_path["points"]:
-					alt_geojson = {
-						"type": "LineString",
-						"coordinates": alt_path["points"]["coordinates"]
-					}
-				
-				alternative_routes.append({
-					"distance_km": alt_distance_km,
-					"duration_minutes": alt_duration_minutes,
-					"estimated_cost": alt_cost,
-					"route_geojson": alt_geojson
-				})
-			
-			result["alternatives"] = alternative_routes
+		if "alternatives" in route:
+			result["alternatives"] = [
+				dict(alt, estimated_cost=(alt["distance_km"] * cost_per_km) + (alt["duration_minutes"] * cost_per_minute))
+				for alt in route["alternatives"]
+			]
 		
 		return result
 		
@@ -137,6 +85,88 @@ def get_route(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, vehicle="car", a
 			"message": str(e)
 		}
 
+def fetch_route(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, vehicle, alternatives, settings):
+	"""Request a route from GraphHopper; None when no path exists.
+
+	Returns distance, duration, GeoJSON and instructions (plus alternatives
+	when requested), without costs.
+	"""
+	url = settings.graphhopper_url or "https://graphhopper.com/api/1/route"
+	
+	params = {
+		"point": [f"{pickup_lat},{pickup_lng}", f"{dropoff_lat},{dropoff_lng}"],
+		"vehicle": vehicle,
+		"locale": "en",
+		"calc_points": "true",
+		"debug": "true",
+		"elevation": "false",
+		"points_encoded": "false",
+		"instructions": "true",
+		"alternative_route.max_paths": "3" if alternatives else "1"
+	}
+	
+	if settings.graphhopper_api_key:
+		params["key"] = settings.graphhopper_api_key
+	
+	response = graphhopper.get(url, params=params, timeout=30)
+	response.raise_for_status()
+	
+	route_data = response.json()
+	
+	if "paths" not in route_data or not route_data["paths"]:
+		return None
+	
+	# Process the main route
+	main_path = route_data["paths"][0]
+	
+	# Extract turn-by-turn instructions
+	instructions = []
+	if "instructions" in main_path:
+		for instruction in main_path["instructions"]:
+			instructions.append({
+				"text": instruction.get("text", ""),
+				"distance": instruction.get("distance", 0),
+				"time": instruction.get("time", 0),
+				"sign": instruction.get("sign", 0),
+				"interval": instruction.get("interval", [])
+			})
+	
+	route = {
+		"distance_km": main_path.get("distance", 0) / 1000.0,
+		"duration_minutes": main_path.get("time", 0) / 60000.0,
+		"route_geojson": get_path_geojson(main_path),
+		"instructions": instructions
+	}
+	
+	# Add alternative routes if requested
+	if alternatives and len(route_data["paths"]) > 1:
+		route["alternatives"] = [{
+			"distance_km": alt_path.get("distance", 0) / 1000.0,
+			"duration_minutes": alt_path.get("time", 0) / 60000.0,
+			"route_geojson": get_path_geojson(alt_path)
+		} for alt_path in route_data["paths"][1:]]
+	
+	return route
+
+def get_path_geojson(path):
+	"""GeoJSON LineString for a GraphHopper path, if it has points"""
+	if "points" in path and "coordinates" in path["points"]:
+		return {
+			"type": "LineString",
+			"coordinates": path["points"]["coordinates"]
+		}
+	return None
+
+@frappe.whitelist()
+def get_route_cache_stats():
+	"""Hit/miss counters and size of the route cache"""
+	frappe.only_for("System Manager")
+	
+	return {
+		"status": "success",
+		"stats": route_cache.get_stats()
+	}
+
 @frappe.whitelist()
 def get_isochrone(latitude, longitude, time_limit=600, vehicle="car"):
 	"""Get isochrone (reachable area) from GraphHopper API"""
@@ -164,11 +194,7 @@ def get_isochrone(latitude, longitude, time_limit=600, vehicle="car"):
 		if settings.graphhopper_api_key:
 			params["key"] = settings.graphhopper_api_key
 		
-		headers = {
-			'User-Agent': 'Hayago Mapping Module/1.0 (Frappe Framework)'
-		}
-		
-		response = requests.get(isochrone_url, params=params, headers=headers, timeout=30)
+		response = graphhopper.get(isochrone_url, params=params, timeout=30)
 		response.raise_for_status()
 		
 		isochrone_data = response.json()
@@ -258,16 +284,10 @@ def optimize_route(points, vehicle="car", optimize=True):
 		if settings.graphhopper_api_key:
 			params["key"] = settings.graphhopper_api_key
 		
-		headers = {
-			'Content-Type': 'application/json',
-			'User-Agent': 'Hayago Mapping Module/1.0 (Frappe Framework)'
-		}
-		
-		response = requests.post(
+		response = graphhopper.post(
 			optimization_url,
 			json=optimization_request,
 			params=params,
-			headers=headers,
 			timeout=60
 		)
 		response.raise_for_status()
@@ -341,11 +361,7 @@ def calculate_matrix(origins, destinations, vehicle="car"):
 		if settings.graphhopper_api_key:
 			params["key"] = settings.graphhopper_api_key
 		
-		headers = {
-			'User-Agent': 'Hayago Mapping Module/1.0 (Frappe Framework)'
-		}
-		
-		response = requests.get(matrix_url, params=params, headers=headers, timeout=60)
+		response = graphhopper.get(matrix_url, params=params, timeout=60)
 		response.raise_for_status()
 		
 		matrix_result = response.json()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+"""
+Geohash-based spatial indexing for driver positions.
+
+Positions store a fixed-precision geohash; a radius query is turned into the
+handful of geohash cells covering the search bounding box, fetched with
+index-friendly prefix ranges, and refined with an exact haversine distance.
+"""
+
+from __future__ import unicode_literals
+import math
+from .utils import get_bounding_box, haversine_distance
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Precision stored on Driver Position (~4.8m x 4.8m cells)
+GEOHASH_PRECISION = 9
+
+# Upper bound on cells per radius query; the coarsest precision that fits wins
+MAX_COVERING_CELLS = 16
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+	"""Encode a coordinate as a geohash string of `precision` characters"""
+	lat_range = [-90.0, 90.0]
+	lon_range = [-180.0, 180.0]
+	geohash = []
+	bits = 0
+	bit_count = 0
+	even = True
+
+	while len(geohash) < precision:
+		if even:
+			mid = (lon_range[0] + lon_range[1]) / 2
+			if longitude >= mid:
+				bits = (bits << 1) | 1
+				lon_range[0] = mid
+			else:
+				bits = bits << 1
+				lon_range[1] = mid
+		else:
+			mid = (lat_range[0] + lat_range[1]) / 2
+			if latitude >= mid:
+				bits = (bits << 1) | 1
+				lat_range[0] = mid
+			else:
+				bits = bits << 1
+				lat_range[1] = mid
+
+		even = not even
+		bit_count += 1
+
+		if bit_count == 5:
+			geohash.append(GEOHASH_BASE32[bits])
+			bits = 0
+			bit_count = 0
+
+	return "".join(geohash)
+
+def get_cell_size(precision):
+	"""Return (lat_degrees, lon_degrees) spanned by a geohash cell"""
+	lon_bits = int(math.ceil(precision * 5 / 2.0))
+	lat_bits = precision * 5 - lon_bits
+
+	return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+def get_covering_cells(latitude, longitude, radius_km, max_cells=MAX_COVERING_CELLS):
+	"""Return the geohash prefixes whose cells cover a circle of `radius_km`"""
+	box = get_bounding_box(latitude, longitude, radius_km)
+	min_lat = max(box["min_lat"], -90.0)
+	max_lat = min(box["max_lat"], 90.0)
+
+	# Pick the finest precision whose grid still covers the box in few cells
+	precision = 1
+	for candidate in range(GEOHASH_PRECISION, 0, -1):
+		cell_lat, cell_lon = get_cell_size(candidate)
+		rows = int(math.floor((max_lat + 90.0) / cell_lat) - math.floor((min_lat + 90.0) / cell_lat)) + 1
+		cols = int(math.floor((box["max_lon"] + 180.0) / cell_lon) - math.floor((box["min_lon"] + 180.0) / cell_lon)) + 1
+		if rows * cols <= max_cells:
+			precision = candidate
+			break
+
+	return get_grid_cells(min_lat, max_lat, box["min_lon"], box["max_lon"], precision)
+
+def get_grid_cells(min_lat, max_lat, min_lon, max_lon, precision):
+	"""Return the geohash cells of `precision` that intersect a bounding box"""
+	cell_lat, cell_lon = get_cell_size(precision)
+	cells = set()
+
+	# Walk the grid cell centres across the bounding box
+	lat = (math.floor((min_lat + 90.0) / cell_lat) + 0.5) * cell_lat - 90.0
+	while lat - cell_lat / 2 <= max_lat:
+		lon = (math.floor((min_lon + 180.0) / cell_lon) + 0.5) * cell_lon - 180.0
+		while lon - cell_lon / 2 <= max_lon:
+			wrapped_lon = ((lon + 180.0) % 360.0) - 180.0
+			cells.add(encode_geohash(min(lat, 90.0), wrapped_lon, precision))
+			lon += cell_lon
+		lat += cell_lat
+
+	return sorted(cells)
+
+def get_cell_conditions(cells, column):
+	"""SQL condition and values matching `column` against geohash prefixes"""
+	condition = " OR ".join("{0} LIKE %s".format(column) for _ in cells)
+	return "({0})".format(condition), ["{0}%".format(cell) for cell in cells]
+
+def refine_by_distance(candidates, latitude, longitude, radius_km, limit=None):
+	"""Exact haversine filter over candidate rows, closest first.
+
+	Each candidate needs `latitude` and `longitude`; `distance` (km) is set on
+	the rows that are kept.
+	"""
+	results = []
+	for candidate in candidates:
+		distance = haversine_distance(latitude, longitude, candidate["latitude"], candidate["longitude"])
+		if distance <= radius_km:
+			candidate["distance"] = distance
+			results.append(candidate)
+
+	results.sort(key=lambda row: row["distance"])
+
+	return results[:int(limit)] if limit else results
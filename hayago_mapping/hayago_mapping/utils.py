@@ -4,47 +4,27 @@
 
 from __future__ import unicode_literals
 import frappe
-import math
 import json
 from datetime import datetime, timedelta
+from . import geodesic
 
 def haversine_distance(lat1, lon1, lat2, lon2):
 	"""
 	Calculate the great circle distance between two points 
 	on the earth (specified in decimal degrees)
 	Returns distance in kilometers
+
+	Any argument may be a sequence to measure many points in one call; see
+	`geodesic.haversine`.
 	"""
-	# Convert decimal degrees to radians
-	lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-	
-	# Haversine formula
-	dlat = lat2 - lat1
-	dlon = lon2 - lon1
-	a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-	c = 2 * math.asin(math.sqrt(a))
-	
-	# Radius of earth in kilometers
-	r = 6371
-	
-	return c * r
+	return geodesic.haversine(lat1, lon1, lat2, lon2)
 
 def calculate_bearing(lat1, lon1, lat2, lon2):
 	"""
 	Calculate the bearing between two points
 	Returns bearing in degrees (0-360)
 	"""
-	lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-	
-	dlon = lon2 - lon1
-	
-	y = math.sin(dlon) * math.cos(lat2)
-	x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dlon)
-	
-	bearing = math.atan2(y, x)
-	bearing = math.degrees(bearing)
-	bearing = (bearing + 360) % 360
-	
-	return bearing
+	return geodesic.bearing(lat1, lon1, lat2, lon2)
 
 def create_geojson_point(longitude, latitude):
 	"""Create a GeoJSON Point from coordinates"""
@@ -96,22 +76,68 @@ def validate_coordinates(latitude, longitude):
 	except (ValueError, TypeError):
 		return False, "Invalid coordinate format"
 
+# Used for any setting that has not been configured
+DEFAULT_MODULE_SETTINGS = {
+	'nominatim_url': 'https://nominatim.openstreetmap.org/',
+	'graphhopper_url': 'https://graphhopper.com/api/1/route',
+	'graphhopper_api_key': '',
+	'tracking_api_endpoint': '',
+	'nearby_driver_radius': 5.0,
+	'cost_per_km': 1.0,
+	'cost_per_minute': 0.2,
+	'geocode_cache_ttl_days': 30,
+	'geocode_negative_ttl_hours': 24,
+	'reverse_geocode_match_distance': 50
+}
+
+# Redis key bumped whenever Module Settings is saved
+MODULE_SETTINGS_VERSION_KEY = "hayago_module_settings_version"
+
+_settings_snapshots = {}
+
 def get_module_settings():
-	"""Get module settings with defaults"""
+	"""Get module settings with defaults.
+
+	Returns a process-level snapshot shared by all callers, so treat it as
+	read-only. It is reloaded only when the version stored in Redis changes
+	(see `invalidate_module_settings`); the version is read at most once per
+	request, so hot paths make no database round trips for settings.
+	"""
+	site = getattr(frappe.local, "site", None)
+	version = frappe.cache().get_value(MODULE_SETTINGS_VERSION_KEY)
+
+	snapshot = _settings_snapshots.get(site)
+	if snapshot and snapshot[0] == version:
+		return snapshot[1]
+
+	settings = load_module_settings()
+	_settings_snapshots[site] = (version, settings)
+
+	return settings
+
+def load_module_settings():
+	"""Read Module Settings from the database into a plain dict"""
+	settings = frappe._dict(DEFAULT_MODULE_SETTINGS)
+
 	try:
-		settings = frappe.get_single("Module Settings")
-		return settings
+		doc = frappe.get_single("Module Settings")
 	except frappe.DoesNotExistError:
 		# Return default settings if not configured
-		return frappe._dict({
-			'nominatim_url': 'https://nominatim.openstreetmap.org/',
-			'graphhopper_url': 'https://graphhopper.com/api/1/route',
-			'graphhopper_api_key': '',
-			'tracking_api_endpoint': '',
-			'nearby_driver_radius': 5.0,
-			'cost_per_km': 1.0,
-			'cost_per_minute': 0.2
-		})
+		return settings
+
+	for fieldname, value in doc.as_dict(no_default_fields=True).items():
+		if value is not None:
+			settings[fieldname] = value
+
+	# Password fields read back masked; the API key is needed in clear
+	settings.graphhopper_api_key = doc.get_password("graphhopper_api_key", raise_exception=False) or ""
+
+	return settings
+
+def invalidate_module_settings():
+	"""Make every worker reload Module Settings on its next read"""
+	_settings_snapshots.pop(getattr(frappe.local, "site", None), None)
+	frappe.cache().set_value(MODULE_SETTINGS_VERSION_KEY, frappe.generate_hash(length=10))
 
 def cleanup_old_location_data(days=7):
 	"""Clean up old driver location data older than specified days"""
@@ -197,17 +223,5 @@ def is_point_in_radius(center_lat, center_lon, point_lat, point_lon, radius_km):
 
 def get_bounding_box(latitude, longitude, radius_km):
 	"""Get bounding box coordinates for a point and radius"""
-	# Approximate degrees per kilometer
-	lat_deg_per_km = 1 / 111.0
-	lon_deg_per_km = 1 / (111.0 * math.cos(math.radians(latitude)))
-	
-	lat_offset = radius_km * lat_deg_per_km
-	lon_offset = radius_km * lon_deg_per_km
-	
-	return {
-		'min_lat': latitude - lat_offset,
-		'max_lat': latitude + lat_offset,
-		'min_lon': longitude - lon_offset,
-		'max_lon': longitude + lon_offset
-	}
+	return geodesic.bounding_box(latitude, longitude, radius_km)
 
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+from hayago_mapping.hayago_mapping.doctype.driver_location.driver_location import on_doctype_update
+
+def execute():
+	"""Add the composite Driver Location indexes on sites whose DocType did not change"""
+	on_doctype_update()
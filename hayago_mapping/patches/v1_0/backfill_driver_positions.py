@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+
+def execute():
+	"""Seed Driver Position with each driver's latest Driver Location"""
+	frappe.reload_doc("hayago_mapping", "doctype", "driver_position")
+
+	frappe.db.sql("""
+		INSERT INTO `tabDriver Position`
+			(name, creation, modified, owner, modified_by, docstatus,
+			driver, timestamp, latitude, longitude, speed, heading, is_available)
+		SELECT
+			dl.driver, NOW(), NOW(), 'Administrator', 'Administrator', 0,
+			dl.driver, dl.timestamp, dl.latitude, dl.longitude, dl.speed, dl.heading, 1
+		FROM `tabDriver Location` dl
+		INNER JOIN (
+			SELECT driver, MAX(timestamp) AS timestamp
+			FROM `tabDriver Location`
+			GROUP BY driver
+		) latest ON latest.driver = dl.driver AND latest.timestamp = dl.timestamp
+		ON DUPLICATE KEY UPDATE name = `tabDriver Position`.name
+	""")
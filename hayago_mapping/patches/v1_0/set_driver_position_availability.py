@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+from hayago_mapping.hayago_mapping.doctype.driver_position.driver_position import BUSY_TRIP_STATUSES
+
+def execute():
+	"""Derive `is_available` for existing Driver Positions from their open trips"""
+	frappe.reload_doc("hayago_mapping", "doctype", "driver_position")
+	frappe.reload_doc("hayago_mapping", "doctype", "trip")
+
+	frappe.db.sql("""
+		UPDATE `tabDriver Position` dp
+		SET dp.is_available = NOT EXISTS (
+			SELECT 1 FROM `tabTrip` t
+			WHERE t.driver = dp.driver AND t.status IN %(statuses)s
+		)
+	""", {"statuses": BUSY_TRIP_STATUSES})
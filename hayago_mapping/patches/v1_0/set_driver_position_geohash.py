@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+from hayago_mapping.hayago_mapping.spatial_index import encode_geohash
+
+def execute():
+	"""Compute the geohash cell for Driver Positions stored before it existed"""
+	frappe.reload_doc("hayago_mapping", "doctype", "driver_position")
+
+	positions = frappe.db.sql("""
+		SELECT name, latitude, longitude
+		FROM `tabDriver Position`
+		WHERE IFNULL(geohash, '') = ''
+	""", as_dict=True)
+
+	for position in positions:
+		frappe.db.sql("""
+			UPDATE `tabDriver Position` SET geohash = %s WHERE name = %s
+		""", (encode_geohash(position.latitude, position.longitude), position.name))
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, Manus AI and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+from hayago_mapping.hayago_mapping.doctype.trip.trip import TRIP_PROGRESS_FIELDS, accumulate_trip_progress
+
+def execute():
+	"""Compute progress aggregates for trips logged before they were kept"""
+	frappe.reload_doc("hayago_mapping", "doctype", "trip")
+
+	trips = frappe.db.sql_list("""
+		SELECT DISTINCT parent FROM `tabRoute Log`
+		WHERE parenttype = 'Trip' AND parentfield = 'route_logs'
+	""")
+
+	for trip in trips:
+		points = frappe.db.sql("""
+			SELECT timestamp, latitude, longitude, speed
+			FROM `tabRoute Log`
+			WHERE parent = %s AND parenttype = 'Trip' AND parentfield = 'route_logs'
+			ORDER BY idx
+		""", (trip,), as_dict=True)
+
+		progress = accumulate_trip_progress({}, points)
+		frappe.db.set_value("Trip", trip, {fieldname: progress[fieldname] for fieldname in TRIP_PROGRESS_FIELDS},
+			update_modified=False)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Failure-path tests for the Tracking API's location ingest.
+
+Forces the primary insert to fail and checks that a ping is either spilled
+to the offline queue (HTTP 202) or handed back to the client with HTTP 503
+and Retry-After. It must never be acknowledged and lost, or end in a 500,
+in direct or in buffered (group-commit) mode.
+"""
+
+import os
+import sys
+from unittest import mock
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracking_api'))
+
+from src.migrations import run_migrations
+from src.models.location import db, DriverLocation, OfflineLocationQueue
+from src.routes.tracking import tracking_bp
+from src.services.ingest import LocationIngestBuffer
+
+LOCATION = {'driver_id': 'driver_001', 'latitude': 37.77, 'longitude': -122.42, 'timestamp': '2025-01-15T10:30:00Z'}
+
+def create_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    app.register_blueprint(tracking_bp, url_prefix='/api')
+
+    with app.app_context():
+        db.create_all()
+        run_migrations()
+
+    return app
+
+def database_error():
+    return OperationalError('INSERT', {}, Exception('database is locked'))
+
+def counts(app):
+    with app.app_context():
+        return DriverLocation.query.count(), OfflineLocationQueue.query.count()
+
+def test_failed_insert_is_spilled(app=None):
+    """Primary insert fails: the ping is queued and acknowledged with 202"""
+    app = app or create_app()
+    before = counts(app)
+
+    with mock.patch('src.services.ingest.store_locations', side_effect=database_error()):
+        response = app.test_client().post('/api/location', json=LOCATION)
+
+    assert response.status_code == 202, response.get_data(as_text=True)
+    assert response.get_json()['queued'] is True
+    assert counts(app) == (before[0], before[1] + 1)
+
+def test_failed_spill_is_retryable(app=None):
+    """Primary insert and spill both fail: 503 with Retry-After, nothing stored"""
+    app = app or create_app()
+    before = counts(app)
+
+    with mock.patch('src.services.ingest.store_locations', side_effect=database_error()), \
+            mock.patch('src.services.offline_queue.spill_locations', side_effect=database_error()):
+        client = app.test_client()
+        responses = [
+            client.post('/api/location', json=LOCATION),
+            client.post('/api/location/batch', json={'locations': [LOCATION, {'driver_id': 'driver_001'}]})
+        ]
+
+    for response in responses:
+        assert response.status_code == 503, response.get_data(as_text=True)
+        assert int(response.headers['Retry-After']) > 0
+    assert responses[1].get_json()['failed_count'] == 1
+    assert counts(app) == before
+
+def test_buffered_ack_is_durable(app=None):
+    """Buffered mode: 200 only once committed, then 202 or 503 when the flush fails"""
+    app = app or create_app()
+    buffer = LocationIngestBuffer()
+    with mock.patch('src.services.ingest.INGEST_MODE', 'buffered'):
+        buffer.init_app(app)
+
+    try:
+        with mock.patch('src.routes.tracking.ingest_buffer', buffer):
+            client = app.test_client()
+
+            before = counts(app)
+            response = client.post('/api/location', json=dict(LOCATION, seq=1))
+            assert response.status_code == 200, response.get_data(as_text=True)
+            assert response.get_json()['location_id']
+            assert counts(app) == (before[0] + 1, before[1])
+
+            with mock.patch('src.services.ingest.store_locations', side_effect=database_error()):
+                response = client.post('/api/location', json=dict(LOCATION, seq=2))
+                assert response.status_code == 202, response.get_data(as_text=True)
+                assert counts(app) == (before[0] + 1, before[1] + 1)
+
+                with mock.patch('src.services.offline_queue.spill_locations', side_effect=database_error()):
+                    response = client.post('/api/location', json=dict(LOCATION, seq=3))
+                    assert response.status_code == 503, response.get_data(as_text=True)
+                    assert 'Retry-After' in response.headers
+
+            # Flush failures show in the queue status, not only in the logs
+            queue_stats = client.get('/api/queue/status').get_json()['queue']
+            assert queue_stats['spill_failed'] >= 1
+            assert 'spill failed' in queue_stats['last_error']
+    finally:
+        buffer.shutdown()
+
+def main():
+    print("Ingest Failure Tests")
+    print("=" * 50)
+
+    app = create_app()
+    tests = [
+        test_failed_insert_is_spilled,
+        test_failed_spill_is_retryable,
+        test_buffered_ack_is_durable
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test(app)
+            print(f"✓ {test.__doc__.splitlines()[0]}")
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__doc__.splitlines()[0]}\n{e}")
+
+    print("\n" + "=" * 50)
+    print(f"Test Results: {passed}/{len(tests)} tests passed")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Query plan regression tests for the Tracking API's hot queries.
+
+Builds the tracking schema (tables, then migrations) in a throwaway SQLite
+database, loads synthetic locations, and checks with EXPLAIN QUERY PLAN that
+every hot query is answered from its index: no full table scan and no
+temporary B-tree sort.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import func, select, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracking_api'))
+
+from src.migrations import run_migrations
+from src.models.location import db, DriverLocation, OfflineLocationQueue
+from src.services.history import decode_cursor, encode_cursor, history_query
+from src.services.positions import latest_positions_query
+
+DRIVERS = 50
+LOCATIONS_PER_DRIVER = 200
+
+# Both lead with (driver_id, timestamp), so either answers a latest-row lookup
+LATEST_INDEXES = ('ix_driver_locations_driver_timestamp', 'uq_driver_locations_point')
+
+def create_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        run_migrations()
+
+        now = datetime.utcnow()
+        db.session.execute(DriverLocation.__table__.insert(), [{
+            'driver_id': f'driver_{driver:03d}',
+            'timestamp': now - timedelta(seconds=i * 5),
+            'latitude': 37.77,
+            'longitude': -122.42,
+            'is_offline': False,
+            # Most history is already synced; a small backlog is pending
+            'synced_to_frappe': i >= 10
+        } for driver in range(DRIVERS) for i in range(LOCATIONS_PER_DRIVER)])
+        db.session.commit()
+        db.session.execute(text('ANALYZE'))
+
+    return app
+
+def get_plan(statement):
+    compiled = statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {compiled}')).all()
+    return [row[-1] for row in rows]
+
+def assert_indexed(statement, index, allow_sort=False, table='driver_locations'):
+    """Fail on a table scan, a temp sort, or a plan that skips `index` (a name or tuple of names)"""
+    plan = get_plan(statement)
+    text_plan = '\n'.join(plan)
+    indexes = (index,) if isinstance(index, str) else index
+
+    assert any(name in step for step in plan for name in indexes), f'{" or ".join(indexes)} not used:\n{text_plan}'
+    assert not any(step.startswith(f'SCAN {table}') and 'INDEX' not in step for step in plan), \
+        f'full table scan:\n{text_plan}'
+    if not allow_sort:
+        assert not any('TEMP B-TREE' in step for step in plan), f'temporary sort:\n{text_plan}'
+
+    return plan
+
+def since():
+    return datetime.utcnow() - timedelta(hours=24)
+
+def test_history_page_plan(app=None):
+    """GET /api/location/<driver_id>, first page, newest first"""
+    with (app or create_app()).app_context():
+        assert_indexed(history_query('driver_001', since(), limit=1001), 'ix_driver_locations_driver_timestamp')
+
+def test_history_keyset_page_plan(app=None):
+    """GET /api/location/<driver_id> with a cursor, both orders"""
+    with (app or create_app()).app_context():
+        cursor = encode_cursor((17, 'driver_001', datetime.utcnow() - timedelta(hours=1)))
+        assert decode_cursor(cursor)[1] == 17
+
+        for ascending in (False, True):
+            assert_indexed(
+                history_query('driver_001', since(), cursor=cursor, ascending=ascending, limit=1001),
+                'ix_driver_locations_driver_timestamp'
+            )
+
+def test_latest_location_plan(app=None):
+    """GET /api/location/<driver_id>/latest"""
+    with (app or create_app()).app_context():
+        statement = select(DriverLocation).where(
+            DriverLocation.driver_id == 'driver_001'
+        ).order_by(DriverLocation.timestamp.desc()).limit(1)
+        assert_indexed(statement, LATEST_INDEXES)
+
+def test_latest_positions_plan(app=None):
+    """GET /api/location/latest cache misses, many drivers at once"""
+    with (app or create_app()).app_context():
+        assert_indexed(latest_positions_query(['driver_001', 'driver_002', 'driver_003']), LATEST_INDEXES)
+
+def test_sync_batch_plan(app=None):
+    """Frappe sync: a driver's oldest unsynced rows"""
+    with (app or create_app()).app_context():
+        statement = select(DriverLocation).where(
+            DriverLocation.driver_id == 'driver_001',
+            DriverLocation.synced_to_frappe == False
+        ).order_by(DriverLocation.timestamp.asc()).limit(200)
+        assert_indexed(statement, 'ix_driver_locations_unsynced')
+
+def test_sync_due_drivers_plan(app=None):
+    """Frappe sync: drivers with a backlog, oldest first.
+
+    Ordering by MIN(timestamp) needs a sort of the grouped rows (one per
+    pending driver), but the rows grouped must come from the unsynced index
+    alone, never from the whole table.
+    """
+    with (app or create_app()).app_context():
+        statement = select(DriverLocation.driver_id).where(
+            DriverLocation.synced_to_frappe == False
+        ).group_by(DriverLocation.driver_id).order_by(func.min(DriverLocation.timestamp)).limit(50)
+        plan = assert_indexed(statement, 'ix_driver_locations_unsynced', allow_sort=True)
+
+        # Grouping reads the index in driver order; only the final ORDER BY sorts
+        assert not any('GROUP BY' in step and 'TEMP B-TREE' in step for step in plan), '\n'.join(plan)
+
+def test_offline_queue_claim_plan(app=None):
+    """Offline queue drain: oldest claimable entries"""
+    with (app or create_app()).app_context():
+        statement = select(OfflineLocationQueue.id).where(
+            OfflineLocationQueue.processed == False,
+            OfflineLocationQueue.quarantined_at.is_(None),
+            OfflineLocationQueue.visible_at <= datetime.utcnow()
+        ).order_by(OfflineLocationQueue.timestamp, OfflineLocationQueue.id).limit(1000)
+        assert_indexed(statement, 'ix_offline_location_queue_ready', table='offline_location_queue')
+
+def main():
+    """Run every plan check against one database and report like test_tracking_api.py"""
+    print("Query Plan Regression Tests")
+    print("=" * 50)
+
+    app = create_app()
+    tests = [
+        test_history_page_plan,
+        test_history_keyset_page_plan,
+        test_latest_location_plan,
+        test_latest_positions_plan,
+        test_sync_batch_plan,
+        test_sync_due_drivers_plan,
+        test_offline_queue_claim_plan
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test(app)
+            print(f"✓ {test.__doc__.splitlines()[0]}")
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__doc__.splitlines()[0]}\n{e}")
+
+    print("\n" + "=" * 50)
+    print(f"Test Results: {passed}/{len(tests)} tests passed")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
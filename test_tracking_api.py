@@ -60,6 +60,33 @@ def test_location_update():
         print(f"✗ Location update failed: {e}")
         return False
 
+def test_duplicate_location_update():
+    """Test that a retried location is deduplicated"""
+    print("\nTesting duplicate location update...")
+    
+    location_data = {
+        "driver_id": "test_driver_001",
+        "latitude": 37.7749,
+        "longitude": -122.4194,
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "seq": 1
+    }
+    
+    try:
+        first = requests.post(f"{API_BASE_URL}/location", json=location_data, timeout=10)
+        retry = requests.post(f"{API_BASE_URL}/location", json=location_data, timeout=10)
+        
+        if first.status_code == 200 and retry.status_code == 200 and retry.json().get("deduplicated"):
+            print(f"✓ Duplicate location ignored: {retry.json()}")
+            return True
+        else:
+            print(f"✗ Duplicate location not deduplicated: {first.status_code} {retry.status_code}")
+            print(f"Response: {retry.text}")
+            return False
+    except Exception as e:
+        print(f"✗ Duplicate location update failed: {e}")
+        return False
+
 def test_batch_location_update():
     """Test batch location update endpoint"""
     print("\nTesting batch location update...")
@@ -149,6 +176,37 @@ def test_get_latest_location():
         print(f"✗ Get latest location failed: {e}")
         return False
 
+def test_get_latest_locations():
+    """Test multi-driver latest location endpoint"""
+    print("\nTesting get latest locations...")
+    
+    try:
+        response = requests.get(
+            f"{API_BASE_URL}/location/latest",
+            params={"driver_ids": "test_driver_001,test_driver_002,unknown_driver"},
+            timeout=10
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            if "unknown_driver" not in data.get("missing", []):
+                print(f"✗ Unknown driver not reported as missing: {data}")
+                return False
+            for location in data.get("locations", []):
+                missing_keys = {"id", "seq", "synced_to_frappe", "created_at"} - set(location)
+                if missing_keys:
+                    print(f"✗ Latest location lacks {sorted(missing_keys)}: {location}")
+                    return False
+            print(f"✓ Get latest locations successful: {data}")
+            return True
+        else:
+            print(f"✗ Get latest locations failed with status {response.status_code}")
+            print(f"Response: {response.text}")
+            return False
+    except Exception as e:
+        print(f"✗ Get latest locations failed: {e}")
+        return False
+
 def test_sync_status():
     """Test sync status endpoint"""
     print("\nTesting sync status...")
@@ -171,6 +229,28 @@ def test_sync_status():
         print(f"✗ Sync status failed: {e}")
         return False
 
+def test_queue_status():
+    """Test offline queue status endpoint"""
+    print("\nTesting offline queue status...")
+    
+    try:
+        response = requests.get(
+            f"{API_BASE_URL}/queue/status",
+            timeout=10
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            print(f"✓ Queue status successful: depth {data['queue']['depth']}, quarantined {data['queue']['quarantined']}")
+            return True
+        else:
+            print(f"✗ Queue status failed with status {response.status_code}")
+            print(f"Response: {response.text}")
+            return False
+    except Exception as e:
+        print(f"✗ Queue status failed: {e}")
+        return False
+
 def main():
     """Run all tests"""
     print("=" * 50)
@@ -180,10 +260,13 @@ def main():
     tests = [
         test_health_check,
         test_location_update,
+        test_duplicate_location_update,
         test_batch_location_update,
         test_get_driver_locations,
         test_get_latest_location,
-        test_sync_status
+        test_get_latest_locations,
+        test_sync_status,
+        test_queue_status
     ]
     
     passed = 0
@@ -5,8 +5,13 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory
 from flask_cors import CORS
+from src.migrations import run_migrations
 from src.models.location import db
 from src.routes.tracking import tracking_bp
+from src.services.frappe_sync import frappe_sync
+from src.services.ingest import ingest_buffer
+from src.services.offline_queue import offline_queue
+from src.services.positions import position_cache
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -22,6 +27,11 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
 with app.app_context():
     db.create_all()
+    run_migrations()
+ingest_buffer.init_app(app)
+position_cache.init_app(app)
+offline_queue.init_app(app)
+frappe_sync.init_app(app)
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -0,0 +1,108 @@
+"""
+Versioned schema migrations for the tracking database.
+
+`db.create_all()` creates missing tables but never changes existing ones, so
+schema changes to tables that already hold data are applied here. Each
+migration runs once, in order, and is recorded in `schema_migrations`.
+Migrations must be idempotent: on a fresh database `create_all()` has
+already built the current schema when they run.
+"""
+
+from datetime import datetime
+from sqlalchemy import func, inspect, select, text, update
+from src.models.location import db, DriverLocation, OfflineLocationQueue, SyncStatus
+
+def add_driver_location_composite_indexes(connection):
+    """Composite indexes for history/latest/sync reads; drop the driver_id index they make redundant"""
+    for index in DriverLocation.__table__.indexes:
+        if index.name in ('ix_driver_locations_driver_timestamp', 'ix_driver_locations_unsynced'):
+            index.create(connection, checkfirst=True)
+
+    existing = {index['name'] for index in inspect(connection).get_indexes(DriverLocation.__tablename__)}
+    if 'ix_driver_locations_driver_id' in existing:
+        connection.execute(text(
+            'DROP INDEX ix_driver_locations_driver_id ON driver_locations'
+            if connection.dialect.name in ('mysql', 'mariadb') else
+            'DROP INDEX ix_driver_locations_driver_id'
+        ))
+
+def add_driver_location_idempotency_key(connection):
+    """Add `seq`, drop duplicate points and enforce (driver_id, timestamp, seq) as unique"""
+    columns = {column['name'] for column in inspect(connection).get_columns(DriverLocation.__tablename__)}
+    if 'seq' not in columns:
+        connection.execute(text('ALTER TABLE driver_locations ADD COLUMN seq INTEGER NOT NULL DEFAULT 0'))
+
+    # Keep the first stored copy of each point. The derived table lets MySQL
+    # delete from the table it selects from.
+    deleted = connection.execute(text(
+        'DELETE FROM driver_locations WHERE id NOT IN ('
+        'SELECT id FROM (SELECT MIN(id) AS id FROM driver_locations GROUP BY driver_id, timestamp, seq) AS keep)'
+    )).rowcount
+
+    if deleted:
+        # Duplicates were counted as pending when they arrived
+        connection.execute(update(SyncStatus).values(pending_locations=select(func.count()).where(
+            DriverLocation.driver_id == SyncStatus.driver_id,
+            DriverLocation.synced_to_frappe == False
+        ).scalar_subquery()))
+        print(f"Removed {deleted} duplicate locations")
+
+    for index in DriverLocation.__table__.indexes:
+        if index.name == 'uq_driver_locations_point':
+            index.create(connection, checkfirst=True)
+
+def add_offline_queue_delivery_columns(connection):
+    """Turn offline_location_queue into a claimable queue: order, visibility, attempts, quarantine"""
+    columns = {column['name'] for column in inspect(connection).get_columns(OfflineLocationQueue.__tablename__)}
+    added = {
+        'timestamp': 'DATETIME',
+        'visible_at': 'DATETIME',
+        'attempts': 'INTEGER NOT NULL DEFAULT 0',
+        'last_error': 'TEXT',
+        'quarantined_at': 'DATETIME'
+    }
+
+    for name, definition in added.items():
+        if name not in columns:
+            connection.execute(text(f'ALTER TABLE offline_location_queue ADD COLUMN {name} {definition}'))
+
+    # Added as nullable; the application always sets both from here on
+    connection.execute(update(OfflineLocationQueue).where(OfflineLocationQueue.timestamp.is_(None)).values(
+        timestamp=func.coalesce(OfflineLocationQueue.created_at, func.current_timestamp())
+    ))
+    connection.execute(update(OfflineLocationQueue).where(OfflineLocationQueue.visible_at.is_(None)).values(
+        visible_at=OfflineLocationQueue.timestamp
+    ))
+
+    for index in OfflineLocationQueue.__table__.indexes:
+        if index.name == 'ix_offline_location_queue_ready':
+            index.create(connection, checkfirst=True)
+
+# (version, function) in the order they are applied; never renumber or remove
+MIGRATIONS = [
+    (1, add_driver_location_composite_indexes),
+    (2, add_driver_location_idempotency_key),
+    (3, add_offline_queue_delivery_columns),
+]
+
+def run_migrations():
+    """Apply pending migrations; call inside an app context after create_all()"""
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, applied_at TIMESTAMP NOT NULL)'
+        ))
+        applied = {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+
+        # One transaction per migration, recorded only if it succeeds
+        with db.engine.begin() as connection:
+            migration(connection)
+            connection.execute(
+                text('INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)'),
+                {'version': version, 'name': migration.__name__, 'applied_at': datetime.utcnow()}
+            )
+        print(f"Applied migration {version}: {migration.__name__}")
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
 from datetime import datetime
 import json
 
@@ -6,10 +7,28 @@ db = SQLAlchemy()
 
 class DriverLocation(db.Model):
     __tablename__ = 'driver_locations'
+    __table_args__ = (
+        # History, latest-location and keyset pages: driver equality, then
+        # (timestamp, id) order. Also serves any lookup by driver alone.
+        db.Index('ix_driver_locations_driver_timestamp', 'driver_id', 'timestamp', 'id'),
+        # Idempotency key: a retried or replayed point is the same driver,
+        # client timestamp and client sequence number, and is stored once
+        db.Index('uq_driver_locations_point', 'driver_id', 'timestamp', 'seq', unique=True),
+        # Frappe sync backlog. Partial where supported so it only holds
+        # unsynced rows; on MySQL it is a full index led by the flag.
+        db.Index(
+            'ix_driver_locations_unsynced', 'synced_to_frappe', 'driver_id', 'timestamp',
+            sqlite_where=text('synced_to_frappe = 0'),
+            postgresql_where=text('synced_to_frappe = false')
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    driver_id = db.Column(db.String(100), nullable=False, index=True)
+    driver_id = db.Column(db.String(100), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # Client sequence number; 0 when the client sends none, so the unique
+    # key never contains NULL (which every backend treats as distinct)
+    seq = db.Column(db.Integer, nullable=False, default=0, server_default=text('0'))
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
     speed = db.Column(db.Float, nullable=True)
@@ -28,6 +47,7 @@ class DriverLocation(db.Model):
             'id': self.id,
             'driver_id': self.driver_id,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'seq': self.seq,
             'latitude': self.latitude,
             'longitude': self.longitude,
             'speed': self.speed,
@@ -58,13 +78,35 @@ class DriverLocation(db.Model):
         }
 
 class OfflineLocationQueue(db.Model):
+    """Durable spill queue for locations the primary write path could not store.
+
+    A row is pending until the drain worker claims it by pushing
+    `visible_at` past the visibility timeout; it is acknowledged by setting
+    `processed` once its location is stored. Rows that keep failing are
+    quarantined instead of retried forever.
+    """
     __tablename__ = 'offline_location_queue'
+    __table_args__ = (
+        # Drain order over pending rows only; on MySQL a full composite index
+        db.Index(
+            'ix_offline_location_queue_ready', 'processed', 'quarantined_at', 'timestamp',
+            sqlite_where=text('processed = 0 AND quarantined_at IS NULL'),
+            postgresql_where=text('processed = false AND quarantined_at IS NULL')
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     driver_id = db.Column(db.String(100), nullable=False, index=True)
     location_data = db.Column(db.Text, nullable=False)  # JSON string
+    # Location timestamp, the replay order
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     processed = db.Column(db.Boolean, default=False, nullable=False)
+    # Not claimable before this time; a claim moves it one visibility timeout ahead
+    visible_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default=text('0'))
+    last_error = db.Column(db.Text, nullable=True)
+    quarantined_at = db.Column(db.DateTime, nullable=True)
     
     def __repr__(self):
         return f'<OfflineLocationQueue {self.driver_id} - {self.id}>'
@@ -77,6 +119,17 @@ class OfflineLocationQueue(db.Model):
     
     def set_location_data(self, data):
         self.location_data = json.dumps(data)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'driver_id': self.driver_id,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'quarantined_at': self.quarantined_at.isoformat() if self.quarantined_at else None
+        }
 
 class SyncStatus(db.Model):
     __tablename__ = 'sync_status'
@@ -1,16 +1,115 @@
-from flask import Blueprint, request, jsonify
-from datetime import datetime, timedelta
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from datetime import datetime, timedelta, timezone
 from src.models.location import db, DriverLocation, OfflineLocationQueue, SyncStatus
-import requests
-import os
+from src.services.frappe_sync import frappe_sync
+from src.services.history import HISTORY_DEFAULT_LIMIT, decode_cursor, get_history_page, stream_history
+from src.services.ingest import INGEST_ACK_TIMEOUT_MS, ingest_buffer, ingest_locations, seen_recently
+from src.services.offline_queue import OFFLINE_QUEUE_RETRY_AFTER_S, offline_queue, requeue_quarantined, spill_failed_write
+from src.services.positions import LATEST_MAX_DRIVERS, position_cache
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
 import json
 
 tracking_bp = Blueprint('tracking', __name__)
 
-# Configuration - these should be environment variables in production
-FRAPPE_BASE_URL = os.getenv('FRAPPE_BASE_URL', 'http://localhost:8000')
-FRAPPE_API_KEY = os.getenv('FRAPPE_API_KEY', '')
-FRAPPE_API_SECRET = os.getenv('FRAPPE_API_SECRET', '')
+def parse_location(data):
+    """Validate a location payload and return DriverLocation column values.
+
+    Raises ValueError with a client-facing message when the payload is invalid.
+    """
+    # Validate required fields
+    required_fields = ['driver_id', 'latitude', 'longitude']
+    for field in required_fields:
+        if field not in data:
+            raise ValueError(f'Missing required field: {field}')
+    
+    # Validate coordinate ranges
+    try:
+        lat = float(data['latitude'])
+        lng = float(data['longitude'])
+    except (ValueError, TypeError):
+        raise ValueError('Invalid coordinate format')
+    
+    if not (-90 <= lat <= 90):
+        raise ValueError('Invalid latitude range')
+    
+    if not (-180 <= lng <= 180):
+        raise ValueError('Invalid longitude range')
+    
+    # Optional client sequence number, part of the idempotency key
+    try:
+        seq = int(data.get('seq') or 0)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid sequence number')
+    
+    # Parse timestamp
+    timestamp = datetime.utcnow()
+    if 'timestamp' in data:
+        try:
+            timestamp = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
+            # Stored timestamps are naive UTC
+            if timestamp.tzinfo:
+                timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        except (ValueError, AttributeError):
+            # Use current time if timestamp parsing fails
+            pass
+    
+    return {
+        'driver_id': data['driver_id'],
+        'timestamp': timestamp,
+        'seq': seq,
+        'latitude': lat,
+        'longitude': lng,
+        'speed': float(data.get('speed')) if data.get('speed') is not None else None,
+        'heading': float(data.get('heading')) if data.get('heading') is not None else None,
+        'accuracy': float(data.get('accuracy')) if data.get('accuracy') is not None else None,
+        'is_offline': bool(data.get('is_offline', False)),
+        'trip_id': data.get('trip_id'),
+        'synced_to_frappe': False,
+        'created_at': datetime.utcnow()
+    }
+
+def store_unavailable(**extra):
+    """503 telling the client to keep its points and retry later"""
+    response = jsonify({
+        'status': 'error',
+        'message': 'Location store unavailable, retry later',
+        **extra
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(OFFLINE_QUEUE_RETRY_AFTER_S)
+    return response
+
+def location_response(outcome, location_id=None):
+    """Response for a single ping by how its write ended.
+
+    Only a committed ping is acknowledged. 'failed' and a buffered write that
+    did not finish in time (None) answer 503: the client resends, and the
+    idempotency key keeps a ping that did land from being stored twice.
+    """
+    if outcome == 'stored':
+        return jsonify({
+            'status': 'success',
+            'message': 'Location updated successfully',
+            'location_id': location_id,
+            'deduplicated': False
+        }), 200
+    
+    if outcome == 'duplicate':
+        return jsonify({
+            'status': 'success',
+            'message': 'Duplicate location ignored',
+            'deduplicated': True
+        }), 200
+    
+    if outcome == 'spilled':
+        return jsonify({
+            'status': 'success',
+            'message': 'Location queued for retry',
+            'queued': True
+        }), 202
+    
+    return store_unavailable()
 
 @tracking_bp.route('/location', methods=['POST'])
 def update_location():
@@ -21,78 +120,32 @@ def update_location():
         if not data:
             return jsonify({'status': 'error', 'message': 'No data provided'}), 400
         
-        # Validate required fields
-        required_fields = ['driver_id', 'latitude', 'longitude']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'status': 'error', 'message': f'Missing required field: {field}'}), 400
-        
-        # Validate coordinate ranges
         try:
-            lat = float(data['latitude'])
-            lng = float(data['longitude'])
-            
-            if not (-90 <= lat <= 90):
-                return jsonify({'status': 'error', 'message': 'Invalid latitude range'}), 400
-            
-            if not (-180 <= lng <= 180):
-                return jsonify({'status': 'error', 'message': 'Invalid longitude range'}), 400
-                
-        except (ValueError, TypeError):
-            return jsonify({'status': 'error', 'message': 'Invalid coordinate format'}), 400
-        
-        # Parse timestamp
-        timestamp = datetime.utcnow()
-        if 'timestamp' in data:
-            try:
-                timestamp = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
-            except ValueError:
-                # Use current time if timestamp parsing fails
-                pass
-        
-        # Create location record
-        location = DriverLocation(
-            driver_id=data['driver_id'],
-            timestamp=timestamp,
-            latitude=lat,
-            longitude=lng,
-            speed=float(data.get('speed')) if data.get('speed') is not None else None,
-            heading=float(data.get('heading')) if data.get('heading') is not None else None,
-            accuracy=float(data.get('accuracy')) if data.get('accuracy') is not None else None,
-            is_offline=bool(data.get('is_offline', False)),
-            trip_id=data.get('trip_id')
-        )
-        
-        db.session.add(location)
-        db.session.commit()
-        
-        # Update sync status
-        sync_status = SyncStatus.query.filter_by(driver_id=data['driver_id']).first()
-        if not sync_status:
-            sync_status = SyncStatus(driver_id=data['driver_id'])
-            db.session.add(sync_status)
-        
-        sync_status.pending_locations += 1
-        db.session.commit()
-        
-        # Try to sync to Frappe immediately if online
-        if not data.get('is_offline', False):
-            try:
-                sync_result = sync_location_to_frappe(location)
-                if sync_result:
-                    location.synced_to_frappe = True
-                    sync_status.pending_locations = max(0, sync_status.pending_locations - 1)
-                    sync_status.last_sync_timestamp = datetime.utcnow()
-                    db.session.commit()
-            except Exception as e:
-                # Log error but don't fail the request
-                print(f"Sync error: {str(e)}")
+            row = parse_location(data)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        
+        # A retry of a point stored moments ago: acknowledge it again
+        if seen_recently(row):
+            return location_response('duplicate')
+        
+        # Buffered mode: the group-commit writer stores this ping together
+        # with others arriving at the same time and resolves the ticket once
+        # they are committed. A full buffer falls back to the direct write.
+        ticket = ingest_buffer.enqueue(row) if ingest_buffer.enabled else None
+        if ticket is not None:
+            return location_response(ticket.wait(INGEST_ACK_TIMEOUT_MS / 1000.0), ticket.location_id)
+        
+        # Insert-or-ignore plus the SyncStatus upsert, one commit
+        try:
+            inserted, deduplicated_count = ingest_locations([row])
+        except SQLAlchemyError as e:
+            # Primary write failed: keep the ping in the durable offline queue
+            return location_response('spilled' if spill_failed_write([row], e) else 'failed')
         
-        return jsonify({
-            'status': 'success',
-            'message': 'Location updated successfully',
-            'location_id': location.id
-        }), 200
+        if deduplicated_count:
+            return location_response('duplicate')
+        return location_response('stored', inserted[0].get('id'))
         
     except Exception as e:
         db.session.rollback()
@@ -111,75 +164,45 @@ def update_locations_batch():
         if not isinstance(locations, list):
             return jsonify({'status': 'error', 'message': 'Locations must be a list'}), 400
         
+        # Validate the whole payload before touching the database
         processed_locations = []
         failed_locations = []
         
         for i, loc_data in enumerate(locations):
+            if not isinstance(loc_data, dict):
+                failed_locations.append({'index': i, 'error': 'Location must be an object'})
+                continue
+            
             try:
-                # Validate required fields
-                required_fields = ['driver_id', 'latitude', 'longitude']
-                for field in required_fields:
-                    if field not in loc_data:
-                        failed_locations.append({'index': i, 'error': f'Missing required field: {field}'})
-                        continue
-                
-                # Validate coordinates
-                lat = float(loc_data['latitude'])
-                lng = float(loc_data['longitude'])
-                
-                if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
-                    failed_locations.append({'index': i, 'error': 'Invalid coordinates'})
-                    continue
-                
-                # Parse timestamp
-                timestamp = datetime.utcnow()
-                if 'timestamp' in loc_data:
-                    try:
-                        timestamp = datetime.fromisoformat(loc_data['timestamp'].replace('Z', '+00:00'))
-                    except ValueError:
-                        pass
-                
-                # Create location record
-                location = DriverLocation(
-                    driver_id=loc_data['driver_id'],
-                    timestamp=timestamp,
-                    latitude=lat,
-                    longitude=lng,
-                    speed=float(loc_data.get('speed')) if loc_data.get('speed') is not None else None,
-                    heading=float(loc_data.get('heading')) if loc_data.get('heading') is not None else None,
-                    accuracy=float(loc_data.get('accuracy')) if loc_data.get('accuracy') is not None else None,
-                    is_offline=bool(loc_data.get('is_offline', False)),
-                    trip_id=loc_data.get('trip_id')
-                )
-                
-                db.session.add(location)
-                processed_locations.append(location)
-                
-            except Exception as e:
+                processed_locations.append(parse_location(loc_data))
+            except (ValueError, TypeError, AttributeError) as e:
                 failed_locations.append({'index': i, 'error': str(e)})
         
-        # Commit all successful locations
-        db.session.commit()
-        
-        # Update sync status for each driver
-        driver_counts = {}
-        for location in processed_locations:
-            driver_counts[location.driver_id] = driver_counts.get(location.driver_id, 0) + 1
-        
-        for driver_id, count in driver_counts.items():
-            sync_status = SyncStatus.query.filter_by(driver_id=driver_id).first()
-            if not sync_status:
-                sync_status = SyncStatus(driver_id=driver_id)
-                db.session.add(sync_status)
-            
-            sync_status.pending_locations += count
-        
-        db.session.commit()
+        # Single multi-row insert-or-ignore plus one SyncStatus upsert, one commit
+        try:
+            inserted, deduplicated_count = ingest_locations(processed_locations)
+        except SQLAlchemyError as e:
+            # Primary write failed: keep the batch in the durable offline queue
+            if not spill_failed_write(processed_locations, e):
+                return store_unavailable(
+                    failed_count=len(failed_locations),
+                    failed_locations=failed_locations
+                )
+            return jsonify({
+                'status': 'success',
+                'message': f'Queued {len(processed_locations)} locations for retry',
+                'processed_count': len(processed_locations),
+                'queued': True,
+                'failed_count': len(failed_locations),
+                'failed_locations': failed_locations
+            }), 202
         
         return jsonify({
             'status': 'success',
             'message': f'Processed {len(processed_locations)} locations',
             'processed_count': len(processed_locations),
+            'inserted_count': len(inserted),
+            'deduplicated_count': deduplicated_count,
             'failed_count': len(failed_locations),
             'failed_locations': failed_locations
         }), 200
@@ -188,28 +211,93 @@ def update_locations_batch():
         db.session.rollback()
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+# Streaming formats for history exports, by `format` parameter
+HISTORY_STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'geojson-seq': 'application/geo+json-seq'
+}
+
 @tracking_bp.route('/location/<driver_id>', methods=['GET'])
 def get_driver_locations(driver_id):
-    """Get location history for a specific driver"""
+    """Get location history for a specific driver.
+
+    Pages are keyset-paginated: pass the returned `next_cursor` as `cursor`
+    to get the next page. With `format=ndjson` or `format=geojson-seq` the
+    whole window (or `limit` rows, if given) is streamed instead, one record
+    per line, in constant memory.
+    """
     try:
         # Get query parameters
         hours = request.args.get('hours', 24, type=int)
-        limit = request.args.get('limit', 1000, type=int)
+        cursor = request.args.get('cursor') or None
+        ascending = request.args.get('order', 'desc') == 'asc'
+        output_format = request.args.get('format', 'json')
         
         # Calculate time threshold
         time_threshold = datetime.utcnow() - timedelta(hours=hours)
         
-        # Query locations
-        locations = DriverLocation.query.filter(
-            DriverLocation.driver_id == driver_id,
-            DriverLocation.timestamp >= time_threshold
-        ).order_by(DriverLocation.timestamp.desc()).limit(limit).all()
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 400
+        
+        if output_format in HISTORY_STREAM_FORMATS:
+            limit = request.args.get('limit', type=int)
+            return Response(
+                stream_with_context(stream_history(
+                    driver_id, time_threshold, cursor, ascending, limit,
+                    geojson=output_format == 'geojson-seq'
+                )),
+                mimetype=HISTORY_STREAM_FORMATS[output_format]
+            )
+        
+        if output_format != 'json':
+            return jsonify({'status': 'error', 'message': f'Unsupported format: {output_format}'}), 400
+        
+        limit = request.args.get('limit', HISTORY_DEFAULT_LIMIT, type=int)
+        locations, next_cursor = get_history_page(driver_id, time_threshold, cursor, ascending, limit)
         
         return jsonify({
             'status': 'success',
             'driver_id': driver_id,
-            'locations': [loc.to_dict() for loc in locations],
-            'count': len(locations)
+            'locations': locations,
+            'count': len(locations),
+            'next_cursor': next_cursor
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@tracking_bp.route('/location/latest', methods=['GET'])
+def get_latest_locations():
+    """Get the latest location of many drivers in one call.
+
+    `driver_ids` is a comma-separated list (or repeated parameter). Drivers
+    that have never reported are listed under `missing`.
+    """
+    try:
+        driver_ids = []
+        for value in request.args.getlist('driver_ids'):
+            driver_ids.extend(driver_id.strip() for driver_id in value.split(',') if driver_id.strip())
+        driver_ids = list(dict.fromkeys(driver_ids))
+        
+        if not driver_ids:
+            return jsonify({'status': 'error', 'message': 'driver_ids is required'}), 400
+        
+        if len(driver_ids) > LATEST_MAX_DRIVERS:
+            return jsonify({
+                'status': 'error',
+                'message': f'At most {LATEST_MAX_DRIVERS} drivers per request'
+            }), 400
+        
+        positions = position_cache.get_many(driver_ids)
+        
+        return jsonify({
+            'status': 'success',
+            'locations': [positions[driver_id] for driver_id in driver_ids if driver_id in positions],
+            'count': len(positions),
+            'missing': [driver_id for driver_id in driver_ids if driver_id not in positions]
         }), 200
         
     except Exception as e:
@@ -219,9 +307,8 @@ def get_driver_locations(driver_id):
 def get_latest_location(driver_id):
     """Get the latest location for a specific driver"""
     try:
-        location = DriverLocation.query.filter_by(driver_id=driver_id).order_by(
-            DriverLocation.timestamp.desc()
-        ).first()
+        # Served from the last-known-position cache, not the history table
+        location = position_cache.get(driver_id)
         
         if not location:
             return jsonify({
@@ -231,7 +318,7 @@ def get_latest_location(driver_id):
         
         return jsonify({
             'status': 'success',
-            'location': location.to_dict()
+            'location': location
         }), 200
         
     except Exception as e:
@@ -241,48 +328,26 @@ def get_latest_location(driver_id):
 def sync_driver_locations(driver_id):
     """Manually trigger sync for a specific driver"""
     try:
-        # Get unsynced locations
-        unsynced_locations = DriverLocation.query.filter(
-            DriverLocation.driver_id == driver_id,
-            DriverLocation.synced_to_frappe == False
-        ).order_by(DriverLocation.timestamp.asc()).limit(100).all()
+        # Push one batch through the same path the background worker uses
+        synced_count, failed_count, error = frappe_sync.sync_driver(driver_id)
         
-        if not unsynced_locations:
+        if not synced_count and not failed_count and not error:
             return jsonify({
                 'status': 'success',
                 'message': 'No locations to sync',
                 'synced_count': 0
             }), 200
         
-        synced_count = 0
-        failed_count = 0
-        
-        for location in unsynced_locations:
-            try:
-                if sync_location_to_frappe(location):
-                    location.synced_to_frappe = True
-                    synced_count += 1
-                else:
-                    failed_count += 1
-            except Exception as e:
-                failed_count += 1
-                print(f"Sync error for location {location.id}: {str(e)}")
-        
-        # Update sync status
-        sync_status = SyncStatus.query.filter_by(driver_id=driver_id).first()
-        if sync_status:
-            sync_status.pending_locations = max(0, sync_status.pending_locations - synced_count)
-            if synced_count > 0:
-                sync_status.last_sync_timestamp = datetime.utcnow()
-        
-        db.session.commit()
-        
-        return jsonify({
+        response = {
             'status': 'success',
             'message': f'Synced {synced_count} locations',
             'synced_count': synced_count,
             'failed_count': failed_count
-        }), 200
+        }
+        if error:
+            response['error'] = error
+        
+        return jsonify(response), 200
         
     except Exception as e:
         db.session.rollback()
@@ -296,18 +361,59 @@ def get_sync_status():
         
         return jsonify({
             'status': 'success',
-            'sync_statuses': [status.to_dict() for status in sync_statuses]
+            'sync_statuses': [status.to_dict() for status in sync_statuses],
+            'worker': frappe_sync.get_stats()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@tracking_bp.route('/queue/status', methods=['GET'])
+def get_queue_status():
+    """Offline queue depth, drain counters and the most recent quarantined entries"""
+    try:
+        quarantined = OfflineLocationQueue.query.filter(
+            OfflineLocationQueue.processed == False,
+            OfflineLocationQueue.quarantined_at.isnot(None)
+        ).order_by(OfflineLocationQueue.quarantined_at.desc()).limit(100).all()
+        
+        return jsonify({
+            'status': 'success',
+            'queue': offline_queue.get_stats(),
+            'quarantined_entries': [entry.to_dict() for entry in quarantined]
         }), 200
         
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@tracking_bp.route('/queue/requeue', methods=['POST'])
+def requeue_offline_locations():
+    """Release quarantined entries for another round of attempts (all, or the given `ids`)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        entry_ids = data.get('ids')
+        
+        if entry_ids is not None and not isinstance(entry_ids, list):
+            return jsonify({'status': 'error', 'message': 'ids must be a list'}), 400
+        
+        count = requeue_quarantined(entry_ids)
+        
+        return jsonify({
+            'status': 'success',
+            'message': f'Requeued {count} entries',
+            'requeued_count': count
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @tracking_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     try:
         # Check database connection
-        db.session.execute('SELECT 1')
+        db.session.execute(text('SELECT 1'))
         
         # Get some basic stats
         total_locations = DriverLocation.query.count()
@@ -318,6 +424,9 @@ def health_check():
             'database': 'connected',
             'total_locations': total_locations,
             'active_drivers': active_drivers,
+            'ingest': ingest_buffer.get_stats(),
+            'positions': position_cache.get_stats(),
+            'offline_queue': offline_queue.get_stats(),
             'timestamp': datetime.utcnow().isoformat()
         }), 200
         
@@ -328,48 +437,3 @@ def health_check():
             'timestamp': datetime.utcnow().isoformat()
         }), 500
 
-def sync_location_to_frappe(location):
-    """Sync a location record to Frappe"""
-    try:
-        if not FRAPPE_BASE_URL:
-            return False
-        
-        # Prepare data for Frappe API
-        frappe_data = {
-            'driver': location.driver_id,
-            'latitude': location.latitude,
-            'longitude': location.longitude,
-            'timestamp': location.timestamp.isoformat(),
-            'speed': location.speed,
-            'heading': location.heading,
-            'accuracy': location.accuracy,
-            'is_offline': location.is_offline,
-            'trip': location.trip_id
-        }
-        
-        # Remove None values
-        frappe_data = {k: v for k, v in frappe_data.items() if v is not None}
-        
-        # Make API request to Frappe
-        url = f"{FRAPPE_BASE_URL}/api/method/hayago_mapping.api.update_driver_location_api"
-        
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        
-        # Add authentication if available
-        if FRAPPE_API_KEY and FRAPPE_API_SECRET:
-            headers['Authorization'] = f'token {FRAPPE_API_KEY}:{FRAPPE_API_SECRET}'
-        
-        response = requests.post(url, json=frappe_data, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result.get('message', {}).get('status') == 'success'
-        
-        return False
-        
-    except Exception as e:
-        print(f"Frappe sync error: {str(e)}")
-        return False
-
@@ -0,0 +1,298 @@
+import os
+import random
+import threading
+import time
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import func, update
+import requests
+from src.models.location import db, DriverLocation, SyncStatus
+from src.services.http_client import UpstreamClient
+from src.services.positions import position_cache
+
+# Configuration - these should be environment variables in production
+FRAPPE_BASE_URL = os.getenv('FRAPPE_BASE_URL', 'http://localhost:8000')
+FRAPPE_API_KEY = os.getenv('FRAPPE_API_KEY', '')
+FRAPPE_API_SECRET = os.getenv('FRAPPE_API_SECRET', '')
+
+# Background sync tuning
+FRAPPE_SYNC_ENABLED = os.getenv('FRAPPE_SYNC_ENABLED', '1') == '1'
+FRAPPE_SYNC_INTERVAL_MS = int(os.getenv('FRAPPE_SYNC_INTERVAL_MS', '1000'))
+FRAPPE_SYNC_BATCH_SIZE = int(os.getenv('FRAPPE_SYNC_BATCH_SIZE', '200'))
+FRAPPE_SYNC_MAX_DRIVERS = int(os.getenv('FRAPPE_SYNC_MAX_DRIVERS', '50'))
+FRAPPE_SYNC_CONCURRENCY = int(os.getenv('FRAPPE_SYNC_CONCURRENCY', '4'))
+FRAPPE_SYNC_TIMEOUT = float(os.getenv('FRAPPE_SYNC_TIMEOUT', '10'))
+FRAPPE_SYNC_BACKOFF_BASE_MS = int(os.getenv('FRAPPE_SYNC_BACKOFF_BASE_MS', '1000'))
+FRAPPE_SYNC_BACKOFF_MAX_MS = int(os.getenv('FRAPPE_SYNC_BACKOFF_MAX_MS', '300000'))
+
+# One keep-alive connection per concurrent sync thread
+frappe_client = UpstreamClient('frappe', timeout=FRAPPE_SYNC_TIMEOUT, pool_size=FRAPPE_SYNC_CONCURRENCY)
+
+def get_frappe_headers():
+    headers = {
+        'Content-Type': 'application/json'
+    }
+
+    # Add authentication if available
+    if FRAPPE_API_KEY and FRAPPE_API_SECRET:
+        headers['Authorization'] = f'token {FRAPPE_API_KEY}:{FRAPPE_API_SECRET}'
+
+    return headers
+
+def location_to_frappe_payload(location):
+    """Map a DriverLocation row to a Frappe update_driver_locations_batch item"""
+    frappe_data = {
+        'driver': location.driver_id,
+        'latitude': location.latitude,
+        'longitude': location.longitude,
+        # Stored timestamps are naive UTC
+        'timestamp': location.timestamp.isoformat() + 'Z',
+        'speed': location.speed,
+        'heading': location.heading,
+        'accuracy': location.accuracy,
+        'is_offline': location.is_offline,
+        'trip': location.trip_id
+    }
+
+    # Remove None values
+    return {k: v for k, v in frappe_data.items() if v is not None}
+
+def push_locations(batch):
+    """Push one driver's batch to Frappe in a single update_driver_locations_batch call.
+
+    `batch` is a list of (location id, Frappe payload) tuples. Returns the ids
+    that Frappe stored and the first error reported, if any.
+    """
+    url = f"{FRAPPE_BASE_URL}/api/method/hayago_mapping.api.update_driver_locations_batch"
+    payload = {'locations': [frappe_data for _, frappe_data in batch]}
+
+    try:
+        response = frappe_client.post(url, json=payload, headers=get_frappe_headers())
+    except requests.RequestException as e:
+        return [], f"Frappe unreachable: {str(e)}"
+
+    if response.status_code != 200:
+        return [], f"Frappe returned HTTP {response.status_code}"
+
+    # A 200 from a proxy or error page may not be the JSON Frappe returns
+    try:
+        result = response.json().get('message', {})
+        if result.get('status') != 'success':
+            return [], result.get('message', 'Frappe rejected batch')
+
+        # One result per location: 1 when stored, otherwise the error message
+        results = list(result.get('results', []))
+    except (ValueError, AttributeError, TypeError):
+        return [], "Frappe returned an unexpected response"
+
+    synced_ids = [location_id for (location_id, _), item in zip(batch, results) if item == 1]
+    errors = [item for item in results if item != 1]
+
+    return synced_ids, errors[0] if errors else None
+
+class FrappeSyncWorker:
+    """Background outbox relay from the tracking database to Frappe.
+
+    Unsynced DriverLocation rows are the outbox. Each cycle picks the drivers
+    with the oldest pending rows and pushes up to FRAPPE_SYNC_BATCH_SIZE rows
+    per driver in one HTTP call, with at most FRAPPE_SYNC_CONCURRENCY drivers
+    in flight. Rows Frappe accepted are marked synced; drivers whose push
+    failed back off exponentially.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._backoff = {}
+        self.stats = {
+            'cycles': 0,
+            'synced': 0,
+            'failed_pushes': 0,
+            'last_cycle_at': None,
+            'last_error': None
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = FRAPPE_SYNC_ENABLED and bool(FRAPPE_BASE_URL)
+
+        if self.enabled and self._thread is None:
+            self._executor = ThreadPoolExecutor(max_workers=FRAPPE_SYNC_CONCURRENCY, thread_name_prefix='frappe-sync')
+            self._thread = threading.Thread(target=self._run, name='frappe-sync-worker', daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=FRAPPE_SYNC_TIMEOUT)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['enabled'] = self.enabled
+        stats['backing_off'] = len(self._backoff)
+        stats['upstream'] = frappe_client.get_stats()
+        if stats['last_cycle_at']:
+            stats['last_cycle_at'] = stats['last_cycle_at'].isoformat()
+        return stats
+
+    def _run(self):
+        while not self._stop.wait(FRAPPE_SYNC_INTERVAL_MS / 1000.0):
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    db.session.rollback()
+                    self.stats['last_error'] = str(e)
+                    print(f"Frappe sync cycle error: {str(e)}")
+
+    def run_once(self):
+        """Run one sync cycle inside an app context. Returns the number of rows synced."""
+        driver_ids = self._claim(self._due_drivers())
+        if not driver_ids:
+            return 0
+
+        try:
+            batches = {driver_id: self._fetch_batch(driver_id) for driver_id in driver_ids}
+            db.session.commit()
+
+            # Only the HTTP pushes run concurrently; all DB work stays on this thread
+            futures = {
+                driver_id: self._executor.submit(push_locations, batch)
+                for driver_id, batch in batches.items() if batch
+            }
+            results = {}
+            for driver_id, future in futures.items():
+                # One failed push must not stop the others from being marked synced
+                try:
+                    results[driver_id] = future.result()
+                except Exception as e:
+                    results[driver_id] = ([], str(e))
+
+            synced = self._apply_results(results)
+        finally:
+            self._release(driver_ids)
+
+        self.stats['cycles'] += 1
+        self.stats['last_cycle_at'] = datetime.utcnow()
+        return synced
+
+    def sync_driver(self, driver_id):
+        """Synchronously push one batch for a driver. Returns (synced, failed, error)."""
+        if not FRAPPE_BASE_URL:
+            return 0, 0, 'Frappe sync is not configured (FRAPPE_BASE_URL is empty)'
+
+        if not self._claim([driver_id]):
+            return 0, 0, 'Sync already in progress for this driver'
+
+        try:
+            batch = self._fetch_batch(driver_id)
+            if not batch:
+                return 0, 0, None
+
+            synced_ids, error = push_locations(batch)
+            self._apply_results({driver_id: (synced_ids, error)})
+        finally:
+            self._release([driver_id])
+
+        return len(synced_ids), len(batch) - len(synced_ids), error
+
+    def _claim(self, driver_ids):
+        with self._lock:
+            claimed = [driver_id for driver_id in driver_ids if driver_id not in self._in_flight]
+            self._in_flight.update(claimed)
+        return claimed
+
+    def _release(self, driver_ids):
+        with self._lock:
+            self._in_flight.difference_update(driver_ids)
+
+    def _due_drivers(self):
+        """Drivers with pending rows, oldest backlog first, skipping those in backoff"""
+        now = time.monotonic()
+        backing_off = [driver_id for driver_id, (_, retry_at) in self._backoff.items() if retry_at > now]
+
+        query = db.session.query(DriverLocation.driver_id).filter(
+            DriverLocation.synced_to_frappe == False
+        )
+        if backing_off:
+            query = query.filter(DriverLocation.driver_id.notin_(backing_off))
+
+        rows = query.group_by(DriverLocation.driver_id).order_by(
+            func.min(DriverLocation.timestamp)
+        ).limit(FRAPPE_SYNC_MAX_DRIVERS).all()
+
+        return [row.driver_id for row in rows]
+
+    def _fetch_batch(self, driver_id):
+        locations = DriverLocation.query.filter(
+            DriverLocation.driver_id == driver_id,
+            DriverLocation.synced_to_frappe == False
+        ).order_by(DriverLocation.timestamp.asc()).limit(FRAPPE_SYNC_BATCH_SIZE).all()
+
+        return [(location.id, location_to_frappe_payload(location)) for location in locations]
+
+    def _apply_results(self, results):
+        """Mark accepted rows as synced and update SyncStatus in one transaction"""
+        if not results:
+            return 0
+
+        now = datetime.utcnow()
+        total_synced = 0
+
+        statuses = {
+            status.driver_id: status
+            for status in SyncStatus.query.filter(SyncStatus.driver_id.in_(list(results))).all()
+        }
+
+        for driver_id, (synced_ids, error) in results.items():
+            if synced_ids:
+                db.session.execute(
+                    update(DriverLocation).where(DriverLocation.id.in_(synced_ids)).values(synced_to_frappe=True)
+                )
+                total_synced += len(synced_ids)
+
+            sync_status = statuses.get(driver_id)
+            if not sync_status:
+                sync_status = SyncStatus(driver_id=driver_id, pending_locations=0)
+                db.session.add(sync_status)
+
+            sync_status.pending_locations = max(0, (sync_status.pending_locations or 0) - len(synced_ids))
+            if synced_ids:
+                sync_status.last_sync_timestamp = now
+
+            if error:
+                sync_status.last_error = error
+                self._schedule_retry(driver_id)
+                self.stats['failed_pushes'] += 1
+                self.stats['last_error'] = error
+            else:
+                sync_status.last_error = None
+                self._backoff.pop(driver_id, None)
+
+        db.session.commit()
+        position_cache.mark_synced({
+            driver_id: synced_ids for driver_id, (synced_ids, _) in results.items() if synced_ids
+        })
+        self.stats['synced'] += total_synced
+        return total_synced
+
+    def _schedule_retry(self, driver_id):
+        """Exponential backoff with jitter, capped at FRAPPE_SYNC_BACKOFF_MAX_MS"""
+        attempts = self._backoff.get(driver_id, (0, 0))[0] + 1
+        delay_ms = min(FRAPPE_SYNC_BACKOFF_BASE_MS * (2 ** (attempts - 1)), FRAPPE_SYNC_BACKOFF_MAX_MS)
+        delay_ms *= random.uniform(0.5, 1.0)
+        self._backoff[driver_id] = (attempts, time.monotonic() + delay_ms / 1000.0)
+
+frappe_sync = FrappeSyncWorker()
@@ -0,0 +1,138 @@
+import base64
+import json
+import os
+from datetime import datetime
+from sqlalchemy import and_, or_, select
+from src.models.location import db, DriverLocation
+
+# Rows fetched per round trip when streaming from a server-side cursor
+HISTORY_STREAM_BATCH_SIZE = int(os.getenv('HISTORY_STREAM_BATCH_SIZE', '1000'))
+
+# Page size bounds for paginated (non-streaming) history
+HISTORY_DEFAULT_LIMIT = 1000
+HISTORY_MAX_LIMIT = int(os.getenv('HISTORY_MAX_LIMIT', '5000'))
+
+# Columns selected for history, in the order rows are unpacked
+HISTORY_COLUMNS = (
+    DriverLocation.id,
+    DriverLocation.driver_id,
+    DriverLocation.timestamp,
+    DriverLocation.seq,
+    DriverLocation.latitude,
+    DriverLocation.longitude,
+    DriverLocation.speed,
+    DriverLocation.heading,
+    DriverLocation.accuracy,
+    DriverLocation.is_offline,
+    DriverLocation.trip_id,
+    DriverLocation.synced_to_frappe,
+    DriverLocation.created_at
+)
+HISTORY_FIELDS = tuple(column.key for column in HISTORY_COLUMNS)
+
+def encode_cursor(row):
+    """Opaque keyset cursor for the position just after `row`"""
+    raw = json.dumps([row[2].isoformat(), row[0]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, location_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(location_id)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def history_query(driver_id, since, cursor=None, ascending=False, limit=None):
+    """Select a driver's locations ordered by (timestamp, id).
+
+    Rows after `cursor` are found with a keyset condition rather than an
+    OFFSET, so every page costs the same however deep it is.
+    """
+    query = select(*HISTORY_COLUMNS).where(
+        DriverLocation.driver_id == driver_id,
+        DriverLocation.timestamp >= since
+    )
+
+    if cursor:
+        timestamp, location_id = decode_cursor(cursor)
+        if ascending:
+            query = query.where(or_(
+                DriverLocation.timestamp > timestamp,
+                and_(DriverLocation.timestamp == timestamp, DriverLocation.id > location_id)
+            ))
+        else:
+            query = query.where(or_(
+                DriverLocation.timestamp < timestamp,
+                and_(DriverLocation.timestamp == timestamp, DriverLocation.id < location_id)
+            ))
+
+    if ascending:
+        query = query.order_by(DriverLocation.timestamp.asc(), DriverLocation.id.asc())
+    else:
+        query = query.order_by(DriverLocation.timestamp.desc(), DriverLocation.id.desc())
+
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query
+
+def get_history_page(driver_id, since, cursor=None, ascending=False, limit=HISTORY_DEFAULT_LIMIT):
+    """One page of history as (locations, next_cursor); next_cursor is None on the last page"""
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+
+    # One extra row tells whether another page follows
+    rows = db.session.execute(history_query(driver_id, since, cursor, ascending, limit + 1)).all()
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [row_to_dict(row) for row in rows[:limit]], next_cursor
+
+def stream_history(driver_id, since, cursor=None, ascending=False, limit=None, geojson=False):
+    """Yield history as NDJSON lines, or GeoJSON text sequence records (RFC 8142).
+
+    Rows come from a server-side cursor in batches of
+    HISTORY_STREAM_BATCH_SIZE column tuples, so memory use does not grow
+    with the number of rows exported.
+    """
+    query = history_query(driver_id, since, cursor, ascending, limit)
+    result = db.session.execute(
+        query.execution_options(stream_results=True, yield_per=HISTORY_STREAM_BATCH_SIZE)
+    )
+
+    try:
+        for row in result:
+            if geojson:
+                yield '\x1e' + json.dumps(row_to_feature(row)) + '\n'
+            else:
+                yield json.dumps(row_to_dict(row)) + '\n'
+    finally:
+        result.close()
+        db.session.close()
+
+def row_to_dict(row):
+    """Same shape as DriverLocation.to_dict, from a HISTORY_COLUMNS tuple"""
+    location = dict(zip(HISTORY_FIELDS, row))
+    location['timestamp'] = location['timestamp'].isoformat() if location['timestamp'] else None
+    location['created_at'] = location['created_at'].isoformat() if location['created_at'] else None
+    return location
+
+def row_to_feature(row):
+    """Same shape as DriverLocation.to_geojson_feature, from a HISTORY_COLUMNS tuple"""
+    location = row_to_dict(row)
+    return {
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [location['longitude'], location['latitude']]
+        },
+        'properties': {
+            'driver_id': location['driver_id'],
+            'timestamp': location['timestamp'],
+            'speed': location['speed'],
+            'heading': location['heading'],
+            'accuracy': location['accuracy'],
+            'is_offline': location['is_offline'],
+            'trip_id': location['trip_id']
+        }
+    }
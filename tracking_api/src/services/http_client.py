@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connection pool and timeout tuning for upstream calls
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '10'))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '3.05'))
+
+# Consecutive failures that open the circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', '30'))
+
+# Upper bounds (ms) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class CircuitOpenError(requests.RequestException):
+    """Raised without contacting the upstream while its circuit is open"""
+
+class UpstreamClient:
+    """Pooled keep-alive HTTP client for one upstream service.
+
+    Connections are reused across requests and threads, responses are
+    gzip-compressed when the server supports it, a circuit breaker fails fast
+    after CIRCUIT_FAILURE_THRESHOLD consecutive failures (one trial request is
+    let through every CIRCUIT_RESET_SECONDS), and latencies are kept as a
+    histogram for the health endpoints.
+    """
+
+    def __init__(self, name, timeout, pool_size=UPSTREAM_POOL_SIZE):
+        self.name = name
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.latency = {bucket: 0 for bucket in self._bucket_names()}
+        self.counts = {'requests': 0, 'errors': 0, 'rejected': 0}
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """Send a request through the pool; 5xx responses count as failures"""
+        self._check_circuit()
+
+        start = time.monotonic()
+        try:
+            response = self.session.request(
+                method, url, timeout=(UPSTREAM_CONNECT_TIMEOUT, timeout or self.timeout), **kwargs
+            )
+        except requests.RequestException:
+            self._record(start, failed=True)
+            raise
+
+        self._record(start, failed=response.status_code >= 500)
+        return response
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats['latency_ms'] = dict(self.latency)
+            stats['consecutive_failures'] = self.failures
+            stats['circuit'] = self._circuit_state()
+        return stats
+
+    def _check_circuit(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+
+            if time.monotonic() - self.opened_at >= CIRCUIT_RESET_SECONDS and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+
+            self.counts['rejected'] += 1
+
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+    def _record(self, start, failed):
+        elapsed_ms = (time.monotonic() - start) * 1000
+        bucket = next(
+            (f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS if elapsed_ms <= bound),
+            f"gt_{LATENCY_BUCKETS_MS[-1]}ms"
+        )
+
+        with self.lock:
+            self.latency[bucket] += 1
+            self.counts['requests'] += 1
+            self.trial_in_flight = False
+
+            if failed:
+                self.counts['errors'] += 1
+                self.failures += 1
+                if self.failures >= CIRCUIT_FAILURE_THRESHOLD or self.opened_at is not None:
+                    self.opened_at = time.monotonic()
+            else:
+                self.failures = 0
+                self.opened_at = None
+
+    def _circuit_state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= CIRCUIT_RESET_SECONDS:
+            return 'half-open'
+        return 'open'
+
+    @staticmethod
+    def _bucket_names():
+        return [f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + [f"gt_{LATENCY_BUCKETS_MS[-1]}ms"]
@@ -0,0 +1,384 @@
+import os
+import queue
+import threading
+import time
+import atexit
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import func, insert, select, tuple_
+from src.models.location import db, DriverLocation, SyncStatus
+from src.services.positions import position_cache
+
+# Ingest configuration - 'direct' commits every ping in the request, 'buffered'
+# hands pings to a single writer thread that group-commits them
+INGEST_MODE = os.getenv('INGEST_MODE', 'direct')
+INGEST_BUFFER_SIZE = int(os.getenv('INGEST_BUFFER_SIZE', '10000'))
+INGEST_FLUSH_INTERVAL_MS = int(os.getenv('INGEST_FLUSH_INTERVAL_MS', '200'))
+INGEST_FLUSH_MAX_ROWS = int(os.getenv('INGEST_FLUSH_MAX_ROWS', '500'))
+INGEST_ENQUEUE_TIMEOUT_MS = int(os.getenv('INGEST_ENQUEUE_TIMEOUT_MS', '50'))
+# How long a buffered request waits for its flush before answering 503
+INGEST_ACK_TIMEOUT_MS = int(os.getenv('INGEST_ACK_TIMEOUT_MS', '5000'))
+
+# Idempotency keys of recently stored points remembered per process, so
+# client retries are dropped before they reach the database
+INGEST_DEDUP_KEYS = int(os.getenv('INGEST_DEDUP_KEYS', '100000'))
+
+# Points dropped as duplicates: by the recent-keys filter, or by the unique
+# index when the filter had not seen them
+dedup_stats = {
+    'filtered': 0,
+    'ignored': 0
+}
+
+def location_key(row):
+    """Idempotency key of a location row: (driver_id, timestamp, seq)"""
+    return (row['driver_id'], row['timestamp'], row.get('seq') or 0)
+
+class RecentKeyFilter:
+    """Bounded set of recently stored idempotency keys, oldest evicted first.
+
+    Only a fast path: a key that has been evicted, or was stored by another
+    process, still reaches the database, where the unique index drops it.
+    """
+
+    def __init__(self, max_size=INGEST_DEDUP_KEYS):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def filter(self, rows):
+        """Rows whose key is neither recently stored nor repeated earlier in `rows`"""
+        fresh = []
+        batch_keys = set()
+
+        with self._lock:
+            for row in rows:
+                key = location_key(row)
+                if key in self._keys or key in batch_keys:
+                    continue
+                batch_keys.add(key)
+                fresh.append(row)
+
+        return fresh
+
+    def add(self, rows):
+        """Remember the keys of committed rows"""
+        if not self.max_size:
+            return
+
+        with self._lock:
+            for row in rows:
+                key = location_key(row)
+                self._keys[key] = True
+                self._keys.move_to_end(key)
+
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+recent_keys = RecentKeyFilter()
+
+def seen_recently(row):
+    """True if `row` repeats a point this process stored recently"""
+    if location_key(row) in recent_keys:
+        dedup_stats['filtered'] += 1
+        return True
+    return False
+
+def ingest_locations(rows):
+    """Store location rows exactly once each, commit, and publish the new ones.
+
+    Returns the rows inserted (with `id` where the database reports it) and
+    the number dropped as duplicates. The caller rolls back on error.
+    """
+    fresh = recent_keys.filter(rows)
+    dedup_stats['filtered'] += len(rows) - len(fresh)
+
+    inserted = store_locations(fresh)
+    db.session.commit()
+    dedup_stats['ignored'] += len(fresh) - len(inserted)
+
+    recent_keys.add(fresh)
+    position_cache.update(inserted)
+
+    return inserted, len(rows) - len(inserted)
+
+def store_locations(rows):
+    """Insert location rows and bump pending counters in the current transaction.
+
+    `rows` are dicts of DriverLocation column values. Points whose
+    idempotency key is already stored are skipped and not counted as
+    pending. Returns the rows inserted. The caller commits.
+    """
+    if not rows:
+        return []
+
+    inserted = insert_new_locations(rows)
+
+    driver_counts = {}
+    for row in inserted:
+        driver_counts[row['driver_id']] = driver_counts.get(row['driver_id'], 0) + 1
+
+    apply_pending_counts(driver_counts)
+    return inserted
+
+def insert_new_locations(rows):
+    """Insert-or-ignore on the (driver_id, timestamp, seq) unique index.
+
+    `rows` must not repeat a key. Returns the rows actually inserted.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+        # RETURNING reports only the rows that did not conflict
+        stmt = dialect_insert(DriverLocation).on_conflict_do_nothing(
+            index_elements=[DriverLocation.driver_id, DriverLocation.timestamp, DriverLocation.seq]
+        ).returning(DriverLocation.id, DriverLocation.driver_id, DriverLocation.timestamp, DriverLocation.seq)
+        ids = {(row.driver_id, row.timestamp, row.seq): row.id for row in db.session.execute(stmt, rows)}
+
+        return [dict(row, id=ids[location_key(row)]) for row in rows if location_key(row) in ids]
+
+    # Generic fallback: one SELECT for the keys already stored, then insert
+    # the rest. MySQL's INSERT IGNORE covers a concurrent insert in between.
+    keys = [location_key(row) for row in rows]
+    existing = set(db.session.execute(
+        select(DriverLocation.driver_id, DriverLocation.timestamp, DriverLocation.seq).where(
+            tuple_(DriverLocation.driver_id, DriverLocation.timestamp, DriverLocation.seq).in_(keys)
+        )
+    ).tuples())
+
+    new_rows = [row for row, key in zip(rows, keys) if key not in existing]
+    if new_rows:
+        stmt = insert(DriverLocation)
+        if dialect in ('mysql', 'mariadb'):
+            stmt = stmt.prefix_with('IGNORE')
+        db.session.execute(stmt, new_rows)
+
+    return new_rows
+
+def apply_pending_counts(driver_counts):
+    """Add per-driver pending location counts to SyncStatus with one upsert"""
+    if not driver_counts:
+        return
+
+    now = datetime.utcnow()
+    values = [
+        {'driver_id': driver_id, 'pending_locations': count, 'updated_at': now}
+        for driver_id, count in driver_counts.items()
+    ]
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+        stmt = dialect_insert(SyncStatus).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SyncStatus.driver_id],
+            set_={
+                'pending_locations': func.coalesce(SyncStatus.pending_locations, 0) + stmt.excluded.pending_locations,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        db.session.execute(stmt)
+        return
+
+    if dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+
+        stmt = dialect_insert(SyncStatus).values(values)
+        stmt = stmt.on_duplicate_key_update(
+            pending_locations=func.coalesce(SyncStatus.pending_locations, 0) + stmt.inserted.pending_locations,
+            updated_at=stmt.inserted.updated_at
+        )
+        db.session.execute(stmt)
+        return
+
+    # Generic fallback: one SELECT for all drivers, then update in the session
+    existing = {
+        status.driver_id: status
+        for status in SyncStatus.query.filter(SyncStatus.driver_id.in_(list(driver_counts))).all()
+    }
+
+    for driver_id, count in driver_counts.items():
+        sync_status = existing.get(driver_id)
+        if not sync_status:
+            sync_status = SyncStatus(driver_id=driver_id, pending_locations=0)
+            db.session.add(sync_status)
+
+        sync_status.pending_locations = (sync_status.pending_locations or 0) + count
+
+class IngestTicket:
+    """Outcome of one buffered row, resolved by the writer after its flush"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.outcome = None
+        self.location_id = None
+
+    def resolve(self, outcome, location_id=None):
+        self.outcome = outcome
+        self.location_id = location_id
+        self._done.set()
+
+    def wait(self, timeout):
+        """'stored', 'duplicate', 'spilled' or 'failed'; None if not resolved in time"""
+        self._done.wait(timeout)
+        return self.outcome
+
+class LocationIngestBuffer:
+    """Bounded in-process buffer drained by a single group-commit writer.
+
+    Request handlers call `enqueue()` and wait on the returned ticket; the
+    writer thread flushes whatever has accumulated every
+    INGEST_FLUSH_INTERVAL_MS or as soon as INGEST_FLUSH_MAX_ROWS rows are
+    waiting, in a single transaction, and resolves the tickets once that
+    transaction (or the spill of a failed one) is committed. Concurrent
+    requests share one commit, and none is acknowledged before its row is
+    on disk.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.max_size = INGEST_BUFFER_SIZE
+        self.flush_interval = INGEST_FLUSH_INTERVAL_MS / 1000.0
+        self.flush_max_rows = INGEST_FLUSH_MAX_ROWS
+        self.enqueue_timeout = INGEST_ENQUEUE_TIMEOUT_MS / 1000.0
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self.stats = {
+            'enqueued': 0,
+            'rejected': 0,
+            'flushed_rows': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            'spilled_rows': 0,
+            'last_flush_at': None
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = INGEST_MODE == 'buffered'
+
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='location-ingest-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def enqueue(self, row):
+        """Queue a location row for the writer. Returns its IngestTicket, or None when the buffer is full."""
+        ticket = IngestTicket()
+        try:
+            self._queue.put((row, ticket), timeout=self.enqueue_timeout)
+        except queue.Full:
+            self.stats['rejected'] += 1
+            return None
+
+        self.stats['enqueued'] += 1
+        return ticket
+
+    def flush(self):
+        """Synchronously write everything currently buffered"""
+        while True:
+            batch = self._take(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['mode'] = INGEST_MODE
+        stats['depth'] = self.depth()
+        stats['capacity'] = self.max_size
+        stats['deduplicated'] = dict(dedup_stats)
+        stats['recent_keys'] = len(recent_keys)
+        if stats['last_flush_at']:
+            stats['last_flush_at'] = stats['last_flush_at'].isoformat()
+        return stats
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take(block=True)
+            if batch:
+                self._write(batch)
+
+    def _take(self, block):
+        """Collect up to flush_max_rows (row, ticket) pairs, waiting at most one flush interval"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.flush_max_rows:
+            try:
+                if block:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _write(self, batch):
+        rows = [row for row, _ in batch]
+
+        with self._flush_lock, self.app.app_context():
+            try:
+                inserted, _ = ingest_locations(rows)
+                self.stats['flushes'] += 1
+                self.stats['flushed_rows'] += len(inserted)
+                self.stats['last_flush_at'] = datetime.utcnow()
+            except Exception as e:
+                self.stats['failed_flushes'] += 1
+                outcome = self._spill(rows, e)
+                for _, ticket in batch:
+                    ticket.resolve(outcome)
+                return
+
+        ids = {location_key(row): row.get('id') for row in inserted}
+        for row, ticket in batch:
+            key = location_key(row)
+            if key in ids:
+                ticket.resolve('stored', ids[key])
+            else:
+                ticket.resolve('duplicate')
+
+    def _spill(self, rows, error):
+        """Move rows that failed to flush into the durable offline queue; returns the outcome"""
+        from src.services.offline_queue import spill_failed_write
+
+        if spill_failed_write(rows, error):
+            self.stats['spilled_rows'] += len(rows)
+            return 'spilled'
+        return 'failed'
+
+ingest_buffer = LocationIngestBuffer()
@@ -0,0 +1,362 @@
+import os
+import json
+import threading
+import time
+import atexit
+from datetime import datetime, timedelta
+from sqlalchemy import and_, case, delete, func, insert, select, update
+from sqlalchemy.exc import OperationalError
+from src.models.location import db, OfflineLocationQueue
+from src.services.ingest import ingest_locations
+
+# Drain worker tuning
+OFFLINE_QUEUE_ENABLED = os.getenv('OFFLINE_QUEUE_ENABLED', '1') == '1'
+OFFLINE_QUEUE_INTERVAL_MS = int(os.getenv('OFFLINE_QUEUE_INTERVAL_MS', '1000'))
+OFFLINE_QUEUE_BATCH_SIZE = int(os.getenv('OFFLINE_QUEUE_BATCH_SIZE', '1000'))
+OFFLINE_QUEUE_VISIBILITY_TIMEOUT_S = int(os.getenv('OFFLINE_QUEUE_VISIBILITY_TIMEOUT_S', '60'))
+OFFLINE_QUEUE_MAX_ATTEMPTS = int(os.getenv('OFFLINE_QUEUE_MAX_ATTEMPTS', '5'))
+OFFLINE_QUEUE_BACKOFF_MAX_MS = int(os.getenv('OFFLINE_QUEUE_BACKOFF_MAX_MS', '60000'))
+OFFLINE_QUEUE_RETENTION_HOURS = int(os.getenv('OFFLINE_QUEUE_RETENTION_HOURS', '24'))
+
+# Retry-After (seconds) sent when a failed write cannot be spilled either
+OFFLINE_QUEUE_RETRY_AFTER_S = int(os.getenv('OFFLINE_QUEUE_RETRY_AFTER_S', '30'))
+
+# Location row fields stored as ISO strings in location_data
+DATETIME_FIELDS = ('timestamp', 'created_at')
+
+def encode_location(row):
+    return json.dumps({
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in row.items()
+    })
+
+def decode_location(location_data):
+    """DriverLocation column values from a queued entry; raises ValueError if unreadable"""
+    row = json.loads(location_data)
+    if not isinstance(row, dict) or not row.get('driver_id') or not row.get('timestamp'):
+        raise ValueError('Queued location has no driver_id or timestamp')
+
+    for field in DATETIME_FIELDS:
+        if row.get(field):
+            row[field] = datetime.fromisoformat(row[field])
+
+    return row
+
+def spill_locations(rows, error=None):
+    """Durably queue location rows the primary write path failed to store.
+
+    `rows` are dicts of DriverLocation column values. The caller must have
+    rolled back the failed transaction; this commits its own. The queue is a
+    table in the same database as driver_locations, so it absorbs failures of
+    the write itself (lock timeouts, a bad batch) but not an outage of that
+    database: then this raises too, and callers must not acknowledge the rows.
+    """
+    if not rows:
+        return 0
+
+    now = datetime.utcnow()
+    db.session.execute(insert(OfflineLocationQueue), [{
+        'driver_id': row['driver_id'],
+        'location_data': encode_location(row),
+        'timestamp': row['timestamp'],
+        'created_at': now,
+        'processed': False,
+        'visible_at': now,
+        'attempts': 0,
+        'last_error': str(error) if error else None
+    } for row in rows])
+    db.session.commit()
+
+    offline_queue.stats['spilled'] += len(rows)
+    return len(rows)
+
+def spill_failed_write(rows, error):
+    """Spill rows whose primary write failed; False if the spill failed too.
+
+    Rolls back the failed transaction first. Both failures are recorded in
+    the queue stats, so they show in GET /api/queue/status. When this
+    returns False the rows are stored nowhere and must not be acknowledged.
+    """
+    db.session.rollback()
+    offline_queue.stats['last_error'] = f'Primary write failed: {error}'
+
+    try:
+        spill_locations(rows, error)
+        return True
+    except Exception as e:
+        db.session.rollback()
+        offline_queue.stats['spill_failed'] += len(rows)
+        offline_queue.stats['last_error'] = f'Primary write failed: {error}; spill failed: {e}'
+        return False
+
+def get_queue_depth():
+    """Pending entries by state, and the age of the oldest one not quarantined"""
+    now = datetime.utcnow()
+    live = OfflineLocationQueue.quarantined_at.is_(None)
+
+    row = db.session.execute(select(
+        func.sum(case((and_(live, OfflineLocationQueue.visible_at <= now), 1), else_=0)),
+        func.sum(case((and_(live, OfflineLocationQueue.visible_at > now), 1), else_=0)),
+        func.sum(case((live, 0), else_=1)),
+        func.min(case((live, OfflineLocationQueue.timestamp)))
+    ).where(OfflineLocationQueue.processed == False)).one()
+
+    ready, in_flight, quarantined, oldest = (row[0] or 0, row[1] or 0, row[2] or 0, row[3])
+    return {
+        'depth': ready + in_flight,
+        'ready': ready,
+        'in_flight': in_flight,
+        'quarantined': quarantined,
+        'oldest_pending_age_seconds': (now - oldest).total_seconds() if oldest else None
+    }
+
+def requeue_quarantined(entry_ids=None):
+    """Give quarantined entries (all, or `entry_ids`) a fresh set of attempts. Returns the count."""
+    query = update(OfflineLocationQueue).where(
+        OfflineLocationQueue.processed == False,
+        OfflineLocationQueue.quarantined_at.isnot(None)
+    )
+    if entry_ids:
+        query = query.where(OfflineLocationQueue.id.in_(entry_ids))
+
+    count = db.session.execute(query.values(
+        quarantined_at=None,
+        attempts=0,
+        visible_at=datetime.utcnow()
+    )).rowcount
+    db.session.commit()
+    return count
+
+class OfflineQueueDrainer:
+    """At-least-once replay of the spill queue into driver_locations.
+
+    Each batch claims up to OFFLINE_QUEUE_BATCH_SIZE entries in timestamp
+    order by moving their `visible_at` one visibility timeout ahead, so an
+    entry whose worker dies mid-batch becomes claimable again on its own.
+    Claimed entries are stored with the regular insert-or-ignore ingest, so a
+    replayed entry is never stored twice, then acknowledged. An entry that
+    fails OFFLINE_QUEUE_MAX_ATTEMPTS times is quarantined. Full batches are
+    drained back to back, so a backlog clears at batch-insert speed.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._failures = 0
+        self._retry_at = 0
+        self._purged_at = 0
+        self.stats = {
+            'spilled': 0,
+            'spill_failed': 0,
+            'replayed': 0,
+            'duplicates': 0,
+            'failed': 0,
+            'quarantined': 0,
+            'batches': 0,
+            'last_drain_at': None,
+            'last_error': None
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = OFFLINE_QUEUE_ENABLED
+
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='offline-queue-drainer', daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['enabled'] = self.enabled
+        stats.update(get_queue_depth())
+        if stats['last_drain_at']:
+            stats['last_drain_at'] = stats['last_drain_at'].isoformat()
+        return stats
+
+    def _run(self):
+        while not self._stop.wait(OFFLINE_QUEUE_INTERVAL_MS / 1000.0):
+            with self.app.app_context():
+                try:
+                    while self.drain_once() >= OFFLINE_QUEUE_BATCH_SIZE and not self._stop.is_set():
+                        pass
+                    self._purge()
+                except Exception as e:
+                    db.session.rollback()
+                    self.stats['last_error'] = str(e)
+                    print(f"Offline queue drain error: {str(e)}")
+
+    def drain_once(self):
+        """Claim, replay and acknowledge one batch inside an app context. Returns the number claimed."""
+        if time.monotonic() < self._retry_at:
+            return 0
+
+        entries = self._claim()
+        if not entries:
+            return 0
+
+        replayable = []
+        for entry in entries:
+            if entry.attempts > OFFLINE_QUEUE_MAX_ATTEMPTS:
+                # Claimed before but never acknowledged or failed: it stops the worker
+                self._quarantine(entry, entry.last_error or 'Delivery attempts exhausted')
+                continue
+
+            try:
+                replayable.append((entry, decode_location(entry.location_data)))
+            except (TypeError, ValueError) as e:
+                self._quarantine(entry, f'Unreadable location: {str(e)}')
+
+        try:
+            acked = self._replay(replayable)
+        except OperationalError as e:
+            # Database unavailable: hand the batch back without using up attempts
+            db.session.rollback()
+            self._release([entry.id for entry, _ in replayable])
+            self._back_off(e)
+            return 0
+
+        self._ack(acked)
+        self._failures = 0
+        self.stats['batches'] += 1
+        self.stats['last_drain_at'] = datetime.utcnow()
+        return len(entries)
+
+    def _claim(self):
+        now = datetime.utcnow()
+        # The new visible_at doubles as this claim's token
+        deadline = now + timedelta(seconds=OFFLINE_QUEUE_VISIBILITY_TIMEOUT_S)
+        claimable = and_(
+            OfflineLocationQueue.processed == False,
+            OfflineLocationQueue.quarantined_at.is_(None),
+            OfflineLocationQueue.visible_at <= now
+        )
+
+        entry_ids = db.session.execute(
+            select(OfflineLocationQueue.id).where(claimable).order_by(
+                OfflineLocationQueue.timestamp, OfflineLocationQueue.id
+            ).limit(OFFLINE_QUEUE_BATCH_SIZE)
+        ).scalars().all()
+        if not entry_ids:
+            db.session.rollback()
+            return []
+
+        # Re-check visibility so a concurrent drainer's claim is never taken over
+        db.session.execute(update(OfflineLocationQueue).where(
+            OfflineLocationQueue.id.in_(entry_ids), claimable
+        ).values(visible_at=deadline, attempts=OfflineLocationQueue.attempts + 1))
+        db.session.commit()
+
+        # Plain rows, not ORM objects, so the commits that follow never reload them
+        return db.session.execute(select(
+            OfflineLocationQueue.id,
+            OfflineLocationQueue.attempts,
+            OfflineLocationQueue.last_error,
+            OfflineLocationQueue.location_data
+        ).where(
+            OfflineLocationQueue.id.in_(entry_ids),
+            OfflineLocationQueue.visible_at == deadline
+        ).order_by(OfflineLocationQueue.timestamp, OfflineLocationQueue.id)).all()
+
+    def _replay(self, replayable):
+        """Store the batch in one transaction; on a data error, isolate the bad entries one by one"""
+        if not replayable:
+            return []
+
+        try:
+            inserted, duplicates = ingest_locations([row for _, row in replayable])
+            self.stats['replayed'] += len(inserted)
+            self.stats['duplicates'] += duplicates
+            return [entry.id for entry, _ in replayable]
+        except OperationalError:
+            raise
+        except Exception:
+            db.session.rollback()
+
+        acked = []
+        for entry, row in replayable:
+            try:
+                inserted, duplicates = ingest_locations([row])
+                self.stats['replayed'] += len(inserted)
+                self.stats['duplicates'] += duplicates
+                acked.append(entry.id)
+            except OperationalError:
+                raise
+            except Exception as e:
+                db.session.rollback()
+                self._fail(entry, e)
+
+        return acked
+
+    def _ack(self, entry_ids):
+        if not entry_ids:
+            return
+
+        db.session.execute(update(OfflineLocationQueue).where(
+            OfflineLocationQueue.id.in_(entry_ids)
+        ).values(processed=True, last_error=None))
+        db.session.commit()
+
+    def _fail(self, entry, error):
+        """Record a failed replay; the entry is retried once its visibility timeout passes"""
+        self.stats['failed'] += 1
+        if entry.attempts >= OFFLINE_QUEUE_MAX_ATTEMPTS:
+            self._quarantine(entry, str(error))
+            return
+
+        db.session.execute(update(OfflineLocationQueue).where(
+            OfflineLocationQueue.id == entry.id
+        ).values(last_error=str(error)))
+        db.session.commit()
+
+    def _quarantine(self, entry, error):
+        db.session.execute(update(OfflineLocationQueue).where(
+            OfflineLocationQueue.id == entry.id
+        ).values(quarantined_at=datetime.utcnow(), last_error=error))
+        db.session.commit()
+        self.stats['quarantined'] += 1
+
+    def _release(self, entry_ids):
+        """Make claimed entries visible again and refund their attempt, best effort"""
+        if not entry_ids:
+            return
+
+        try:
+            db.session.execute(update(OfflineLocationQueue).where(
+                OfflineLocationQueue.id.in_(entry_ids)
+            ).values(visible_at=datetime.utcnow(), attempts=OfflineLocationQueue.attempts - 1))
+            db.session.commit()
+        except OperationalError:
+            # The claim simply expires after the visibility timeout
+            db.session.rollback()
+
+    def _back_off(self, error):
+        """Exponential backoff after the database refused a batch, capped at OFFLINE_QUEUE_BACKOFF_MAX_MS"""
+        self._failures += 1
+        delay_ms = min(OFFLINE_QUEUE_INTERVAL_MS * (2 ** (self._failures - 1)), OFFLINE_QUEUE_BACKOFF_MAX_MS)
+        self._retry_at = time.monotonic() + delay_ms / 1000.0
+        self.stats['last_error'] = str(error)
+
+    def _purge(self):
+        """Delete acknowledged entries spilled over OFFLINE_QUEUE_RETENTION_HOURS ago, once a minute"""
+        if time.monotonic() - self._purged_at < 60:
+            return
+
+        self._purged_at = time.monotonic()
+        db.session.execute(delete(OfflineLocationQueue).where(
+            OfflineLocationQueue.processed == True,
+            OfflineLocationQueue.created_at < datetime.utcnow() - timedelta(hours=OFFLINE_QUEUE_RETENTION_HOURS)
+        ))
+        db.session.commit()
+
+offline_queue = OfflineQueueDrainer()
@@ -0,0 +1,258 @@
+import os
+import json
+import threading
+from datetime import datetime
+from sqlalchemy import and_, func, select
+from src.models.location import db, DriverLocation
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Shared backend for the last-known-position cache. Unset keeps the cache in
+# process, which is exact for a single worker; with several workers each one
+# only sees its own ingests, so point them all at one Redis.
+LAST_POSITION_REDIS_URL = os.getenv('LAST_POSITION_REDIS_URL', '')
+LAST_POSITION_REDIS_KEY = os.getenv('LAST_POSITION_REDIS_KEY', 'tracking:last_position')
+
+# Most drivers one GET /api/location/latest call may ask for
+LATEST_MAX_DRIVERS = int(os.getenv('LATEST_MAX_DRIVERS', '500'))
+
+# Columns a last-known position is made of: every DriverLocation.to_dict key
+POSITION_COLUMNS = (
+    DriverLocation.id,
+    DriverLocation.driver_id,
+    DriverLocation.timestamp,
+    DriverLocation.seq,
+    DriverLocation.latitude,
+    DriverLocation.longitude,
+    DriverLocation.speed,
+    DriverLocation.heading,
+    DriverLocation.accuracy,
+    DriverLocation.is_offline,
+    DriverLocation.trip_id,
+    DriverLocation.synced_to_frappe,
+    DriverLocation.created_at
+)
+POSITION_FIELDS = tuple(column.key for column in POSITION_COLUMNS)
+
+# Newer-wins write of many positions. KEYS[1] holds position JSON and
+# KEYS[2] the epoch timestamp per driver; ARGV is (driver, epoch, json)*
+REDIS_UPDATE_SCRIPT = """
+local updated = 0
+for i = 1, #ARGV, 3 do
+    local current = redis.call('HGET', KEYS[2], ARGV[i])
+    if not current or tonumber(ARGV[i + 1]) > tonumber(current) then
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+        updated = updated + 1
+    end
+end
+return updated
+"""
+
+# Flag cached positions as synced. KEYS[1] holds position JSON; ARGV is
+# (driver, id)* and a position is only touched while it is still that row
+REDIS_MARK_SYNCED_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local value = redis.call('HGET', KEYS[1], ARGV[i])
+    if value then
+        local position = cjson.decode(value)
+        if position['id'] == tonumber(ARGV[i + 1]) then
+            position['synced_to_frappe'] = true
+            redis.call('HSET', KEYS[1], ARGV[i], cjson.encode(position))
+        end
+    end
+end
+return 0
+"""
+
+def to_position(values):
+    """Position dict from a location row or column values"""
+    position = {field: values.get(field) for field in POSITION_FIELDS}
+    position['timestamp'] = position['timestamp'].isoformat() if position['timestamp'] else None
+    position['created_at'] = position['created_at'].isoformat() if position['created_at'] else None
+    position['is_offline'] = bool(position['is_offline'])
+    position['synced_to_frappe'] = bool(position['synced_to_frappe'])
+    return position
+
+def position_epoch(position):
+    return (datetime.fromisoformat(position['timestamp']) - datetime(1970, 1, 1)).total_seconds()
+
+class LastPositionCache:
+    """Latest position per driver, kept current by ingest.
+
+    Writes only ever move a driver forward in time, so offline replays of old
+    points never overwrite a newer position. Drivers not yet cached are read
+    from the history table once, all in one query, and cached from then on.
+    """
+
+    def __init__(self, app=None):
+        self._positions = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_update = None
+        self._redis_mark_synced = None
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'updates': 0,
+            'stale_updates': 0
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not LAST_POSITION_REDIS_URL:
+            return
+
+        if redis is None:
+            print("LAST_POSITION_REDIS_URL is set but redis is not installed; using the in-process cache")
+            return
+
+        self._redis = redis.Redis.from_url(LAST_POSITION_REDIS_URL)
+        self._redis_update = self._redis.register_script(REDIS_UPDATE_SCRIPT)
+        self._redis_mark_synced = self._redis.register_script(REDIS_MARK_SYNCED_SCRIPT)
+
+    def update(self, rows):
+        """Record ingested location rows (dicts of DriverLocation column values).
+
+        Call after the rows are committed. Only each driver's newest row is
+        considered, and it only replaces a cached position that is older.
+        """
+        newest = {}
+        for row in rows:
+            current = newest.get(row['driver_id'])
+            if current is None or row['timestamp'] > current['timestamp']:
+                newest[row['driver_id']] = row
+
+        self._store([to_position(row) for row in newest.values()])
+
+    def mark_synced(self, synced_ids):
+        """Record {driver_id: [location id]} as pushed to Frappe.
+
+        Call after the sync commit, so cached positions report the same
+        `synced_to_frappe` as the history table.
+        """
+        cached = self._lookup(list(synced_ids))
+        marked = [
+            (driver_id, position['id']) for driver_id, position in cached.items()
+            if not position.get('synced_to_frappe') and position.get('id') in synced_ids[driver_id]
+        ]
+        if not marked:
+            return
+
+        if self._redis is not None:
+            args = []
+            for driver_id, location_id in marked:
+                args.extend((driver_id, location_id))
+            self._redis_mark_synced(keys=[LAST_POSITION_REDIS_KEY], args=args)
+            return
+
+        with self._lock:
+            for driver_id, location_id in marked:
+                position = self._positions.get(driver_id)
+                if position is not None and position['id'] == location_id:
+                    self._positions[driver_id] = dict(position, synced_to_frappe=True)
+
+    def get(self, driver_id):
+        return self.get_many([driver_id]).get(driver_id)
+
+    def get_many(self, driver_ids):
+        """{driver_id: position} for the drivers that have ever reported"""
+        found = self._lookup(driver_ids)
+        missing = [driver_id for driver_id in driver_ids if driver_id not in found]
+
+        self.stats['hits'] += len(found)
+        self.stats['misses'] += len(missing)
+
+        if missing:
+            loaded = load_positions(missing)
+            self._store(list(loaded.values()))
+            # Re-read so a newer ingest that raced the load wins
+            found.update(self._lookup(list(loaded)))
+
+        return found
+
+    def clear(self):
+        with self._lock:
+            self._positions.clear()
+
+        if self._redis is not None:
+            self._redis.delete(LAST_POSITION_REDIS_KEY, LAST_POSITION_REDIS_KEY + ':ts')
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['backend'] = 'redis' if self._redis is not None else 'memory'
+        if self._redis is None:
+            stats['drivers'] = len(self._positions)
+        return stats
+
+    def _lookup(self, driver_ids):
+        if not driver_ids:
+            return {}
+
+        if self._redis is not None:
+            values = self._redis.hmget(LAST_POSITION_REDIS_KEY, driver_ids)
+            return {
+                driver_id: json.loads(value)
+                for driver_id, value in zip(driver_ids, values) if value is not None
+            }
+
+        with self._lock:
+            return {
+                driver_id: self._positions[driver_id]
+                for driver_id in driver_ids if driver_id in self._positions
+            }
+
+    def _store(self, positions):
+        if not positions:
+            return
+
+        if self._redis is not None:
+            args = []
+            for position in positions:
+                args.extend((position['driver_id'], position_epoch(position), json.dumps(position)))
+            updated = self._redis_update(keys=[LAST_POSITION_REDIS_KEY, LAST_POSITION_REDIS_KEY + ':ts'], args=args)
+        else:
+            updated = 0
+            with self._lock:
+                for position in positions:
+                    current = self._positions.get(position['driver_id'])
+                    if current is None or position_epoch(position) > position_epoch(current):
+                        self._positions[position['driver_id']] = position
+                        updated += 1
+
+        self.stats['updates'] += updated
+        self.stats['stale_updates'] += len(positions) - updated
+
+def load_positions(driver_ids):
+    """Latest stored position of each driver, in one query.
+
+    The per-driver MAX(timestamp) is read from the (driver_id, timestamp, id)
+    index; rows sharing the newest timestamp resolve to the highest id.
+    """
+    rows = db.session.execute(latest_positions_query(driver_ids)).all()
+
+    newest = {}
+    for row in rows:
+        if row.driver_id not in newest or row.id > newest[row.driver_id].id:
+            newest[row.driver_id] = row
+
+    return {driver_id: to_position(row._mapping) for driver_id, row in newest.items()}
+
+def latest_positions_query(driver_ids):
+    """Rows at each driver's MAX(timestamp); more than one per driver on a tie"""
+    latest = select(
+        DriverLocation.driver_id,
+        func.max(DriverLocation.timestamp).label('timestamp')
+    ).where(DriverLocation.driver_id.in_(driver_ids)).group_by(DriverLocation.driver_id).subquery()
+
+    return select(*POSITION_COLUMNS).join(latest, and_(
+        DriverLocation.driver_id == latest.c.driver_id,
+        DriverLocation.timestamp == latest.c.timestamp
+    ))
+
+position_cache = LastPositionCache()